@@ -0,0 +1,143 @@
+"""BERTの学習設定(精度、勾配累積、オプティマイザ、勾配チェックポイント)ごとに、学習のスループットとピークメモリを測る
+
+ピークメモリを設定ごとに分けて測るため、各設定は別のプロセスで実行する。
+実効バッチサイズ(バッチサイズ * 勾配累積)はどの設定でも同じにする。
+
+    python benchmarks/bench_bert_training.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --batch-size 32
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import rootutils
+import torch
+from lightning.pytorch import Callback, Trainer
+from torch.utils.data import DataLoader, Dataset
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.models.bert_module import BertForSequenceClassificationMultiLabel_pl
+
+# 設定名: (precision, 勾配累積, optimizer, warmup_ratio, 勾配チェックポイント)
+SETTINGS = {
+    "fp32_adam": ("32-true", 1, "adam", None, False),
+    "bf16_adam": ("bf16-mixed", 1, "adam", None, False),
+    "bf16_adamw_warmup": ("bf16-mixed", 1, "adamw", 0.1, False),
+    "bf16_adamw_accum4": ("bf16-mixed", 4, "adamw", 0.1, False),
+    "bf16_adamw_accum4_ckpt": ("bf16-mixed", 4, "adamw", 0.1, True),
+}
+
+
+class RandomTokens(Dataset):
+    """固定長のランダムなトークン列とラベル"""
+
+    def __init__(self, n: int, seq_len: int, vocab_size: int, num_labels: int) -> None:
+        generator = torch.Generator().manual_seed(0)
+        self.input_ids = torch.randint(5, vocab_size, (n, seq_len), generator=generator)
+        self.labels = torch.randint(0, 2, (n, num_labels), generator=generator)
+
+    def __len__(self) -> int:
+        return len(self.input_ids)
+
+    def __getitem__(self, i: int) -> dict[str, torch.Tensor]:
+        return {
+            "input_ids": self.input_ids[i],
+            "attention_mask": torch.ones_like(self.input_ids[i]),
+            "token_type_ids": torch.zeros_like(self.input_ids[i]),
+            "labels": self.labels[i],
+        }
+
+
+class Throughput(Callback):
+    """最初のwarmup回のバッチを除いた、1秒あたりの学習サンプル数を測る"""
+
+    def __init__(self, warmup: int) -> None:
+        self.warmup = warmup
+        self.n_samples = 0
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        if batch_idx == self.warmup:
+            self.start = time.perf_counter()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        if batch_idx >= self.warmup:
+            self.n_samples += len(batch["input_ids"])
+            self.elapsed = time.perf_counter() - self.start
+
+
+def run_setting(args: argparse.Namespace) -> dict[str, float]:
+    precision, accumulate, optimizer, warmup_ratio, checkpointing = SETTINGS[args.setting]
+    micro_batch = args.batch_size // accumulate
+    model = BertForSequenceClassificationMultiLabel_pl(
+        args.model_name,
+        num_labels=args.num_labels,
+        lr=5e-5,
+        optimizer=optimizer,
+        weight_decay=0.01,
+        warmup_ratio=warmup_ratio,
+        gradient_checkpointing=checkpointing,
+    )
+    vocab_size = model.bert_scml.bert.config.vocab_size
+    n_batches = args.warmup + args.steps * accumulate
+    dataset = RandomTokens(n_batches * micro_batch, args.seq_len, vocab_size, args.num_labels)
+    throughput = Throughput(args.warmup)
+    accelerator = "gpu" if torch.cuda.is_available() else "cpu"
+    with tempfile.TemporaryDirectory() as tmp:
+        trainer = Trainer(
+            max_epochs=1,
+            accelerator=accelerator,
+            devices=1,
+            precision=precision,
+            accumulate_grad_batches=accumulate,
+            logger=False,
+            enable_checkpointing=False,
+            enable_progress_bar=False,
+            enable_model_summary=False,
+            default_root_dir=tmp,
+            callbacks=[throughput],
+        )
+        if accelerator == "gpu":
+            torch.cuda.reset_peak_memory_stats()
+        trainer.fit(model, DataLoader(dataset, batch_size=micro_batch))
+
+    if accelerator == "gpu":
+        peak_mb = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        # Linuxではru_maxrssはKB単位
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"samples_per_sec": throughput.n_samples / throughput.elapsed, "peak_mb": peak_mb}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--batch-size", type=int, default=32, help="実効バッチサイズ")
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--num-labels", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=10, help="計測するオプティマイザのステップ数")
+    parser.add_argument("--warmup", type=int, default=2, help="計測前に学習するバッチ数")
+    parser.add_argument("--settings", nargs="+", default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument("--setting", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.setting:
+        print(json.dumps(run_setting(args)))
+        return
+
+    for setting in args.settings:
+        result = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--setting", setting],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        metrics = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{setting:>24}: {metrics['samples_per_sec']:8.1f} samples/sec  peak {metrics['peak_mb']:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
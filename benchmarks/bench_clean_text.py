@@ -0,0 +1,48 @@
+"""要約の整形処理(map_elements版と式版)の行/秒の比較
+
+出力が一致することはtests/test_clean_text.pyで確認する
+
+    python benchmarks/bench_clean_text.py --rows 200000
+"""
+import argparse
+import time
+
+import polars as pl
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import clean_text, extract_dataframe, get_fi_list
+from tests.helpers.data import make_frame
+
+
+def extract_dataframe_map_elements(df: pl.DataFrame) -> pl.DataFrame:
+    """従来のmap_elementsによる実装"""
+    return df.select([
+        pl.col("要約").map_elements(clean_text, return_dtype=pl.String).alias("summary"),
+        pl.col("FI").map_elements(get_fi_list, return_dtype=pl.String).alias("FI"),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+
+    start = time.perf_counter()
+    extract_dataframe_map_elements(df)
+    elapsed_map = time.perf_counter() - start
+
+    start = time.perf_counter()
+    extract_dataframe(df)
+    elapsed_expr = time.perf_counter() - start
+
+    print(f"rows: {args.rows}")
+    print(f"map_elements: {args.rows / elapsed_map:,.0f} rows/sec")
+    print(f"expressions : {args.rows / elapsed_expr:,.0f} rows/sec ({elapsed_map / elapsed_expr:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""BERTの学習ステップを、eagerとtorch.compile(動的な形状 / 系列長を丸めた静的な形状)で比べる
+
+系列長がバッチごとに変わる(動的パディング)状況で、コンパイルを含む最初のwarmupステップの時間と、
+その後の1ステップあたりの時間を測る。
+
+    python benchmarks/bench_compile.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking
+"""
+import argparse
+import time
+
+import rootutils
+import torch
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.components.batching import pad_to_longest
+from src.models.bert_module import BertForSequenceClassificationMultiLabel, enable_compile_compat
+
+
+def make_batches(n: int, batch_size: int, max_length: int, vocab_size: int, seed: int = 0) -> list[dict[str, torch.Tensor]]:
+    """max_lengthまでパディングした、バッチごとに系列長の異なるバッチを作る"""
+    generator = torch.Generator().manual_seed(seed)
+    batches = []
+    for _ in range(n):
+        lengths = torch.randint(16, max_length + 1, (batch_size,), generator=generator)
+        mask = (torch.arange(max_length) < lengths[:, None]).long()
+        batches.append({
+            "input_ids": torch.randint(5, vocab_size, (batch_size, max_length), generator=generator) * mask,
+            "attention_mask": mask,
+            "token_type_ids": torch.zeros_like(mask),
+            "labels": torch.randint(0, 2, (batch_size, 1), generator=generator),
+        })
+    return batches
+
+
+def run(model: torch.nn.Module, batches: list[dict[str, torch.Tensor]], warmup: int) -> tuple[float, float, float]:
+    """学習ステップを実行し、最初のwarmupステップの合計時間と、その後のステップ時間の中央値・最大値を返す
+
+    warmup後に初めて現れた系列長で再コンパイルが起きると最大値に表れる
+    """
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    times = []
+    for batch in batches:
+        start = time.perf_counter()
+        loss = model(**batch).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        times.append(time.perf_counter() - start)
+    steady = sorted(times[warmup:])
+    return sum(times[:warmup]), steady[len(steady) // 2], steady[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--pad-to-multiple-of", type=int, default=32)
+    args = parser.parse_args()
+
+    vocab_size = BertForSequenceClassificationMultiLabel(args.model_name, 1).bert.config.vocab_size
+    raw = make_batches(args.steps, args.batch_size, args.max_length, vocab_size)
+    settings = {
+        "eager": (None, [pad_to_longest(dict(b)) for b in raw]),
+        "compile dynamic": (True, [pad_to_longest(dict(b)) for b in raw]),
+        f"compile static (x{args.pad_to_multiple_of})": (
+            False,
+            [pad_to_longest(dict(b), pad_to_multiple_of=args.pad_to_multiple_of) for b in raw],
+        ),
+    }
+    if not torch._dynamo.is_dynamo_supported():
+        print("torch.compile is not supported in this environment (PyTorch 2.2 on Python 3.12+); running eager only.")
+        settings = {"eager": settings["eager"]}
+
+    for name, (dynamic, batches) in settings.items():
+        torch.manual_seed(0)
+        model = BertForSequenceClassificationMultiLabel(args.model_name, 1)
+        if dynamic is not None:
+            torch._dynamo.reset()
+            enable_compile_compat()
+            model.compile(dynamic=dynamic)
+        warmup, median, worst = run(model, batches, args.warmup)
+        print(f"{name:>24}: warmup {warmup:7.2f} sec  steady {median * 1000:8.1f} ms/step (max {worst * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""1台のCPUマシンで、DDP(gloo)のプロセス数を変えてBERTモジュールを学習し、学習のスループットを比べる
+
+プロセスあたりのバッチサイズを固定し(全体のバッチサイズはプロセス数倍)、configs/trainer/ddp_cpu.yamlと同じく
+データモジュールがランクごとにデータを分ける。各ランクのスループットはProfilingCallbackで測り、その合計を
+全体のスループット(samples/sec)とする。各プロセスのtorchのスレッド数はLightningがコア数/プロセス数に設定する。
+
+    python benchmarks/bench_ddp_scaling.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --processes 1 2 4 8
+"""
+import argparse
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import rootutils
+from lightning.pytorch import Trainer, seed_everything
+from lightning.pytorch.strategies import DDPStrategy
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.callbacks.profiling import ProfilingCallback
+from src.data.data import extract_dataframe
+from src.data.patent_datamodule import PatentDataModule
+from src.models.bert_module import BertForSequenceClassificationMultiLabel_pl
+from tests.helpers.data import make_frame
+
+
+def make_datamodule(args: argparse.Namespace, tmp: str, processes: int) -> PatentDataModule:
+    return PatentDataModule(
+        args.model_name,
+        f"{tmp}/processed.parquet",
+        f"{tmp}/processed.parquet",
+        cache_dir=f"{tmp}/cache",
+        batch_size=args.batch_size * processes,
+        num_workers=0,
+    )
+
+
+def fit(args: argparse.Namespace, tmp: str, processes: int) -> list[dict]:
+    """processes個のプロセスで学習し、ランクごとのProfilingCallbackの集計を返す"""
+    seed_everything(0, verbose=False)
+    output_dir = f"{tmp}/profile_{processes}"
+    model = BertForSequenceClassificationMultiLabel_pl(args.model_name, num_labels=1, lr=1e-4)
+    trainer = Trainer(
+        max_epochs=args.epochs,
+        accelerator="cpu",
+        devices=processes,
+        strategy=DDPStrategy(process_group_backend="gloo", start_method="spawn") if processes > 1 else "auto",
+        use_distributed_sampler=False,
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        num_sanity_val_steps=0,
+        limit_val_batches=0,
+        default_root_dir=tmp,
+        callbacks=[ProfilingCallback(output_dir, warmup_steps=args.warmup_steps)],
+    )
+    trainer.fit(model, make_datamodule(args, tmp, processes))
+    paths = sorted(Path(output_dir).glob("profile*.json"))
+    return [json.loads(path.read_text()) for path in paths]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=16, help="プロセスあたりのバッチサイズ")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--warmup-steps", type=int, default=3)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_frame(args.rows).pipe(extract_dataframe).write_parquet(f"{tmp}/processed.parquet")
+        # トークン化のキャッシュを作っておき、各プロセスはそれを読むだけにする
+        datamodule = make_datamodule(args, tmp, 1)
+        datamodule.prepare_data()
+        datamodule.setup()
+        num_train = len(datamodule.data_train)
+
+        baseline = None
+        for processes in args.processes:
+            summaries = fit(args, tmp, processes)
+            assert len(summaries) == processes, len(summaries)
+            # 各ランクは同じステップ数を学習する(勾配の同期で待ち続けない)
+            steps = {summary["steps"] + summary["warmup_steps"] for summary in summaries}
+            batches_per_rank = -(-(-(-num_train // args.batch_size)) // processes)
+            assert steps == {batches_per_rank * args.epochs}, (steps, batches_per_rank)
+
+            throughput = sum(summary["throughput"]["samples_per_sec"] for summary in summaries)
+            baseline = baseline or throughput
+            step_ms = max(summary["phases"]["step"]["p50_ms"] for summary in summaries)
+            print(
+                f"{processes} processes: {throughput:8.1f} samples/sec ({throughput / baseline:4.2f}x)  "
+                f"step p50 {step_ms:7.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
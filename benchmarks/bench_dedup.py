@@ -0,0 +1,69 @@
+"""MinHash/LSHによる近似重複の検出の時間と再現率を、テキスト数を倍にしながら測る
+
+ランダムな文字列に、数文字だけ置き換えた近似重複を混ぜて検出できるかを確認する。
+テキスト数を倍にしたときに時間がほぼ倍で済む(全ての組を比べる2乗のオーダーにならない)ことも確認する。
+
+    python benchmarks/bench_dedup.py --texts 50000 --workers 1 4
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.components.dedup import group_split, lsh_clusters, minhash_signatures
+
+_ALPHABET = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def make_texts(n_texts: int, n_duplicates: int, seed: int = 0) -> list[str]:
+    """ランダムな要約と、その先頭n_duplicates件の文字を数か所だけ置き換えたコピーを作る"""
+    rng = random.Random(seed)
+    texts = ["".join(rng.choices(_ALPHABET, k=rng.randint(150, 300))) for _ in range(n_texts)]
+    for text in texts[:n_duplicates]:
+        chars = list(text)
+        for _ in range(3):
+            chars[rng.randrange(len(chars))] = rng.choice(_ALPHABET)
+        texts.append("".join(chars))
+    return texts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=20_000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    lsh_times = {}
+    for n in (args.texts, args.texts * 2):
+        n_duplicates = int(n * args.duplicate_ratio)
+        texts = make_texts(n, n_duplicates)
+        for workers in args.workers:
+            start = time.perf_counter()
+            signatures = minhash_signatures(texts, num_workers=workers)
+            print(f"{len(texts):>8} texts, {workers} workers: signatures {time.perf_counter() - start:7.2f} sec")
+
+        start = time.perf_counter()
+        clusters = lsh_clusters(signatures)
+        lsh_times[n] = time.perf_counter() - start
+        recall = (clusters[n:] == np.arange(n_duplicates)).mean()
+        # 元のテキスト同士は重複ではないので、クラスタ数は元のテキスト数になるのが理想
+        false_merges = n - len(np.unique(clusters[:n]))
+        print(f"{len(texts):>8} texts: LSH {lsh_times[n]:7.2f} sec  recall {recall:.3f}  false merges {false_merges}")
+
+        train, val = group_split(clusters, val_fraction=0.3, seed=0)
+        assert not np.isin(clusters[train], clusters[val]).any()
+        assert recall > 0.9 and false_merges == 0
+
+    ratio = lsh_times[args.texts * 2] / lsh_times[args.texts]
+    print(f"LSH time ratio for 2x texts: {ratio:.2f}")
+    # 全ての組を比べる場合は4倍になる
+    assert ratio < 3.5
+
+
+if __name__ == "__main__":
+    main()
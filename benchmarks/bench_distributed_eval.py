@@ -0,0 +1,53 @@
+"""BERTモジュールのテストを、1プロセスとDDP(gloo)の複数プロセスで実行し、時間と評価指標を比べる
+
+テストデータの件数をプロセス数で割り切れない数にし、最後のバッチも小さくなるようにする。
+サンプルを重複させずにランクごとに分け、指標をエポックの終わりにだけ集約していれば、
+どのプロセス数でも1プロセスと同じ値になる。あわせて、全件の予測から直接求めた正解率とも比べる。
+LightningがDistributedSamplerを差し込む場合(既定)と、データモジュールが系列長のバケットをランクごとに分ける場合
+(use_distributed_sampler=False、configs/trainer/ddp_cpu.yaml)の両方を測る。
+指標が一致することはtests/test_ddp.pyで確認する。
+
+    python benchmarks/bench_distributed_eval.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --rows 1001
+"""
+import argparse
+import tempfile
+
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import extract_dataframe
+from tests.helpers.data import make_frame
+from tests.helpers.distributed import make_datamodule, reference_accuracy, run_test
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=1001)
+    parser.add_argument("--batch-size", type=int, default=48)
+    parser.add_argument("--processes", type=int, nargs="+", default=[2, 3])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_frame(args.rows).pipe(extract_dataframe).write_parquet(f"{tmp}/processed.parquet")
+        # トークン化のキャッシュを作っておき、各プロセスはそれを読むだけにする
+        datamodule = make_datamodule(args.model_name, tmp, args.batch_size)
+        datamodule.prepare_data()
+
+        expected, elapsed = run_test(args.model_name, tmp, args.batch_size, 1)
+        print(f"1 process: {elapsed:7.2f} sec  accuracy {expected['accuracy']:.4f}  auroc {expected['auroc']:.4f}")
+        print(f"reference accuracy {reference_accuracy(args.model_name, tmp, args.batch_size):.4f}")
+
+        for processes in args.processes:
+            for use_distributed_sampler in (True, False):
+                metrics, elapsed = run_test(args.model_name, tmp, args.batch_size, processes, use_distributed_sampler)
+                diff = max(abs(metrics[key] - value) for key, value in expected.items())
+                print(
+                    f"{processes} processes (use_distributed_sampler={use_distributed_sampler}): {elapsed:7.2f} sec  "
+                    f"accuracy {metrics['accuracy']:.4f}  auroc {metrics['auroc']:.4f}  max |diff| {diff:.1e}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""評価・推論の起動時に、チェックポイントからモデルを作るまでの時間を比べる
+
+従来の方法(事前学習済みのBERTをfrom_pretrainedで読み込み、オプティマイザの状態を含むLightningのチェックポイント全体を
+読み込んで上書きする)と、src.utils.checkpoint.load_model(設定だけから骨組みを作り、重みだけのsafetensorsを
+メモリマップして読み込む)を、それぞれ新しいプロセスで測る。どちらも同じ出力になることも確認する。
+
+    python benchmarks/bench_eval_cold_start.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+import rootutils
+import torch
+from omegaconf import OmegaConf
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.models.bert_module import BertForSequenceClassificationMultiLabel_pl
+from src.utils.checkpoint import load_model, save_weights, weights_path
+
+TARGET = "src.models.bert_module.BertForSequenceClassificationMultiLabel_pl"
+
+
+def make_checkpoint(model_name: str, path: Path) -> None:
+    """Adamで1ステップ更新したモデルから、Lightningと同じ形式のチェックポイントを作る"""
+    torch.manual_seed(0)
+    model = BertForSequenceClassificationMultiLabel_pl(model_name, num_labels=1, lr=1e-5)
+    optimizer = model.configure_optimizers()
+    ids = torch.randint(5, model.bert_scml.bert.config.vocab_size, (2, 32))
+    model.bert_scml(input_ids=ids, attention_mask=torch.ones_like(ids), labels=torch.ones(2, 1)).loss.backward()
+    optimizer.step()
+    torch.save(
+        {"state_dict": model.state_dict(), "optimizer_states": [optimizer.state_dict()], "hyper_parameters": dict(model.hparams)},
+        path,
+    )
+
+
+def cold_start(mode: str, model_name: str, path: str) -> tuple[float, torch.Tensor]:
+    """新しいプロセスでモデルを作って重みを読み込み、かかった時間と固定の入力に対するlogitsを返す"""
+    torch.set_num_threads(1)
+    start = time.perf_counter()
+    if mode == "full":
+        model = BertForSequenceClassificationMultiLabel_pl(model_name, num_labels=1, lr=1e-5)
+        model.load_state_dict(torch.load(path, map_location="cpu")["state_dict"])
+    else:
+        cfg = OmegaConf.create({"_target_": TARGET, "model_name": model_name, "num_labels": 1, "lr": 1e-5})
+        model = load_model(cfg, path)
+    elapsed = time.perf_counter() - start
+
+    model.eval()
+    generator = torch.Generator().manual_seed(0)
+    ids = torch.randint(5, model.bert_scml.bert.config.vocab_size, (4, 64), generator=generator)
+    with torch.no_grad():
+        logits = model.bert_scml(input_ids=ids, attention_mask=torch.ones_like(ids)).logits
+    return elapsed, logits
+
+
+def measure(mode: str, model_name: str, path: Path, repeats: int) -> tuple[float, torch.Tensor]:
+    """repeats回測り、最小の時間と出力を返す"""
+    results = []
+    for _ in range(repeats):
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results.append(pool.apply(cold_start, (mode, model_name, str(path))))
+    return min(elapsed for elapsed, _ in results), results[0][1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ckpt_path = Path(tmp) / "full" / "best-checkpoint.ckpt"
+        ckpt_path.parent.mkdir()
+        make_checkpoint(args.model_name, ckpt_path)
+        state_dict = torch.load(ckpt_path, map_location="cpu")["state_dict"]
+        fp32_path = Path(tmp) / "fp32" / "best-checkpoint.safetensors"
+        fp16_path = Path(tmp) / "fp16" / "best-checkpoint.safetensors"
+        save_weights(state_dict, fp32_path)
+        save_weights(state_dict, fp16_path, half=True)
+        assert weights_path(ckpt_path).name == fp32_path.name
+
+        baseline, expected = measure("full", args.model_name, ckpt_path, args.repeats)
+        print(f"{'from_pretrained + .ckpt':>26}: {baseline:6.2f} sec  {ckpt_path.stat().st_size / 2**20:7.1f} MiB")
+        for name, path, atol in [("safetensors fp32", fp32_path, 1e-5), ("safetensors fp16", fp16_path, 1e-2)]:
+            elapsed, logits = measure("compact", args.model_name, path, args.repeats)
+            print(
+                f"{name:>26}: {elapsed:6.2f} sec  {path.stat().st_size / 2**20:7.1f} MiB  "
+                f"({baseline / elapsed:4.1f}x)  max |diff| {(logits - expected).abs().max():.2e}"
+            )
+            assert torch.allclose(logits, expected, atol=atol), (logits, expected)
+            assert elapsed < baseline
+
+
+if __name__ == "__main__":
+    main()
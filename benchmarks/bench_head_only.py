@@ -0,0 +1,112 @@
+"""エンコーダを固定して線形層だけを学習するときの1エポックの時間を、毎回エンコーダを通す場合と
+EmbeddingStoreにキャッシュした文書ベクトルを使う場合で比べる
+
+キャッシュを使う場合は、最初の1回だけ文書ベクトルを計算する時間もあわせて表示する。
+
+    python benchmarks/bench_head_only.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --rows 2000
+"""
+import argparse
+import tempfile
+import time
+
+import rootutils
+import torch
+from lightning.pytorch import Callback, Trainer, seed_everything
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.components.batching import pad_to_longest
+from src.data.data import extract_dataframe
+from src.data.patent_datamodule import PatentDataModule
+from src.models.bert_module import BertForSequenceClassificationMultiLabel_pl
+from tests.helpers.data import make_frame
+
+
+class EpochTimer(Callback):
+    """prepare_data(fitの開始からsetupまで)と、学習エポックごとの時間を記録する"""
+
+    def __init__(self) -> None:
+        self.fit_start = time.perf_counter()
+        self.prepare = 0.0
+        self.times: list[float] = []
+
+    def setup(self, trainer, pl_module, stage):
+        self.prepare = time.perf_counter() - self.fit_start
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.start = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        self.times.append(time.perf_counter() - self.start)
+
+
+def fit(
+    args: argparse.Namespace, tmp: str, embedding_cache_dir: str | None
+) -> tuple[EpochTimer, PatentDataModule, BertForSequenceClassificationMultiLabel_pl]:
+    """線形層だけを学習し、時間を記録したEpochTimerとデータモジュール、モデルを返す"""
+    seed_everything(0, verbose=False)
+    datamodule = PatentDataModule(
+        args.model_name,
+        f"{tmp}/processed.parquet",
+        f"{tmp}/processed.parquet",
+        cache_dir=f"{tmp}/cache",
+        batch_size=args.batch_size,
+        num_workers=0,
+        embedding_cache_dir=embedding_cache_dir,
+    )
+    model = BertForSequenceClassificationMultiLabel_pl(args.model_name, num_labels=1, lr=1e-3, freeze_encoder=True)
+    timer = EpochTimer()
+    trainer = Trainer(
+        max_epochs=args.epochs,
+        accelerator="cpu",
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        num_sanity_val_steps=0,
+        limit_val_batches=0,
+        default_root_dir=tmp,
+        callbacks=[timer],
+    )
+    trainer.fit(model, datamodule)
+    return timer, datamodule, model
+
+
+def median(times: list[float]) -> float:
+    return sorted(times)[len(times) // 2]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--epochs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_frame(args.rows).pipe(extract_dataframe).write_parquet(f"{tmp}/processed.parquet")
+        # 1回目はトークン化のキャッシュも作るので、その時間は比べない
+        timer, encoder_data, model = fit(args, tmp, None)
+        encoder_epoch = median(timer.times)
+        print(f"   encoder every epoch: {encoder_epoch:8.3f} sec/epoch")
+        timer, cached_data, _ = fit(args, tmp, f"{tmp}/embeddings")
+        cached_epoch = median(timer.times)
+        print(f" build embedding cache: {timer.prepare:8.3f} sec")
+        print(f"     cached embeddings: {cached_epoch:8.3f} sec/epoch ({encoder_epoch / cached_epoch:.0f}x)")
+        timer, _, _ = fit(args, tmp, f"{tmp}/embeddings")
+        print(f" reuse cache (2nd run): {timer.prepare:8.3f} sec to prepare, {median(timer.times):8.3f} sec/epoch")
+
+        # キャッシュした文書ベクトルは、float16の丸め誤差の範囲でエンコーダの出力と一致する
+        indices = list(range(min(64, args.rows)))
+        batch = pad_to_longest(encoder_data.data_test.__getitems__(indices))
+        with torch.inference_mode():
+            expected = model.bert_scml.pool(batch["input_ids"], batch["attention_mask"], batch["token_type_ids"])
+        cached = cached_data.data_test.__getitems__(indices)["embeddings"]
+        assert torch.allclose(expected, cached, atol=1e-2, rtol=1e-2), (expected - cached).abs().max()
+        assert torch.equal(batch["labels"], cached_data.data_test.__getitems__(indices)["labels"])
+        assert cached_epoch < encoder_epoch
+
+
+if __name__ == "__main__":
+    main()
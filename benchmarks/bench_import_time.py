@@ -0,0 +1,33 @@
+"""学習・評価のエントリーポイントの起動時のimportの時間を`-X importtime`で測る
+
+`--help`や`--cfg job`(設定の確認だけ)で重いライブラリを読み込まないこと、予算内に収まることは
+tests/test_import_time.pyで確認する
+
+    python benchmarks/bench_import_time.py
+"""
+import argparse
+
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from tests.helpers.import_time import COMMANDS, HEAVY_MODULES, import_profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    for name, command in COMMANDS.items():
+        # ディスクのキャッシュなどによるばらつきを除くため、最小値をとる
+        profiles = [import_profile(command) for _ in range(args.repeats)]
+        import_time = min(profile[0] for profile in profiles)
+        elapsed = min(profile[2] for profile in profiles)
+        modules = profiles[0][1]
+        heavy = sorted(module for module in HEAVY_MODULES if module in modules)
+        print(f"{name:>16}: imports {import_time * 1000:7.1f} ms  total {elapsed * 1000:7.1f} ms  heavy {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""差分前処理(process_incremental)で、初回・変更なし・更新時刻だけの変更・1年分の変更・年の追加の時間を測る
+
+結果が全体を作り直すprocess_streamingと一致することも確認する。
+
+    python benchmarks/bench_incremental_preprocess.py --rows-per-year 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import polars as pl
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import YEARS, process_incremental, process_streaming, read_processed
+from tests.helpers.data import make_frame
+
+
+def timed(label: str, raw_dir: Path, processed_dir: Path, years: list[str]) -> dict:
+    start = time.perf_counter()
+    manifest = process_incremental(raw_dir, processed_dir, years, years[-1:])
+    print(f"{label:>22}: {time.perf_counter() - start:7.2f} sec  rebuilt {manifest['rebuilt']}")
+    return manifest
+
+
+def sorted_frame(path: Path) -> pl.DataFrame:
+    return read_processed(path).sort(pl.all())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows-per-year", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_dir = Path(tmp, "raw")
+        raw_dir.mkdir()
+        for i, year in enumerate([*YEARS, "2025"]):
+            make_frame(args.rows_per_year, seed=i).write_csv(raw_dir / f"patent_deeplearning_{year}.csv")
+        processed_dir = Path(tmp, "processed")
+
+        manifest = timed("first run", raw_dir, processed_dir, YEARS)
+        assert manifest["rebuilt"] == YEARS
+
+        manifest = timed("no changes", raw_dir, processed_dir, YEARS)
+        assert manifest["rebuilt"] == []
+
+        # 内容が同じなら、更新時刻が変わっても作り直さない
+        os.utime(raw_dir / f"patent_deeplearning_{YEARS[0]}.csv")
+        manifest = timed("touch (mtime only)", raw_dir, processed_dir, YEARS)
+        assert manifest["rebuilt"] == []
+
+        make_frame(args.rows_per_year, seed=100).write_csv(raw_dir / f"patent_deeplearning_{YEARS[-1]}.csv")
+        manifest = timed(f"{YEARS[-1]} changed", raw_dir, processed_dir, YEARS)
+        assert manifest["rebuilt"] == [YEARS[-1]]
+
+        years = [*YEARS, "2025"]
+        manifest = timed("2025 added", raw_dir, processed_dir, years)
+        assert manifest["rebuilt"] == ["2025"]
+
+        start = time.perf_counter()
+        process_streaming(raw_dir, Path(tmp, "full"), years, years[-1:])
+        print(f"{'full rebuild':>22}: {time.perf_counter() - start:7.2f} sec")
+        for split in ("train", "test"):
+            assert sorted_frame(processed_dir / split).equals(sorted_frame(Path(tmp, "full", split))), split
+        assert sum(m["rows"] for m in manifest["years"].values()) == len(read_processed(processed_dir / "train"))
+
+
+if __name__ == "__main__":
+    main()
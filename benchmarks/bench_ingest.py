@@ -0,0 +1,63 @@
+"""複数年の前処理(従来のread_csv版とストリーミング版)のピークメモリ(RSS)の比較
+
+    python benchmarks/bench_ingest.py --rows-per-year 200000
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import YEARS, read_processed
+from tests.helpers.data import make_frame
+
+
+_MEASURE = (
+    "import resource, subprocess, sys;"
+    "subprocess.run(sys.argv[1:], check=True);"
+    "print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)"
+)
+
+
+def run_mode(raw_dir: Path, processed_dir: Path, years: list[str], eager: bool) -> tuple[float, float]:
+    """前処理を子プロセスで実行し、経過時間とピークRSS(MB)を返す"""
+    processed_dir.mkdir(parents=True, exist_ok=True)
+    cmd = [sys.executable, "-m", "src.data.data", "--raw-dir", str(raw_dir), "--processed-dir", str(processed_dir)]
+    cmd += ["--years", *years, "--test-years", years[-1]]
+    if eager:
+        cmd.append("--eager")
+    start = time.perf_counter()
+    # 計測用のプロセスを挟み、前処理プロセスだけのmaxrss(KB)を取得する
+    result = subprocess.run([sys.executable, "-c", _MEASURE, *cmd], check=True, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, int(result.stdout.split()[-1]) / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows-per-year", type=int, default=100_000)
+    parser.add_argument("--n-years", type=int, default=len(YEARS), help="年数を増やしたときのピークメモリの伸びを確認する")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_dir = Path(tmp, "raw")
+        raw_dir.mkdir()
+        years = [str(2024 - i) for i in reversed(range(args.n_years))]
+        for i, year in enumerate(years):
+            make_frame(args.rows_per_year, seed=i).write_csv(raw_dir / f"patent_deeplearning_{year}.csv")
+
+        for name, eager in [("eager (read_csv + concat)", True), ("streaming (scan_csv + sink)", False)]:
+            processed_dir = Path(tmp, name.split()[0])
+            elapsed, peak_mb = run_mode(raw_dir, processed_dir, years, eager)
+            suffix = ".csv" if eager else ""
+            n_train = len(read_processed(f"{processed_dir}/train{suffix}"))
+            print(f"{name:30s}: {elapsed:6.1f} s, peak RSS {peak_mb:8.1f} MB, train rows {n_train}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""モデルを使わずにPatentDataModuleのDataLoaderだけを回し、入力パイプラインのスループットを測る
+
+    python benchmarks/bench_loader.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --rows 50000
+"""
+import argparse
+import tempfile
+import time
+
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import extract_dataframe
+from src.data.patent_datamodule import PatentDataModule
+from tests.helpers.data import make_frame
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--epochs", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_frame(args.rows).pipe(extract_dataframe).write_parquet(f"{tmp}/processed.parquet")
+        for num_workers in args.num_workers:
+            datamodule = PatentDataModule(
+                args.model_name,
+                f"{tmp}/processed.parquet",
+                f"{tmp}/processed.parquet",
+                cache_dir=f"{tmp}/cache",
+                batch_size=args.batch_size,
+                num_workers=num_workers,
+                persistent_workers=num_workers > 0,
+                prefetch_factor=4 if num_workers > 0 else None,
+            )
+            datamodule.prepare_data()
+            datamodule.setup()
+            loader = datamodule.train_dataloader()
+
+            # 1エポック目はワーカーの起動を含むため、2エポック目以降の定常状態も別に出す
+            for epoch in range(args.epochs):
+                n_samples = 0
+                start = time.perf_counter()
+                for batch in loader:
+                    n_samples += len(batch["labels"])
+                elapsed = time.perf_counter() - start
+                print(f"num_workers={num_workers} epoch={epoch}: {n_samples / elapsed:10,.0f} samples/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""ローカルのファイルストアに対して、MLFlowLoggerとBufferedMLFlowLoggerの1ステップあたりのログのコストを比べる
+
+    python benchmarks/bench_mlflow_logger.py --steps 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import rootutils
+from lightning.pytorch.loggers import MLFlowLogger
+from mlflow.tracking import MlflowClient
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.loggers.buffered_mlflow import BufferedMLFlowLogger
+
+# 新しいMLflowはファイルストアの使用に明示的なオプトインを求める
+os.environ.setdefault("MLFLOW_ALLOW_FILE_STORE", "true")
+
+
+def run(logger: MLFlowLogger, steps: int, n_metrics: int) -> tuple[float, float]:
+    """学習ループと同じようにステップごとにlog_metricsを呼び、1ステップあたりの時間とfinalizeの時間を返す"""
+    # runの作成は計測に含めない
+    _ = logger.experiment
+    start = time.perf_counter()
+    for step in range(steps):
+        logger.log_metrics({f"metric_{i}": step * 0.001 + i for i in range(n_metrics)}, step=step)
+    per_step = (time.perf_counter() - start) / steps
+
+    start = time.perf_counter()
+    logger.finalize("success")
+    return per_step, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--metrics", type=int, default=2, help="1ステップあたりのメトリクス数")
+    parser.add_argument("--flush-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracking_uri = f"file:{tmp}/mlruns"
+        loggers = {
+            "MLFlowLogger": MLFlowLogger(tracking_uri=tracking_uri),
+            "BufferedMLFlowLogger": BufferedMLFlowLogger(tracking_uri=tracking_uri, flush_interval=args.flush_interval),
+        }
+        for name, logger in loggers.items():
+            per_step, finalize = run(logger, args.steps, args.metrics)
+
+            # 全ステップのメトリクスが書き出されていることを確認する
+            history = MlflowClient(tracking_uri).get_metric_history(logger.run_id, "metric_0")
+            assert len(history) == args.steps, f"{name}: {len(history)} != {args.steps}"
+            print(f"{name:>22}: {per_step * 1e6:10.1f} us/step  finalize {finalize * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
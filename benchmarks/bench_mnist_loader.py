@@ -0,0 +1,81 @@
+"""MNISTDataModuleのサンプルごとの変換(ToTensor + Normalize)と、メモリ上のuint8のテンソルから
+バッチ単位で切り出して正規化する方法で、DataLoaderだけの1エポックと学習の1エポックの時間を比べる
+
+    python benchmarks/bench_mnist_loader.py --data-dir data/
+"""
+import argparse
+import time
+
+import rootutils
+import torch
+from lightning.pytorch import Trainer
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.mnist_datamodule import MNISTDataModule
+from src.models.components.simple_dense_net import SimpleDenseNet
+from src.models.mnist_module import MNISTLitModule
+
+
+def make_datamodule(args: argparse.Namespace, in_memory: bool) -> MNISTDataModule:
+    datamodule = MNISTDataModule(args.data_dir, batch_size=args.batch_size, in_memory=in_memory)
+    datamodule.prepare_data()
+    datamodule.setup()
+    return datamodule
+
+
+def loader_epoch(datamodule: MNISTDataModule) -> float:
+    """モデルを使わずに学習データのDataLoaderを1周する時間"""
+    start = time.perf_counter()
+    for _ in datamodule.train_dataloader():
+        pass
+    return time.perf_counter() - start
+
+
+def fit_epoch(datamodule: MNISTDataModule) -> float:
+    """SimpleDenseNetを1エポック学習する時間"""
+    model = MNISTLitModule(
+        net=SimpleDenseNet(),
+        optimizer=torch.optim.Adam,
+        scheduler=None,
+        compile=False,
+    )
+    trainer = Trainer(
+        max_epochs=1,
+        accelerator="cpu",
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        limit_val_batches=0,
+    )
+    start = time.perf_counter()
+    trainer.fit(model, datamodule)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default="data/")
+    parser.add_argument("--batch-size", type=int, default=128)
+    args = parser.parse_args()
+
+    per_sample = make_datamodule(args, in_memory=False)
+    in_memory = make_datamodule(args, in_memory=True)
+
+    # 同じ分割で、同じ値に正規化される
+    indices = list(range(0, len(per_sample.data_test), 97))
+    expected = torch.stack([per_sample.data_test[i][0] for i in indices])
+    images, targets = in_memory.data_test.__getitems__(indices)
+    assert torch.allclose(expected, images, atol=1e-5), (expected - images).abs().max()
+    assert targets.tolist() == [per_sample.data_test[i][1] for i in indices]
+
+    results = {}
+    for name, datamodule in [("ToTensor + Normalize", per_sample), ("in-memory uint8", in_memory)]:
+        results[name] = loader_epoch(datamodule), fit_epoch(datamodule)
+        print(f"{name:>22}: loader {results[name][0]:7.2f} sec/epoch  fit {results[name][1]:7.2f} sec/epoch")
+    assert results["in-memory uint8"][0] < results["ToTensor + Normalize"][0]
+
+
+if __name__ == "__main__":
+    main()
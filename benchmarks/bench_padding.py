@@ -0,0 +1,76 @@
+"""動的パディングと系列長バケッティングの有無による学習・評価のスループット(samples/sec, CPU)の比較
+
+    python benchmarks/bench_padding.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --rows 2000
+"""
+import argparse
+import tempfile
+import time
+
+import rootutils
+import torch
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import extract_dataframe
+from src.data.patent_datamodule import PatentDataModule
+from src.models.bert_module import BertForSequenceClassificationMultiLabel
+from tests.helpers.data import make_frame
+
+SETTINGS = {
+    "max_length padding": dict(dynamic_padding=False, length_bucketing=False),
+    "dynamic padding": dict(dynamic_padding=True, length_bucketing=False),
+    "dynamic + bucketing": dict(dynamic_padding=True, length_bucketing=True),
+}
+
+
+def throughput(model: torch.nn.Module, loader, train: bool, max_batches: int) -> float:
+    """max_batches個のバッチを処理し、samples/secを返す"""
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-5)
+    model.train(train)
+    n_samples = 0
+    start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        if i == max_batches:
+            break
+        if train:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+        else:
+            with torch.inference_mode():
+                model(**{k: v for k, v in batch.items() if k != "labels"})
+        n_samples += len(batch["labels"])
+    return n_samples / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-batches", type=int, default=20)
+    args = parser.parse_args()
+
+    model = BertForSequenceClassificationMultiLabel(args.model_name, num_labels=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_frame(args.rows).pipe(extract_dataframe).write_parquet(f"{tmp}/processed.parquet")
+        for name, setting in SETTINGS.items():
+            datamodule = PatentDataModule(
+                args.model_name,
+                f"{tmp}/processed.parquet",
+                f"{tmp}/processed.parquet",
+                cache_dir=f"{tmp}/cache",
+                batch_size=args.batch_size,
+                **setting,
+            )
+            datamodule.prepare_data()
+            datamodule.setup()
+            train = throughput(model, datamodule.train_dataloader(), True, args.max_batches)
+            test = throughput(model, datamodule.test_dataloader(), False, args.max_batches)
+            print(f"{name:22s}: train {train:8.1f} samples/sec, eval {test:8.1f} samples/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""ProfilingCallbackのオーバーヘッドと、フェーズの時間の合計が1ステップの時間と一致することを確認する
+
+1ステップが非常に短いBoringModelで、何もしないコールバックとProfilingCallbackの1ステップあたりの時間を比べる。
+(Lightningがコールバックのフックを呼び出すこと自体のコストは、どのコールバックでもかかるため除く)
+時間はTrainerの準備を除いた学習ループだけで測り、交互に繰り返した実行の中央値どうしを比べる。
+
+    python benchmarks/bench_profiling_callback.py --epochs 10
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+import rootutils
+from lightning.pytorch import Callback, LightningModule, Trainer
+from lightning.pytorch.demos.boring_classes import BoringModel
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.callbacks.profiling import PHASES, ProfilingCallback
+
+
+class LoopTimer(Callback):
+    """学習ループの開始から終了までの時間を測る"""
+
+    def on_train_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self.start = time.perf_counter()
+
+    def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self.elapsed = time.perf_counter() - self.start
+
+
+def fit(callbacks: list[Callback], epochs: int, tmp: str) -> float:
+    """BoringModelを学習し、1ステップあたりの平均時間を返す"""
+    timer = LoopTimer()
+    trainer = Trainer(
+        max_epochs=epochs,
+        accelerator="cpu",
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        default_root_dir=tmp,
+        callbacks=[*callbacks, timer],
+    )
+    trainer.fit(BoringModel())
+    return timer.elapsed / trainer.global_step
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=9)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 実行ごとのばらつき(他のプロセスなど)を抑えるため、交互に繰り返して中央値どうしを比べる
+        baseline, profiled = [], []
+        for _ in range(args.repeats):
+            baseline.append(fit([Callback()], args.epochs, tmp))
+            callback = ProfilingCallback(tmp, warmup_steps=5)
+            profiled.append(fit([callback], args.epochs, tmp))
+        baseline_median = statistics.median(baseline)
+        overhead = statistics.median(profiled) - baseline_median
+        # 実行間のばらつき(何もしないコールバックどうしの差)より小さい差は測れない
+        noise = statistics.median(abs(b - baseline_median) for b in baseline)
+        print(f"no-op callback: {baseline_median * 1e6:8.1f} us/step (+/- {noise * 1e6:.1f})")
+        print(f"profiling:      {statistics.median(profiled) * 1e6:8.1f} us/step (overhead {overhead * 1e6:+.1f} us/step)")
+
+        with open(f"{tmp}/profile.json") as f:
+            summary = json.load(f)
+        for phase in PHASES:
+            stats = summary["phases"][phase]
+            print(f"  {phase:>9}: p50 {stats['p50_ms'] * 1000:8.1f} us  share {stats['share']:6.1%}")
+        print(f"  {summary['throughput']['samples_per_sec']:.0f} samples/sec")
+
+        assert abs(sum(summary["phases"][phase]["share"] for phase in PHASES) - 1.0) < 1e-6
+        assert summary["steps"] == args.epochs * 64 - 5, summary["steps"]
+        # 計時はperf_counterの呼び出しだけなので、何もしないに近いBoringModelのステップでも1割に収まる
+        assert overhead < 0.1 * baseline_median + 2 * noise, (overhead, baseline_median, noise)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""ローカルのファイルストアにrunを作り、runごとにget_runを呼ぶ方法とRunCacheの同期・問い合わせの時間を比べる
+
+main.pyのlistは、つながらないトラッキングURIを渡してもキャッシュだけで結果を返し、MLflowを読み込まないことも確認する。
+
+    python benchmarks/bench_runs.py --runs 2000
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import rootutils
+from mlflow.entities import Metric, Param
+from mlflow.tracking import MlflowClient
+
+ROOT = rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.runs import RunCache, query
+
+# 新しいMLflowはファイルストアの使用に明示的なオプトインを求める
+os.environ.setdefault("MLFLOW_ALLOW_FILE_STORE", "true")
+
+
+def create_runs(client: MlflowClient, experiment_id: str, n_runs: int, seed: int = 0) -> list[str]:
+    """メトリクスとパラメータを持つ終了済みのrunを作る"""
+    rng = random.Random(seed)
+    run_ids = []
+    for _ in range(n_runs):
+        run = client.create_run(experiment_id)
+        now = int(time.time() * 1000)
+        client.log_batch(
+            run.info.run_id,
+            metrics=[Metric(k, rng.random(), now, 0) for k in ("val_loss", "train_loss", "accuracy")],
+            params=[Param("lr", str(rng.choice([1e-5, 3e-5, 1e-4]))), Param("batch_size", str(rng.choice([32, 64])))],
+        )
+        client.set_terminated(run.info.run_id)
+        run_ids.append(run.info.run_id)
+    return run_ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = MlflowClient(f"file:{tmp}/mlruns")
+        experiment_id = client.create_experiment("bench")
+        start = time.perf_counter()
+        run_ids = create_runs(client, experiment_id, args.runs)
+        print(f"created {args.runs} runs in {time.perf_counter() - start:.1f} sec")
+
+        # 従来のmain.pyと同じく、runごとにget_runを呼ぶ
+        start = time.perf_counter()
+        for run_id in run_ids:
+            client.get_run(run_id)
+        print(f"serial get_run:     {time.perf_counter() - start:8.3f} sec")
+
+        cache = RunCache(f"{tmp}/cache", client)
+        start = time.perf_counter()
+        assert cache.experiment_ids(["bench"], refresh=True) == [experiment_id]
+        cache.sync([experiment_id])
+        print(f"first sync:         {time.perf_counter() - start:8.3f} sec")
+
+        create_runs(client, experiment_id, 10, seed=1)
+        start = time.perf_counter()
+        counts = cache.sync([experiment_id])
+        print(f"incremental sync:   {time.perf_counter() - start:8.3f} sec ({counts[experiment_id]} new runs)")
+
+        start = time.perf_counter()
+        df = cache.load([experiment_id])
+        result = query(df, where='"params.lr" = \'1e-05\'', sort_by="val_loss", top=10)
+        elapsed = time.perf_counter() - start
+        print(f"load + query:       {elapsed:8.3f} sec")
+
+        assert len(df) == args.runs + 10, len(df)
+        assert counts[experiment_id] == 10, counts
+        assert result["metrics.val_loss"].is_sorted(), result
+        assert elapsed < 1.0
+
+        # 同期しないlistは、キャッシュした実験名とIDの対応を使い、サーバーに問い合わせない
+        start = time.perf_counter()
+        cli = subprocess.run(
+            [
+                sys.executable, "-X", "importtime", "main.py", "--tracking-uri", "http://127.0.0.1:9",
+                "--cache-dir", f"{tmp}/cache", "list", "-e", "bench", "--sort", "val_loss", "--top", "5",
+            ],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        elapsed = time.perf_counter() - start
+        print(f"main.py list:       {elapsed:8.3f} sec")
+        assert f"{args.runs + 10} cached runs" in cli.stdout, cli.stdout
+        imported = {line.rsplit("|", 1)[-1].strip() for line in cli.stderr.splitlines() if line.startswith("import time:")}
+        assert "mlflow" not in imported, "main.py list imports mlflow"
+        assert elapsed < 1.0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""起動済みの推論サーバー(src/serve.py)に同時接続数を変えてリクエストを送り、レイテンシとスループットを測る
+
+    python src/serve.py ckpt_path=logs/train/runs/.../checkpoints/last.ckpt max_wait_ms=5
+    python benchmarks/bench_serve.py --concurrency 1 8 32 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+import rootutils
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from tests.helpers.data import make_frame
+
+
+async def request(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, method: str, path: str, payload: dict | None = None
+) -> dict:
+    """keep-aliveの接続で1回リクエストを送り、JSONのレスポンスを返す"""
+    body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+
+    status = (await reader.readline()).split(b" ", 2)[1]
+    headers = {}
+    while (line := await reader.readline()) != b"\r\n":
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    data = json.loads(await reader.readexactly(int(headers["content-length"])))
+    if status != b"200":
+        raise RuntimeError(f"{method} {path} failed: {status.decode()} {data}")
+    return data
+
+
+async def client(
+    host: str, port: int, texts: list[str], n_requests: int, texts_per_request: int, latencies: list[float]
+) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = np.random.default_rng(len(latencies))
+    try:
+        for _ in range(n_requests):
+            batch = [texts[i] for i in rng.integers(len(texts), size=texts_per_request)]
+            start = time.perf_counter()
+            await request(reader, writer, host, "POST", "/predict", {"texts": batch})
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run(args: argparse.Namespace, concurrency: int, texts: list[str]) -> None:
+    latencies: list[float] = []
+    per_client = -(-args.requests // concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(args.host, args.port, texts, per_client, args.texts_per_request, latencies) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    metrics = await request(reader, writer, args.host, "GET", "/metrics")
+    writer.close()
+    print(
+        f"concurrency={concurrency:3d}: {len(latencies) / elapsed:8.1f} req/sec "
+        f"{len(latencies) * args.texts_per_request / elapsed:8.1f} texts/sec  "
+        f"p50={p50:7.1f}ms p95={p95:7.1f}ms p99={p99:7.1f}ms  "
+        f"server mean_batch_size={metrics['mean_batch_size']:.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--texts-per-request", type=int, default=1)
+    args = parser.parse_args()
+
+    texts = make_frame(1000)["要約"].to_list()
+    for concurrency in args.concurrency:
+        asyncio.run(run(args, concurrency, texts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Slackの応答が遅い場合の、SlackNotificationCallbackと同期的な送信のエポック時間を比べる
+
+Slackには送信せず、chat_postMessageでdelay秒待つだけのスタブのWebClientに差し替えて計測する。
+通知が全て送られることはtests/test_notifications.pyで確認する
+
+    python benchmarks/bench_slack_callback.py --delay 0.5 --epochs 10
+"""
+import argparse
+import tempfile
+import time
+
+import rootutils
+from lightning.pytorch import Callback, Trainer
+from lightning.pytorch.demos.boring_classes import BoringModel
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.callbacks.notifications import SlackNotificationCallback
+from tests.helpers.slack import StubWebClient
+from tests.helpers.timing import EpochTimer
+
+
+class SyncSlackCallback(Callback):
+    """比較用に、従来どおりフックの中で同期的に送信するCallback"""
+
+    def __init__(self, client: StubWebClient) -> None:
+        self.client = client
+
+    def on_train_start(self, trainer, pl_module):
+        self.client.chat_postMessage(channel="#bench", text="start")
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        self.client.chat_postMessage(channel="#bench", text=f"epoch {trainer.current_epoch + 1}")
+
+    def on_train_end(self, trainer, pl_module):
+        self.client.chat_postMessage(channel="#bench", text="end")
+
+
+def fit(callbacks: list[Callback], epochs: int) -> float:
+    """BoringModelを学習し、(最初のエポックを除いた)1エポックあたりの平均時間を返す"""
+    timer = EpochTimer()
+    with tempfile.TemporaryDirectory() as tmp:
+        trainer = Trainer(
+            max_epochs=epochs,
+            accelerator="cpu",
+            logger=False,
+            enable_checkpointing=False,
+            enable_progress_bar=False,
+            enable_model_summary=False,
+            default_root_dir=tmp,
+            # EpochTimerを最後に呼び、on_train_epoch_endでの送信のブロックをエポックの時間に含める
+            callbacks=[*callbacks, timer],
+        )
+        trainer.fit(BoringModel())
+    return sum(timer.times[1:]) / len(timer.times[1:])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delay", type=float, default=0.5)
+    parser.add_argument("--epochs", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = fit([], args.epochs)
+    print(f"no callback:     {baseline * 1000:8.1f} ms/epoch")
+
+    sync_client = StubWebClient(args.delay)
+    sync = fit([SyncSlackCallback(sync_client)], args.epochs)
+    print(f"synchronous:     {sync * 1000:8.1f} ms/epoch")
+
+    callback = SlackNotificationCallback("xoxb-dummy", "#bench", min_interval=args.delay)
+    callback.client = StubWebClient(args.delay)
+    start = time.perf_counter()
+    background = fit([callback], args.epochs)
+    elapsed = time.perf_counter() - start
+    print(f"background:      {background * 1000:8.1f} ms/epoch")
+    print(f"sent {len(callback.client.messages)} coalesced messages (fit + flush {elapsed:.1f} sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""ハイパーパラメータ探索の試行を並列のプロセスで実行し、MedianPruningCallbackで打ち切った場合と打ち切らない場合の
+学習したエポック数と時間を比べる
+
+試行ごとに検証の損失の曲線(良さ + 1 / (エポック + 1))を決め、1エポックにかかる時間はsleepで模擬する。
+最も良い試行が打ち切られずに最後まで学習することも確認する。
+
+    python benchmarks/bench_sweep_pruning.py --trials 16 --jobs 4 --epochs 10
+"""
+import argparse
+import multiprocessing
+import random
+import tempfile
+import time
+
+import rootutils
+import torch
+from lightning.pytorch import Trainer
+from lightning.pytorch.demos.boring_classes import BoringModel
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.callbacks.pruning import MedianPruningCallback
+
+
+class CurveModel(BoringModel):
+    """検証の損失が決まった曲線をたどるBoringModel"""
+
+    def __init__(self, quality: float, epoch_seconds: float) -> None:
+        super().__init__()
+        self.quality = quality
+        self.epoch_seconds = epoch_seconds
+
+    def validation_step(self, batch, batch_idx):
+        self.log("val_loss", torch.tensor(self.quality + 1.0 / (self.current_epoch + 1)))
+
+    def on_train_epoch_end(self) -> None:
+        time.sleep(self.epoch_seconds)
+
+
+def run_trial(trial: int, quality: float, args: argparse.Namespace, report_dir: str | None) -> tuple[int, int]:
+    """1つの試行を学習し、試行番号と学習したエポック数を返す"""
+    callbacks = []
+    if report_dir is not None:
+        callbacks.append(MedianPruningCallback(report_dir, n_startup_trials=args.jobs, trial_id=f"trial{trial}"))
+    trainer = Trainer(
+        max_epochs=args.epochs,
+        accelerator="cpu",
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        num_sanity_val_steps=0,
+        limit_train_batches=1,
+        limit_val_batches=1,
+        callbacks=callbacks,
+    )
+    trainer.fit(CurveModel(quality, args.epoch_seconds))
+    return trial, trainer.current_epoch
+
+
+def sweep(args: argparse.Namespace, qualities: list[float], report_dir: str | None) -> tuple[dict[int, int], float]:
+    """args.jobs個のプロセスで全ての試行を実行し、試行ごとのエポック数と時間を返す"""
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(args.jobs) as pool:
+        results = pool.starmap(run_trial, [(i, q, args, report_dir) for i, q in enumerate(qualities)])
+    return dict(results), time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trials", type=int, default=16)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--epoch-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    qualities = [rng.random() for _ in range(args.trials)]
+    best = min(range(args.trials), key=qualities.__getitem__)
+
+    full, full_time = sweep(args, qualities, None)
+    with tempfile.TemporaryDirectory() as tmp:
+        pruned, pruned_time = sweep(args, qualities, tmp)
+
+    print(f"  no pruning: {sum(full.values()):4d} epochs  {full_time:6.2f} sec")
+    print(f"with pruning: {sum(pruned.values()):4d} epochs  {pruned_time:6.2f} sec")
+    print(f"pruned trials: {sum(epochs < args.epochs for epochs in pruned.values())}/{args.trials}")
+    assert all(epochs == args.epochs for epochs in full.values())
+    assert pruned[best] == args.epochs, pruned
+    assert sum(pruned.values()) < sum(full.values())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""要約のトークン化(1行ずつのループとプロセスプールによるバッチ処理)の texts/sec の比較
+
+    python benchmarks/bench_tokenize.py --model-name cl-tohoku/bert-base-japanese-whole-word-masking --rows 20000
+"""
+import argparse
+import time
+
+import numpy as np
+import rootutils
+from transformers import BertJapaneseTokenizer
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.components.tokenization import available_cores, tokenize_batched
+from src.data.data import extract_dataframe
+from tests.helpers.data import make_frame
+
+
+def tokenize_loop(texts: list[str], tokenizer, max_length: int) -> np.ndarray:
+    """従来の1行ずつのトークン化"""
+    return np.array([
+        tokenizer(text, max_length=max_length, padding="max_length", truncation=True)["input_ids"]
+        for text in texts
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-name", default="cl-tohoku/bert-base-japanese-whole-word-masking")
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--max-length", type=int, default=256)
+    args = parser.parse_args()
+
+    tokenizer = BertJapaneseTokenizer.from_pretrained(args.model_name)
+    texts = extract_dataframe(make_frame(args.rows))["summary"].to_list()
+
+    start = time.perf_counter()
+    expected = tokenize_loop(texts, tokenizer, args.max_length)
+    elapsed = time.perf_counter() - start
+    print(f"loop          : {args.rows / elapsed:,.0f} texts/sec")
+
+    for num_workers in sorted({1, 4, available_cores()}):
+        start = time.perf_counter()
+        actual = np.concatenate([
+            encoding["input_ids"] for _, encoding in tokenize_batched(texts, tokenizer, args.max_length, num_workers)
+        ])
+        elapsed = time.perf_counter() - start
+        assert (expected == actual).all(), "tokenization mismatch"
+        print(f"batched x{num_workers:<3d}  : {args.rows / elapsed:,.0f} texts/sec")
+
+
+if __name__ == "__main__":
+    main()
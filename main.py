@@ -1,38 +1,102 @@
-import mlflow
-from mlflow.tracking import MlflowClient
-
-TRACKING_URI = "file:///Users/suizushinsaku/develop/patent/logs/mlflow/mlruns"
-print(TRACKING_URI)
-ARTIFACT_LOCATION = '/Users/suizushinsaku/develop/patent/logs//mlflow/mlruns/920544941022305717/cb8608b21d1e41dd8d87c55dfa85ac85/artifacts'
-EXPERIMENT_NAME = 'demo'
-# トラッキングサーバ（バックエンド）の場所を指定
-mlflow.set_tracking_uri(TRACKING_URI)
-xperiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
-
-# 特定のrun_idを指定
-run_id = 'cb8608b21d1e41dd8d87c55dfa85ac85'
-
-# MlflowClientのインスタンスを作成
-client = MlflowClient()
-
-# ラン情報を取得
-run = client.get_run(run_id)
-
-# メトリクス、パラメータ、タグを表示
-print("Metrics:")
-for key, value in run.data.metrics.items():
-    print(f"  {key}: {value}")
-
-print("\nParameters:")
-for key, value in run.data.params.items():
-    print(f"  {key}: {value}")
-
-print("\nTags:")
-for key, value in run.data.tags.items():
-    print(f"  {key}: {value}")
-
-# アーティファクトのリストを取得し、パスを表示
-print("\nArtifacts:")
-artifacts = client.list_artifacts(run_id)
-for artifact in artifacts:
-    print(f"  {artifact.path}")
+"""MLflowのrunを一覧・絞り込み・比較するCLI
+
+runのメタデータはローカルのParquetにキャッシュし、syncで差分だけ更新する。
+list/compareはキャッシュだけを読み(MLflowも読み込まない)、runが数千件あってもすぐに返る。
+
+    python main.py sync --experiment demo
+    python main.py list --experiment demo --where '"metrics.val_loss" < 0.5' --sort val_loss --top 10
+    python main.py compare --experiment demo RUN_ID RUN_ID
+    python main.py show RUN_ID
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+from src.runs import RunCache, compare, query
+
+
+def show(tracking_uri: str | None, run_id: str) -> None:
+    """1つのrunのメトリクス、パラメータ、タグ、アーティファクトを表示する"""
+    # MLflowの読み込みは重いので、サーバーに問い合わせるコマンドでだけ読み込む
+    from mlflow.tracking import MlflowClient
+
+    client = MlflowClient(tracking_uri)
+    with ThreadPoolExecutor(2) as executor:
+        run = executor.submit(client.get_run, run_id)
+        artifacts = executor.submit(client.list_artifacts, run_id)
+    run, artifacts = run.result(), artifacts.result()
+
+    for title, items in [("Metrics", run.data.metrics), ("Parameters", run.data.params), ("Tags", run.data.tags)]:
+        print(f"{title}:")
+        for key, value in sorted(items.items()):
+            print(f"  {key}: {value}")
+        print()
+    print("Artifacts:")
+    for artifact in artifacts:
+        print(f"  {artifact.path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--tracking-uri", default=os.environ.get("MLFLOW_TRACKING_URI"), help="既定は環境変数MLFLOW_TRACKING_URI"
+    )
+    parser.add_argument("--cache-dir", default="logs/mlflow/run_cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="キャッシュを差分で更新する")
+    list_parser = subparsers.add_parser("list", help="キャッシュしたrunを絞り込み・並べ替えて表示する")
+    compare_parser = subparsers.add_parser("compare", help="runのメトリクスとパラメータの違いを表示する")
+    for p in (sync_parser, list_parser, compare_parser):
+        p.add_argument("-e", "--experiment", action="append", required=True, help="実験名。複数回指定できる")
+    for p in (list_parser, compare_parser):
+        p.add_argument("--sync", action="store_true", help="表示する前にキャッシュを更新する")
+    sync_parser.add_argument("--workers", type=int, default=8, help="同時にsearch_runsを呼び出す数")
+
+    list_parser.add_argument("--where", help='SQLのWHERE句。例: \'"metrics.val_loss" < 0.5\'')
+    list_parser.add_argument("--sort", help="並べ替えるメトリクス。例: val_loss")
+    list_parser.add_argument("--desc", action="store_true", help="降順に並べる")
+    list_parser.add_argument("--top", type=int, default=20)
+    list_parser.add_argument("--columns", nargs="+", help="表示する列")
+    list_parser.add_argument("--output", help="結果をCSV/Parquetに書き出す")
+
+    compare_parser.add_argument("run_ids", nargs="+")
+
+    show_parser = subparsers.add_parser("show", help="1つのrunの詳細を表示する")
+    show_parser.add_argument("run_id")
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        show(args.tracking_uri, args.run_id)
+        return
+
+    cache = RunCache(args.cache_dir, max_workers=getattr(args, "workers", 8), tracking_uri=args.tracking_uri)
+    sync = args.command == "sync" or args.sync
+    # 同期しない場合は、前回の同期でキャッシュした実験名とIDの対応を使う
+    experiment_ids = cache.experiment_ids(args.experiment, refresh=sync)
+    start = time.perf_counter()
+    if sync:
+        counts = cache.sync(experiment_ids)
+        print(f"Synced {sum(counts.values())} runs in {time.perf_counter() - start:.2f} sec")
+        if args.command == "sync":
+            return
+
+    df = cache.load(experiment_ids)
+    if args.command == "list":
+        result = query(df, args.where, args.sort, args.desc, args.top, args.columns)
+        if args.output:
+            result.write_csv(args.output) if args.output.endswith(".csv") else result.write_parquet(args.output)
+    else:
+        result = compare(df, args.run_ids)
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, fmt_str_lengths=60):
+        print(result)
+    print(f"{len(df)} cached runs, {time.perf_counter() - start:.3f} sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from pathlib import Path
+from typing import Any
+
+from lightning.pytorch import Trainer
+from lightning.pytorch.callbacks import ModelCheckpoint
+
+from src.utils.checkpoint import save_weights, weights_path
+
+
+class CompactModelCheckpoint(ModelCheckpoint):
+    """ModelCheckpointと同じ規則でチェックポイントを保存し、その隣に重みだけのsafetensorsを書き出すCallback
+
+    Lightningのチェックポイントはオプティマイザの状態(Adamではモデルの2倍の大きさ)を含み、学習の再開に使う。
+    評価・推論ではsrc.utils.checkpoint.load_modelが`{チェックポイント名}.safetensors`をメモリマップして読み込む。
+    save_top_kで古いチェックポイントが消されるときは、対応するsafetensorsも消す。
+    """
+
+    def __init__(self, *args: Any, save_safetensors: bool = True, half: bool = False, **kwargs: Any) -> None:
+        """
+        Args:
+            save_safetensors: 重みだけのsafetensorsを書き出すかどうか
+            half: safetensorsの浮動小数点の重みをfloat16で書き出す
+            その他の引数はModelCheckpointと同じ
+        """
+        super().__init__(*args, **kwargs)
+        self.save_safetensors = save_safetensors
+        self.half = half
+
+    def _save_checkpoint(self, trainer: Trainer, filepath: str) -> None:
+        super()._save_checkpoint(trainer, filepath)
+        if self.save_safetensors and trainer.is_global_zero:
+            save_weights(
+                trainer.lightning_module.state_dict(),
+                weights_path(filepath),
+                half=self.half,
+                metadata={"epoch": trainer.current_epoch, "global_step": trainer.global_step},
+            )
+        trainer.strategy.barrier()
+
+    def _remove_checkpoint(self, trainer: Trainer, filepath: str) -> None:
+        super()._remove_checkpoint(trainer, filepath)
+        if trainer.is_global_zero:
+            weights_path(filepath).unlink(missing_ok=True)
@@ -1,48 +1,159 @@
-import os
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+import threading
+import time
+from collections import deque
+
 from lightning.pytorch import Trainer, LightningModule
 from lightning.pytorch.callbacks import Callback
 
+from src.utils.pylogger import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
 class SlackNotificationCallback(Callback):
-    def __init__(self, slack_token: str, channel: str):
+    """学習の開始・エポックの終了・学習の終了をSlackに通知するCallback
+
+    Slackへの送信はバックグラウンドのスレッドで行い、学習ループはキューにメッセージを入れるだけで戻る。
+    Slackの応答が遅い・タイムアウトする場合でも、学習ループや(集団通信で待つ)他のランクを止めない。
+
+    - 送信の間隔はmin_interval秒以上空け、その間に溜まったメッセージは1件にまとめて送る
+    - キューがmax_queue_size件で一杯の場合は、最も古いメッセージを捨てる
+    - teardownでキューに残ったメッセージを送り切る(最大flush_timeout秒待つ)。待ちきれなかった場合も
+      スレッドは送信を続け、次の学習ではそのスレッドを使い続ける
+    - グローバルランク0のプロセスだけが送信する
+    """
+
+    def __init__(
+        self,
+        slack_token: str,
+        channel: str,
+        min_interval: float = 1.0,
+        max_queue_size: int = 100,
+        flush_timeout: float = 10.0,
+    ):
+        """
+        Args:
+            slack_token: SlackのAPIトークン
+            channel: 通知先のチャンネル
+            min_interval: 送信の最小間隔(秒)
+            max_queue_size: 送信待ちのメッセージの最大数
+            flush_timeout: teardownで送信の完了を待つ最大の時間(秒)
+        """
         super().__init__()
         self.slack_token = slack_token
         self.channel = channel
-        self.client = WebClient(self.slack_token)
+        self.min_interval = min_interval
+        self.flush_timeout = flush_timeout
+        self._client = None
+        self.max_queue_size = max_queue_size
+        self.dropped = 0
+        self._queue: deque[str] = deque()
+        # _queue、_stopping、_runningを保護し、メッセージの到着と停止の要求をスレッドに知らせる
+        self._cond = threading.Condition()
+        # flushで停止を要求した後、キューが空になったらスレッドを終了する
+        self._stopping = False
+        # スレッドが終了処理に入るまでTrue。is_aliveと違い、終了直前のスレッドを使い回すことがない
+        self._running = False
+        self._worker: threading.Thread | None = None
+
+    @property
+    def client(self):
+        # slack_sdkは最初の送信時(バックグラウンドのスレッド)に読み込み、学習の起動を遅くしない
+        if self._client is None:
+            from slack_sdk import WebClient
+
+            self._client = WebClient(self.slack_token)
+        return self._client
+
+    @client.setter
+    def client(self, client) -> None:
+        self._client = client
+
+    def _start(self) -> None:
+        with self._cond:
+            # flushが待ちきれずにスレッドが残っている場合は、停止の要求を取り消してそのまま使う
+            self._stopping = False
+            if self._running:
+                return
+            self._running = True
+        self._worker = threading.Thread(target=self._run, name="slack-notification", daemon=True)
+        self._worker.start()
+
+    def _enqueue(self, text: str) -> None:
+        with self._cond:
+            if len(self._queue) >= self.max_queue_size:
+                # 古いメッセージを捨てて、最新の状態を優先する
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(text)
+            self._cond.notify()
+
+    def _send(self, text: str) -> None:
+        from slack_sdk.errors import SlackApiError
 
-    # 学習開始時
-    def on_train_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
         try:
-            model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
-            response = self.client.chat_postMessage(
-                channel=self.channel,
-                text=f"🚀{model_name}の学習が開始しました🚀",
-            )
-            print(f"Slack notification sent: {response['message']['text']}")
+            response = self.client.chat_postMessage(channel=self.channel, text=text)
+            log.info(f"Slack notification sent: {response['message']['text']}")
         except SlackApiError as e:
-            print(f"Error sending Slack notification: {e.response['error']}")
+            log.warning(f"Error sending Slack notification: {e.response['error']}")
+        except Exception as e:
+            # タイムアウトや接続エラーでスレッドが止まらないようにする
+            log.warning(f"Error sending Slack notification: {e!r}")
+
+    def _run(self) -> None:
+        last_sent = float("-inf")
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopping)
+                if not self._queue:
+                    # 停止を要求され、送るメッセージが残っていない
+                    self._running = False
+                    return
+
+            # 前回の送信からmin_interval秒経つまで待ち、その間に届いたメッセージもまとめて送る
+            wait = last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self._cond:
+                texts = list(self._queue)
+                self._queue.clear()
+
+            self._send("\n".join(texts))
+            last_sent = time.monotonic()
+
+    def flush(self) -> None:
+        """送信待ちのメッセージを送り切り、スレッドを終了する"""
+        with self._cond:
+            if not self._running:
+                return
+            self._stopping = True
+            self._cond.notify()
+        self._worker.join(self.flush_timeout)
+        if self._worker.is_alive():
+            log.warning(f"Slack notifications were not sent within {self.flush_timeout} sec.")
+        if self.dropped:
+            log.warning(f"Dropped {self.dropped} Slack notifications because the queue was full.")
+
+    def _notify(self, trainer: Trainer, text: str) -> None:
+        if not trainer.is_global_zero:
+            return
+        self._start()
+        self._enqueue(text)
+
+    # 学習開始時
+    def on_train_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
+        self._notify(trainer, f"🚀{model_name}の学習が開始しました🚀")
 
     # 学習終了時
     def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
-        try:
-            model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
-            response = self.client.chat_postMessage(
-                channel=self.channel,
-                text=f"🎉{model_name}の学習が終了しました🎉"
-            )
-            print(f"Slack notification sent: {response['message']['text']}")
-        except SlackApiError as e:
-            print(f"Error sending Slack notigication: {e.response['error']}")
+        model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
+        self._notify(trainer, f"🎉{model_name}の学習が終了しました🎉")
 
     def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
-        try:
-            current_epoch = trainer.current_epoch + 1
-            model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
-            response = self.client.chat_postMessage(
-                channel=self.channel,
-                text=f"✅{model_name}の学習が{current_epoch}epochまで終了しました"
-            )
-            print(f"Slack notification sent: {response['message']['text']}")
-        except SlackApiError as e:
-            print(f"Error sending Slack notification: {e.response['error']}")
+        current_epoch = trainer.current_epoch + 1
+        model_name = getattr(pl_module, "model_name", pl_module.__class__.__name__)
+        self._notify(trainer, f"✅{model_name}の学習が{current_epoch}epochまで終了しました")
+
+    def teardown(self, trainer: Trainer, pl_module: LightningModule, stage: str) -> None:
+        self.flush()
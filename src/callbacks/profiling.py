@@ -0,0 +1,303 @@
+import json
+import time
+from pathlib import Path
+from typing import Any, Mapping
+
+import numpy as np
+import torch
+from lightning.pytorch import LightningModule, Trainer
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.profilers import Profiler
+from lightning.pytorch.utilities.data import extract_batch_size
+
+from src.utils.pylogger import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+# 集計するフェーズ。otherは1ステップの時間から他のフェーズを引いた残り(ロガーへの書き込みやループ自体の処理)
+PHASES = ("data", "forward", "backward", "optimizer", "callbacks", "other")
+
+
+def _phase(action: str) -> str | None:
+    """Lightningのプロファイラのアクション名をフェーズに対応させる。対応しないものはNone"""
+    if action.endswith(".train_dataloader_next"):
+        return "data"
+    if action.startswith("[Strategy]"):
+        if action.endswith(".training_step"):
+            return "forward"
+        if action.endswith(".backward"):
+            return "backward"
+        return None
+    if action == "optimizer_step" or action.endswith((".optimizer_step", ".optimizer_zero_grad", ".lr_scheduler_step")):
+        return "optimizer"
+    if action.startswith(("[Callback]", "[LightningModule]")):
+        return "callbacks"
+    return None
+
+
+def _batch_size(batch: Any) -> int:
+    """バッチの最初のテンソルの長さをバッチサイズとする
+
+    Lightningのextract_batch_sizeはバッチ全体をたどるため、毎ステップ呼ぶと計時よりも重い
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.size(0) if batch.ndim else 1
+    if isinstance(batch, Mapping) and batch:
+        return _batch_size(next(iter(batch.values())))
+    if isinstance(batch, (list, tuple)) and batch:
+        return _batch_size(batch[0])
+    return extract_batch_size(batch)
+
+
+class _PhaseTimer(Profiler):
+    """Trainerのプロファイラを包み、アクションの開始・終了の時刻からフェーズごとの時間を集計するProfiler
+
+    Lightningは学習ループの各処理(データの取得、training_step、backward、optimizer_step、各コールバックの呼び出し)を
+    プロファイラのアクションとして開始・終了を通知するので、それをperf_counterで記録するだけにする。
+    アクションは入れ子になる(optimizer_stepの中でtraining_stepとbackwardが呼ばれる)ため、
+    子のアクションの時間を除いた時間をそれぞれのフェーズに加える。
+    元のプロファイラ(Trainer(profiler=...))にはそのまま転送する。
+    """
+
+    def __init__(self, inner: Profiler, sync_cuda: bool) -> None:
+        super().__init__()
+        self.inner = inner
+        self.sync_cuda = sync_cuda
+        self.active = False
+        self.steps: list[dict[str, float]] = []
+        self._stack: list[list[Any]] = []
+        self._current: dict[str, float] | None = None
+        self._step_start: float | None = None
+        self._has_batch = False
+        # アクション名からフェーズへの対応をキャッシュする(アクション名の種類は少ない)
+        self._phases: dict[str, str | None] = {}
+
+    def _now(self) -> float:
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def close_step(self, now: float | None = None) -> None:
+        """集計中のステップを終え、1ステップの時間を記録する"""
+        if self._current is not None and self._has_batch:
+            now = self._now() if now is None else now
+            self._current["step"] = now - self._step_start
+            self._current["other"] = max(
+                0.0, self._current["step"] - sum(self._current[phase] for phase in PHASES if phase != "other")
+            )
+            self.steps.append(self._current)
+        self._current = None
+        self._step_start = None
+        self._has_batch = False
+
+    def start(self, action_name: str) -> None:
+        if self.active:
+            now = self._now()
+            if action_name.endswith(".train_dataloader_next"):
+                # バッチの取得の開始を1ステップの区切りとする。エポックの最初の先読みのように、
+                # 区切りの間に学習のバッチがなかった場合は、次のステップに含める
+                if self._has_batch:
+                    self.close_step(now)
+                if self._current is None:
+                    self._current = dict.fromkeys(PHASES, 0.0)
+                    self._step_start = now
+            elif action_name == "run_training_batch":
+                self._has_batch = True
+            self._stack.append([action_name, now, 0.0])
+        self.inner.start(action_name)
+
+    def stop(self, action_name: str) -> None:
+        self.inner.stop(action_name)
+        if not self._stack or self._stack[-1][0] != action_name:
+            return
+        name, start, children = self._stack.pop()
+        duration = self._now() - start
+        if self._stack:
+            self._stack[-1][2] += duration
+        phase = self._phases.get(name, "")
+        if phase == "":
+            phase = self._phases[name] = _phase(name)
+        if phase is not None and self._current is not None:
+            self._current[phase] += duration - children
+
+    def setup(self, stage: str, local_rank: int | None = None, log_dir: str | None = None) -> None:
+        self.inner.setup(stage, local_rank=local_rank, log_dir=log_dir)
+
+    def summary(self) -> str:
+        return self.inner.summary()
+
+    def describe(self) -> None:
+        self.inner.describe()
+
+    def teardown(self, stage: str | None) -> None:
+        self.inner.teardown(stage)
+
+
+class ProfilingCallback(Callback):
+    """学習ステップの時間をフェーズ(データの待ち時間、forward、backward、オプティマイザ、コールバック、その他)に分けて計測するCallback
+
+    Trainerのプロファイラを計時用のProfilerで包み、Lightningが通知する各処理の開始・終了の時刻だけを記録する。
+    学習の終了時に、最初のwarmup_stepsステップを除いたフェーズごとのパーセンタイル(ミリ秒)とスループットを
+    ロガーと`{output_dir}/profile.json`に書き出す。検証ループの時間は含めない。
+
+    torch_profilerを有効にすると、trace_wait + trace_warmupステップ後のtrace_activeステップの
+    torch.profilerのトレースを`{output_dir}/profile_trace.json`(chrome://tracingやPerfettoで開ける)に書き出す。
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        warmup_steps: int = 5,
+        percentiles: tuple[int, ...] = (50, 90, 99),
+        sync_cuda: bool = False,
+        torch_profiler: bool = False,
+        trace_wait: int = 5,
+        trace_warmup: int = 2,
+        trace_active: int = 5,
+    ):
+        """
+        Args:
+            output_dir: 集計結果とトレースを書き出すディレクトリ
+            warmup_steps: 集計から除く最初のステップ数(torch.compileやキャッシュの作成を含むため)
+            percentiles: 書き出すパーセンタイル
+            sync_cuda: 各処理の前後でCUDAを同期する。GPUの処理は非同期に実行されるため、
+                同期しないとGPUの時間は同期が起きたフェーズ(多くはoptimizerかdata)に計上される
+            torch_profiler: torch.profilerのトレースを書き出すかどうか
+            trace_wait: トレースを始める前に待つステップ数
+            trace_warmup: トレースの前にプロファイラを温めるステップ数
+            trace_active: トレースを記録するステップ数
+        """
+        super().__init__()
+        self.output_dir = Path(output_dir)
+        self.warmup_steps = warmup_steps
+        if not percentiles:
+            raise ValueError("percentiles must not be empty")
+        self.percentiles = tuple(percentiles)
+        self.sync_cuda = sync_cuda
+        self.torch_profiler = torch_profiler
+        self.trace_wait = trace_wait
+        self.trace_warmup = trace_warmup
+        self.trace_active = trace_active
+        self.summary: dict[str, Any] | None = None
+        self._timer: _PhaseTimer | None = None
+        self._profiler: torch.profiler.profile | None = None
+        self._samples: list[int] = []
+        self._trace_steps = 0
+        self._paused = False
+
+    def _file_name(self, trainer: Trainer, name: str) -> Path:
+        # DDPではランクごとに別のファイルに書き出す
+        suffix = f"_rank{trainer.global_rank}" if trainer.world_size > 1 else ""
+        return self.output_dir / f"{name}{suffix}.json"
+
+    def setup(self, trainer: Trainer, pl_module: LightningModule, stage: str) -> None:
+        if stage != "fit" or isinstance(trainer.profiler, _PhaseTimer):
+            return
+        self._timer = _PhaseTimer(trainer.profiler, sync_cuda=self.sync_cuda and torch.cuda.is_available())
+        trainer.profiler = self._timer
+
+    def teardown(self, trainer: Trainer, pl_module: LightningModule, stage: str) -> None:
+        if self._timer is not None and trainer.profiler is self._timer:
+            trainer.profiler = self._timer.inner
+        self._timer = None
+
+    def on_train_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._samples = []
+        if self._timer is not None:
+            self._timer.steps = []
+            self._timer.active = True
+        if self.torch_profiler:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            trace_path = self._file_name(trainer, "profile_trace")
+            self._profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(
+                    wait=self.trace_wait, warmup=self.trace_warmup, active=self.trace_active, repeat=1
+                ),
+                on_trace_ready=lambda prof: prof.export_chrome_trace(str(trace_path)),
+            )
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            self._profiler.start()
+            self._trace_steps = 0
+
+    def on_train_batch_end(
+        self, trainer: Trainer, pl_module: LightningModule, outputs: Any, batch: Any, batch_idx: int
+    ) -> None:
+        self._samples.append(_batch_size(batch))
+        if self._profiler is not None:
+            self._profiler.step()
+            self._trace_steps += 1
+            if self._trace_steps >= self.trace_wait + self.trace_warmup + self.trace_active:
+                self._stop_torch_profiler()
+
+    def on_validation_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # 検証ループの時間を学習のステップに含めない
+        if self._timer is not None and self._timer.active:
+            self._timer.close_step()
+            self._timer.active = False
+            self._paused = True
+
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if self._timer is not None and self._paused:
+            self._timer.active = True
+            self._paused = False
+
+    def on_train_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._stop_torch_profiler()
+        if self._timer is None:
+            return
+        self._timer.close_step()
+        self._timer.active = False
+        self.summary = self._summarize(self._timer.steps, self._samples)
+        if self.summary is None:
+            log.warning("No training steps were recorded after warmup. Skipping the profile summary.")
+            return
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self._file_name(trainer, "profile")
+        with open(path, "w") as f:
+            json.dump(self.summary, f, indent=2)
+        metrics = {
+            f"profile/{phase}_{key}": value
+            for phase, stats in self.summary["phases"].items()
+            for key, value in stats.items()
+        }
+        metrics.update({f"profile/{key}": value for key, value in self.summary["throughput"].items()})
+        for logger in trainer.loggers:
+            logger.log_metrics(metrics, step=trainer.global_step)
+        log.info(f"Profile summary written to {path}")
+        # 設定したパーセンタイルのうち最初のもの(既定ではp50)を表示する
+        q = self.percentiles[0]
+        for phase, stats in self.summary["phases"].items():
+            log.info(f"  {phase:>9}: p{q} {stats[f'p{q}_ms']:8.2f} ms  share {stats['share']:6.1%}")
+
+    def _stop_torch_profiler(self) -> None:
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
+
+    def _summarize(self, steps: list[dict[str, float]], samples: list[int]) -> dict[str, Any] | None:
+        """ステップごとの時間から、フェーズごとのパーセンタイルと全体に占める割合、スループットを求める"""
+        n = min(len(steps), len(samples))
+        steps, samples = steps[self.warmup_steps:n], samples[self.warmup_steps:n]
+        if not steps:
+            return None
+        total = sum(step["step"] for step in steps)
+        phases = {}
+        for phase in (*PHASES, "step"):
+            values = np.array([step[phase] for step in steps]) * 1000
+            stats = {f"p{q}_ms": float(np.percentile(values, q)) for q in self.percentiles}
+            stats["mean_ms"] = float(values.mean())
+            stats["share"] = float(values.sum() / 1000 / total) if total > 0 else 0.0
+            phases[phase] = stats
+        return {
+            "steps": len(steps),
+            "warmup_steps": self.warmup_steps,
+            "phases": phases,
+            "throughput": {
+                "steps_per_sec": len(steps) / total,
+                "samples_per_sec": sum(samples) / total,
+            },
+        }
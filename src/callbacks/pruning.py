@@ -0,0 +1,127 @@
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from lightning.pytorch import LightningModule, Trainer
+from lightning.pytorch.callbacks import Callback
+
+from src.utils.pylogger import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+class MedianPruningCallback(Callback):
+    """ハイパーパラメータ探索で、見込みのない試行を途中で打ち切るCallback
+
+    OptunaのMedianPrunerと同じ規則で判定する。検証のたびに、これまでの最良の値が、
+    同じエポックまで進んで完了した他の試行の値の中央値よりも悪ければ、学習を終える。
+
+    試行は別々のプロセスで並列に実行される(Hydraのjoblibランチャーなど)ため、各試行は検証のたびに
+    監視する指標の値を`{report_dir}/{trial_id}.json`に書き出し、他の試行のファイルを読んで判定する。
+    打ち切った試行もそれまでの最良の値をoptimized_metricとしてスイーパーに返す。
+    """
+
+    def __init__(
+        self,
+        report_dir: str,
+        monitor: str = "val_loss",
+        mode: str = "min",
+        n_startup_trials: int = 5,
+        n_warmup_epochs: int = 1,
+        trial_id: str | None = None,
+    ):
+        """
+        Args:
+            report_dir: 試行ごとの途中の値を書き出すディレクトリ。同じ探索の試行で共有する
+            monitor: 監視する指標
+            mode: 'min'(小さいほど良い)または'max'
+            n_startup_trials: 判定に必要な、完了した他の試行の数。これより少ない間は打ち切らない
+            n_warmup_epochs: 打ち切りを判定しない最初のエポック数
+            trial_id: 試行の識別子。Noneの場合はランダムに決める
+        """
+        super().__init__()
+        if mode not in ("min", "max"):
+            raise ValueError(f"mode must be 'min' or 'max', but got {mode}")
+        self.report_dir = Path(report_dir)
+        self.monitor = monitor
+        self.mode = mode
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_epochs = n_warmup_epochs
+        self.trial_id = trial_id or uuid.uuid4().hex
+        self.values: dict[int, float] = {}
+        self.pruned = False
+
+    @property
+    def _path(self) -> Path:
+        return self.report_dir / f"{self.trial_id}.json"
+
+    def _write(self, state: str) -> None:
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        # 他の試行が書きかけのファイルを読まないように、一時ファイルに書いてから置き換える
+        tmp_path = self._path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"monitor": self.monitor, "state": state, "values": self.values}, f)
+        os.replace(tmp_path, self._path)
+
+    def _completed_values(self, epoch: int) -> list[float]:
+        """完了した他の試行の、指定したエポックでの値"""
+        values = []
+        for path in self.report_dir.glob("*.json"):
+            if path == self._path:
+                continue
+            try:
+                report = json.loads(path.read_text())
+            except (OSError, json.JSONDecodeError):
+                continue
+            if report["monitor"] != self.monitor or report["state"] != "complete":
+                continue
+            value = report["values"].get(str(epoch))
+            if value is not None:
+                values.append(value)
+        return values
+
+    def _should_prune(self, epoch: int) -> bool:
+        if epoch < self.n_warmup_epochs:
+            return False
+        others = self._completed_values(epoch)
+        if len(others) < self.n_startup_trials:
+            return False
+        best = min(self.values.values()) if self.mode == "min" else max(self.values.values())
+        median = float(np.median(others))
+        return best > median if self.mode == "min" else best < median
+
+    def on_validation_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if trainer.sanity_checking or self.pruned:
+            return
+        value = trainer.callback_metrics.get(self.monitor)
+        if value is None:
+            log.warning(f"Metric `{self.monitor}` was not logged. Skipping pruning.")
+            return
+
+        prune = False
+        if trainer.is_global_zero:
+            epoch = trainer.current_epoch
+            self.values[epoch] = float(value)
+            prune = self._should_prune(epoch)
+            self._write("pruned" if prune else "running")
+        # 判定はランク0だけで行い、全てのランクで同時に学習を終える
+        prune = trainer.strategy.broadcast(prune)
+        if prune:
+            self.pruned = True
+            trainer.should_stop = True
+            log.info(f"Trial {self.trial_id} pruned at epoch {trainer.current_epoch} ({self.monitor}={float(value):.4f})")
+
+    def on_fit_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        if trainer.is_global_zero and not self.pruned and self.values:
+            self._write("complete")
+
+    def state_dict(self) -> dict[str, Any]:
+        return {"trial_id": self.trial_id, "values": self.values, "pruned": self.pruned}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        self.trial_id = state_dict["trial_id"]
+        self.values = state_dict["values"]
+        self.pruned = state_dict["pruned"]
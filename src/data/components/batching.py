@@ -0,0 +1,129 @@
+from typing import Iterator, Mapping
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler, default_collate
+
+
+def collate_tokens(batch: list[dict[str, torch.Tensor]] | Mapping[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+    """TokenStoreのサンプルをバッチにまとめる
+
+    `TokenStore.__getitems__`がバッチ単位で読み出した場合は、すでにまとまっているのでそのまま返す
+
+    Args:
+        batch: サンプルのリスト、またはバッチ単位で読み出した辞書
+
+    Returns:
+        dict[str, torch.Tensor]: (バッチサイズ, max_length)のテンソルの辞書
+    """
+    if isinstance(batch, Mapping):
+        return dict(batch)
+    return default_collate(batch)
+
+
+def pad_to_longest(
+    batch: list[dict[str, torch.Tensor]] | Mapping[str, torch.Tensor],
+    pad_to_multiple_of: int | None = None,
+) -> dict[str, torch.Tensor]:
+    """max_lengthまでパディング済みのサンプルをまとめ、バッチ内の最長の系列の長さで切り詰める
+
+    Args:
+        batch: サンプルのリスト、またはバッチ単位で読み出した辞書
+        pad_to_multiple_of: 指定した場合は系列長をこの倍数に切り上げる。
+            torch.compileで静的な形状としてコンパイルする場合に、系列長の種類(再コンパイルの回数)を絞る
+
+    Returns:
+        dict[str, torch.Tensor]: (バッチサイズ, バッチ内の最長の系列長)のテンソルの辞書
+    """
+    batch = collate_tokens(batch)
+    max_len = int(batch["attention_mask"].sum(1).max())
+    if pad_to_multiple_of:
+        max_len = min(-(-max_len // pad_to_multiple_of) * pad_to_multiple_of, batch["attention_mask"].shape[1])
+    for field in ("input_ids", "attention_mask", "token_type_ids"):
+        batch[field] = batch[field][:, :max_len].contiguous()
+    return batch
+
+
+class LengthBucketBatchSampler(Sampler[list[int]]):
+    """系列長が近いサンプルを同じバッチにまとめるBatchSampler
+
+    学習時はインデックスをシャッフルしてから`batch_size * bucket_size`件ずつのバケットに分け、
+    バケット内を系列長でソートしてバッチを作る。最後にバッチの順番をシャッフルするため、
+    エポックごとに異なるバッチの組み合わせと順番になる。
+
+    DDPでは全てのランクが同じシードで同じバッチの並びを作り、それをnum_replicas個ずつ順に配る。
+    even_shardsの場合は先頭のバッチを繰り返して、全てのランクのバッチ数を揃える。
+    """
+
+    def __init__(
+        self,
+        lengths: np.ndarray,
+        batch_size: int,
+        shuffle: bool,
+        bucket_size: int = 100,
+        drop_last: bool = False,
+        seed: int = 0,
+        num_replicas: int = 1,
+        rank: int = 0,
+        even_shards: bool = True,
+    ) -> None:
+        """
+        Args:
+            lengths: 各サンプルの系列長
+            batch_size: バッチサイズ
+            shuffle: バケット間・バッチ間をシャッフルするかどうか
+            bucket_size: 1つのバケットに含めるバッチ数
+            drop_last: 端数のバッチを捨てるかどうか
+            seed: シャッフルのシード。エポック番号を足して使う。DDPでは全てのランクで同じ値にする
+            num_replicas: バッチを分けるプロセス数
+            rank: このプロセスのランク
+            even_shards: ランクごとのバッチ数を揃えるかどうか。学習時は揃え、評価時はサンプルを重複させないために揃えない
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.even_shards = even_shards
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            num_batches = len(self.lengths) // self.batch_size
+        else:
+            num_batches = -(-len(self.lengths) // self.batch_size)
+        if self.even_shards:
+            return -(-num_batches // self.num_replicas)
+        return len(range(self.rank, num_batches, self.num_replicas))
+
+    def __iter__(self) -> Iterator[list[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+
+        bucket_len = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), bucket_len):
+            bucket = indices[start:start + bucket_len]
+            # 安定ソートで、同じ長さのサンプルの順番を保つ
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            batches.extend(bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size))
+
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        if self.num_replicas > 1:
+            if self.even_shards and batches:
+                padding = -len(batches) % self.num_replicas
+                batches += (batches * -(-padding // len(batches)))[:padding]
+            batches = batches[self.rank::self.num_replicas]
+
+        for batch in batches:
+            yield batch.tolist()
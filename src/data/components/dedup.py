@@ -0,0 +1,235 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.data.components.token_store import hash_source
+from src.data.components.tokenization import available_cores
+from src.data.data import read_processed
+
+# MinHashの置換に使うメルセンヌ素数(2^61 - 1)と、シグネチャの値の上限
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _permutations(num_perm: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    # h -> (a * h + b) mod p の係数。シードが同じなら全てのプロセスで同じ置換になる
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    """文字のshingle_size-gramを32ビットの値にハッシュする
+
+    要約は単語の区切りがない日本語なので、単語ではなく文字のn-gramを使う。
+    shingle_sizeより短いテキストは全体を1つのn-gramとする
+
+    Args:
+        text: テキスト
+        shingle_size: n-gramの文字数
+
+    Returns:
+        np.ndarray: (n-gramの数,)のuint64の配列(値は32ビットに収まる)
+    """
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codepoints) == 0:
+        return codepoints
+    if len(codepoints) < shingle_size:
+        codepoints = np.pad(codepoints, (0, shingle_size - len(codepoints)))
+    # 多項式ハッシュ。uint64の桁あふれはそのまま折り返す
+    multipliers = np.uint64(1_000_003) ** np.arange(shingle_size - 1, -1, -1, dtype=np.uint64)
+    hashes = (sliding_window_view(codepoints, shingle_size) * multipliers).sum(1, dtype=np.uint64)
+    return (hashes ^ (hashes >> np.uint64(32))) & _MAX_HASH
+
+
+def _signature_chunk(texts: list[str], num_perm: int, shingle_size: int, seed: int) -> np.ndarray:
+    a, b = _permutations(num_perm, seed)
+    signatures = np.full((len(texts), num_perm), _MAX_HASH, dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = shingle_hashes(text, shingle_size)
+        if len(hashes):
+            signatures[i] = (((hashes[:, None] * a + b) % _MERSENNE_PRIME) & _MAX_HASH).min(0)
+    return signatures.astype(np.uint32)
+
+
+def minhash_signatures(
+    texts: list[str],
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    seed: int = 0,
+    num_workers: int | None = None,
+    chunk_size: int = 2048,
+) -> np.ndarray:
+    """各テキストの文字n-gramの集合からMinHashのシグネチャを計算する
+
+    2つのシグネチャで値が一致する割合は、n-gramの集合のJaccard係数の推定値になる。
+    テキストごとに独立に計算できるので、チャンクをプロセスプールに分散させる。
+    空のテキストは全ての値が最大値のシグネチャになり、互いに重複とみなされる
+
+    Args:
+        texts: テキスト
+        num_perm: シグネチャの長さ(ハッシュ関数の数)
+        shingle_size: n-gramの文字数
+        seed: ハッシュ関数を決める乱数のシード
+        num_workers: ワーカープロセス数。Noneの場合は使用可能なコア数
+        chunk_size: 1つのワーカーに渡すテキスト数
+
+    Returns:
+        np.ndarray: (テキスト数, num_perm)のuint32の配列
+    """
+    if num_workers is None:
+        num_workers = available_cores()
+    starts = range(0, len(texts), chunk_size)
+    chunks = [texts[start:start + chunk_size] for start in starts]
+    args = ([num_perm] * len(chunks), [shingle_size] * len(chunks), [seed] * len(chunks))
+    if num_workers <= 1 or len(chunks) <= 1:
+        results = list(map(_signature_chunk, chunks, *args))
+    else:
+        # polarsなどのスレッドを持つプロセスをforkするとデッドロックしうるため、spawnでワーカーを起動する
+        with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(_signature_chunk, chunks, *args))
+    if not results:
+        return np.empty((0, num_perm), dtype=np.uint32)
+    return np.concatenate(results)
+
+
+def connected_components(n: int, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """辺(u, v)で結ばれた頂点を同じ成分にまとめ、成分内の最小の頂点番号を返す
+
+    各頂点のラベルを隣接する頂点の最小のラベルで更新し、ラベルをたどって短絡させることを収束まで繰り返す
+
+    Args:
+        n: 頂点数
+        u: 辺の一端の頂点番号
+        v: 辺のもう一端の頂点番号
+
+    Returns:
+        np.ndarray: (n,)の成分のラベル
+    """
+    labels = np.arange(n, dtype=np.int64)
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, u, labels[v])
+        np.minimum.at(updated, v, labels[u])
+        # ラベルのラベルをたどり、鎖状の成分でも少ない反復で収束させる
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def lsh_clusters(signatures: np.ndarray, bands: int = 16, threshold: float = 0.8) -> np.ndarray:
+    """MinHashのシグネチャをLSHのバンドに分け、近似重複のクラスタIDを求める
+
+    シグネチャをbands個のバンドに分け、あるバンドの値が全て一致するテキストを候補とする。
+    候補はバンドごとに値でまとめるだけなので、テキスト数に対してほぼ線形の時間で求まる。
+    推定Jaccard係数がthreshold以上の候補を重複とみなし、推移的につながったテキストを1つのクラスタにする
+
+    Args:
+        signatures: minhash_signaturesの結果
+        bands: バンド数。num_permを割り切れる必要がある
+        threshold: 重複とみなす推定Jaccard係数の下限
+
+    Returns:
+        np.ndarray: (テキスト数,)のクラスタID。クラスタ内の最小の行番号なので、実行ごとに変わらない
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands}).")
+    rows = num_perm // bands
+    sources, targets = [], []
+    for band in range(bands):
+        # バンドの値をまとめてバイト列として比較する
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows]).view(np.dtype((np.void, 4 * rows)))
+        _, first, inverse = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+        # 同じバケットの各テキストを、バケット内で最初のテキストと結ぶ
+        leader = first[inverse]
+        candidates = np.flatnonzero(leader != np.arange(n))
+        sources.append(candidates)
+        targets.append(leader[candidates])
+    u, v = np.concatenate(sources), np.concatenate(targets)
+    # 複数のバンドで一致した候補の組は1回だけ検証する
+    pairs = np.unique(np.stack([u, v], 1), axis=0) if len(u) else np.empty((0, 2), dtype=np.int64)
+    u, v = pairs[:, 0], pairs[:, 1]
+    similarity = (signatures[u] == signatures[v]).mean(1)
+    keep = similarity >= threshold
+    return connected_components(n, u[keep], v[keep])
+
+
+def load_clusters(
+    data_paths: list[str | os.PathLike],
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    bands: int = 16,
+    shingle_size: int = 5,
+    num_workers: int | None = None,
+) -> list[np.ndarray]:
+    """複数の前処理済みデータをまとめて近似重複のクラスタに分け、最初のデータの隣にキャッシュする
+
+    クラスタIDはデータを連結したときの行番号なので、学習データとテストデータにまたがる重複も同じIDになる。
+    キャッシュのファイル名には元データのハッシュとパラメータを含めるため、どちらかが変わると作り直される
+
+    Args:
+        data_paths: 前処理済みデータのパス
+        threshold: 重複とみなす推定Jaccard係数の下限
+        num_perm: MinHashのシグネチャの長さ
+        bands: LSHのバンド数
+        shingle_size: n-gramの文字数
+        num_workers: シグネチャを計算するプロセス数。Noneの場合は使用可能なコア数
+
+    Returns:
+        list[np.ndarray]: data_pathsと同じ順番の、各データの行ごとのクラスタID
+    """
+    params = {"threshold": threshold, "num_perm": num_perm, "bands": bands, "shingle_size": shingle_size}
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    for path in data_paths:
+        digest.update(hash_source(path).encode())
+    first = Path(data_paths[0])
+    cache_path = first.with_name(f"{first.stem}_clusters_{digest.hexdigest()[:16]}.npz")
+    if cache_path.exists():
+        with np.load(cache_path) as cache:
+            return [cache[f"arr_{i}"] for i in range(len(data_paths))]
+
+    texts = [read_processed(path)["summary"].to_list() for path in data_paths]
+    signatures = minhash_signatures(
+        [text for part in texts for text in part], num_perm=num_perm, shingle_size=shingle_size, num_workers=num_workers
+    )
+    clusters = lsh_clusters(signatures, bands=bands, threshold=threshold)
+    parts = np.split(clusters, np.cumsum([len(part) for part in texts])[:-1])
+    tmp_path = cache_path.with_name(cache_path.stem + ".tmp.npz")
+    np.savez(tmp_path, *parts)
+    os.replace(tmp_path, cache_path)
+    return parts
+
+
+def group_split(groups: np.ndarray, val_fraction: float, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """同じグループの行が学習と検証に分かれないように、グループ単位で分割する
+
+    グループの並びをシードで決まる順番にシャッフルし、行数の累計が全体の(1 - val_fraction)を超えない範囲を学習に回す
+
+    Args:
+        groups: 行ごとのグループID
+        val_fraction: 検証に回す行の割合
+        seed: シャッフルのシード
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 学習と検証の行番号(groupsの位置)
+    """
+    unique, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    order = np.random.default_rng(seed).permutation(len(unique))
+    n_train_groups = np.searchsorted(np.cumsum(counts[order]), (1 - val_fraction) * len(groups), side="right")
+    is_train = np.zeros(len(unique), dtype=bool)
+    is_train[order[:n_train_groups]] = True
+    rows = np.random.default_rng(seed).permutation(len(groups))
+    return rows[is_train[inverse[rows]]], rows[~is_train[inverse[rows]]]
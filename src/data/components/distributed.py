@@ -0,0 +1,61 @@
+import torch
+from lightning.pytorch import Trainer
+from lightning.pytorch.overrides.distributed import UnrepeatedDistributedSampler
+from torch.utils.data import Dataset, DistributedSampler
+
+
+def is_distributed(trainer: Trainer | None) -> bool:
+    """Trainerが複数プロセスで実行されているかどうか"""
+    return trainer is not None and trainer.world_size > 1
+
+
+def injects_distributed_sampler(trainer: Trainer | None) -> bool:
+    """複数プロセスで実行し、LightningがDataLoaderにDistributedSamplerを差し込むかどうか
+
+    Lightningは、samplerがDistributedSamplerでないDataLoaderを作り直してサンプラを差し込む。
+    カスタムのbatch_samplerは作り直せないため、この場合はDistributedSamplerを使うDataLoaderを返す必要がある
+    (trainer.use_distributed_sampler=Falseの場合はデータモジュールが自分でランクごとに分ける)
+    """
+    # Trainerはuse_distributed_samplerを公開していないため、AcceleratorConnectorから読む
+    return is_distributed(trainer) and trainer._accelerator_connector.use_distributed_sampler
+
+
+def shared_seed(trainer: Trainer | None) -> int:
+    """全てのランクで共通のシャッフルのシード
+
+    seed_everythingを呼ばない場合はプロセスごとにtorchのシードが異なるため、ランク0のシードを配る。
+    ランクごとに異なる順番でシャッフルすると、分けたデータに重複や抜けが生じる
+    """
+    seed = torch.initial_seed() % 2**32
+    if is_distributed(trainer):
+        seed = trainer.strategy.broadcast(seed)
+    return seed
+
+
+def distributed_sampler(dataset: Dataset, trainer: Trainer | None, shuffle: bool) -> DistributedSampler | None:
+    """DDPのときに、データセットをランクごとに分けるサンプラを返す。1プロセスの場合はNone
+
+    学習時は件数を揃えるためにサンプルを重複させ、全てのランクのステップ数を一致させる(勾配の同期で待ち続けないように)。
+    評価時は重複させずに分け、ランクごとの件数が異なってもよいものとする(評価指標がずれないように)。
+
+    Args:
+        dataset: 分けるデータセット
+        trainer: データモジュールを実行しているTrainer
+        shuffle: 学習用(シャッフルしてランク間で件数を揃える)かどうか
+
+    Returns:
+        DistributedSampler | None: DataLoaderのsamplerに渡すサンプラ
+    """
+    if not is_distributed(trainer):
+        return None
+    if shuffle:
+        return DistributedSampler(
+            dataset,
+            num_replicas=trainer.world_size,
+            rank=trainer.global_rank,
+            shuffle=True,
+            seed=shared_seed(trainer),
+        )
+    return UnrepeatedDistributedSampler(
+        dataset, num_replicas=trainer.world_size, rank=trainer.global_rank, shuffle=False
+    )
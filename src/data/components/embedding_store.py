@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from src.data.components.batching import pad_to_longest
+from src.data.components.token_store import TokenStore
+
+
+def hash_module(module: torch.nn.Module) -> str:
+    """モジュールの重みからハッシュ値を計算する
+
+    事前学習済みのモデルでも学習済みのチェックポイントから読み込んだモデルでも、
+    重みが同じなら同じ値になる
+
+    Args:
+        module: ハッシュを計算するモジュール
+
+    Returns:
+        str: sha256の16進文字列
+    """
+    digest = hashlib.sha256()
+    for name, tensor in sorted(module.state_dict().items()):
+        tensor = tensor.detach().cpu().contiguous()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.flatten().view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def embedding_key(encoder_hash: str, token_store: TokenStore) -> str:
+    """エンコーダの重みのハッシュとTokenStoreのディレクトリ名からキャッシュのディレクトリ名を作る
+
+    TokenStoreのディレクトリ名はトークナイザ名、max_length、元データのハッシュを含む
+    """
+    return f"{encoder_hash[:16]}_{token_store.path.name}"
+
+
+class EmbeddingStore(Dataset):
+    """固定したエンコーダの文書ベクトルをメモリマップで読み出すDataset
+
+    ベクトルは(行数, 隠れ層の次元)のfloat16の配列として`embeddings.npy`に保存し、
+    `np.load(mmap_mode="r")`で開く。行の並びは元のTokenStoreと同じなので、ラベルは
+    TokenStoreの`labels/{名前}.npy`をそのまま使い、ラベルの語彙を変えてもベクトルを作り直す必要はない。
+    """
+
+    def __init__(self, path: str | os.PathLike, labels_path: str | os.PathLike | None = None) -> None:
+        """
+        Args:
+            path: キャッシュのディレクトリ
+            labels_path: 読み出すラベル配列のパス。Noneの場合はラベルを返さない
+        """
+        self.path = Path(path)
+        self.labels_path = None if labels_path is None else Path(labels_path)
+        self._arrays: dict[str, np.ndarray] | None = None
+
+    def exists(self) -> bool:
+        return (self.path / "meta.json").exists()
+
+    @property
+    def meta(self) -> dict[str, Any]:
+        with open(self.path / "meta.json") as f:
+            return json.load(f)
+
+    @property
+    def arrays(self) -> dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {"embeddings": np.load(self.path / "embeddings.npy", mmap_mode="r")}
+            if self.labels_path is not None:
+                self._arrays["labels"] = np.load(self.labels_path, mmap_mode="r")
+        return self._arrays
+
+    def __len__(self) -> int:
+        return len(self.arrays["embeddings"])
+
+    def __getitem__(self, index: int) -> dict[str, torch.Tensor]:
+        return {field: tensor[0] for field, tensor in self.__getitems__([index]).items()}
+
+    def __getitems__(self, indices: list[int]) -> dict[str, torch.Tensor]:
+        # DataLoaderからバッチ単位で呼ばれ、行をまとめて読み出す(collate_tokensでそのままバッチになる)
+        indices = np.asarray(indices)
+        batch = {"embeddings": torch.from_numpy(self.arrays["embeddings"][indices].astype(np.float32))}
+        if "labels" in self.arrays:
+            batch["labels"] = torch.from_numpy(self.arrays["labels"][indices].astype(np.int64))
+        return batch
+
+    def __getstate__(self) -> dict[str, Any]:
+        # 配列の中身ではなくパスだけを渡し、ワーカー側で開き直す
+        return {"path": self.path, "labels_path": self.labels_path, "_arrays": None}
+
+    @classmethod
+    def build(
+        cls,
+        path: str | os.PathLike,
+        token_store: TokenStore,
+        encode: Callable[..., torch.Tensor],
+        dim: int,
+        batch_size: int = 256,
+        device: str | torch.device = "cpu",
+        meta: dict[str, Any] | None = None,
+    ) -> "EmbeddingStore":
+        """TokenStoreの全ての行をエンコードし、float16のメモリマップ可能な配列として保存する
+
+        系列長でソートしてからバッチを作り、バッチ内の最長の系列までに切り詰めるため、パディングの計算は最小限になる。
+        一時ディレクトリに書き出してからリネームするため、途中で失敗しても壊れたキャッシュは残らない
+
+        Args:
+            path: 保存先のディレクトリ
+            token_store: エンコードするTokenStore
+            encode: input_ids, attention_mask, token_type_idsを受け取り(バッチサイズ, dim)のベクトルを返す関数
+            dim: ベクトルの次元
+            batch_size: エンコードするバッチサイズ
+            device: エンコードに使うデバイス
+            meta: meta.jsonに追加で記録する情報
+
+        Returns:
+            EmbeddingStore: 保存したEmbeddingStore
+        """
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        n = len(token_store)
+        output = np.lib.format.open_memmap(tmp_path / "embeddings.npy", mode="w+", dtype=np.float16, shape=(n, dim))
+        order = np.argsort(token_store.lengths, kind="stable")
+        with torch.inference_mode():
+            for start in range(0, n, batch_size):
+                indices = order[start:start + batch_size]
+                batch = pad_to_longest(token_store.__getitems__(indices))
+                embeddings = encode(**{field: tensor.to(device) for field, tensor in batch.items()})
+                output[indices] = embeddings.float().cpu().numpy()
+        output.flush()
+
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump({**(meta or {}), "num_rows": n, "dim": dim, "token_store": token_store.path.name}, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
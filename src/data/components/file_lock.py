@@ -0,0 +1,23 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def file_lock(path: str | os.PathLike) -> Iterator[None]:
+    """ファイルの排他ロックをとる。同じマシンの別プロセス(並列に実行するハイパーパラメータ探索の試行など)の間で、
+    キャッシュの作成を1つのプロセスだけが行うようにする
+
+    ロックはプロセスが終了すると自動的に解放される。
+
+    Args:
+        path: ロックに使うファイルのパス。なければ作成する
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
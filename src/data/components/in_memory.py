@@ -0,0 +1,62 @@
+from typing import Sequence
+
+import torch
+from torch.utils.data import Dataset
+
+
+class InMemoryImageDataset(Dataset):
+    """An image classification dataset held in memory as a single raw `uint8` tensor.
+
+    Instead of converting every sample with `ToTensor()` and `Normalize`, the `DataLoader` passes
+    the indices of a whole batch to `__getitems__`, which slices the raw tensor once and normalizes
+    the batch in a single vectorized operation. Use it with ``collate_fn=collate_batch``.
+    """
+
+    def __init__(
+        self,
+        images: torch.Tensor,
+        targets: torch.Tensor,
+        mean: Sequence[float],
+        std: Sequence[float],
+    ) -> None:
+        """Initialize an `InMemoryImageDataset`.
+
+        :param images: Raw images of shape `(N, H, W)` or `(N, C, H, W)` with values in `[0, 255]`.
+        :param targets: Class labels of shape `(N,)`.
+        :param mean: Per-channel mean of the images scaled to `[0, 1]`, as in `transforms.Normalize`.
+        :param std: Per-channel standard deviation of the images scaled to `[0, 1]`.
+        """
+        if images.ndim == 3:
+            images = images.unsqueeze(1)
+        self.images = images.to(torch.uint8).contiguous()
+        self.targets = targets.to(torch.long)
+        # (x / 255 - mean) / std == x * scale - shift
+        std_ = torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+        self.scale = 1.0 / (255.0 * std_)
+        self.shift = torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1) / std_
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        images, targets = self.__getitems__([index])
+        return images[0], targets[0]
+
+    def __getitems__(self, indices: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        """Slice and normalize a whole batch.
+
+        :param indices: The indices of the samples in the batch.
+        :return: A tuple of normalized `float32` images of shape `(B, C, H, W)` and labels of shape `(B,)`.
+        """
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        images = torch.addcmul(-self.shift, self.images[indices], self.scale)
+        return images, self.targets[indices]
+
+
+def collate_batch(batch: tuple[torch.Tensor, torch.Tensor]) -> tuple[torch.Tensor, torch.Tensor]:
+    """Return a batch built by `InMemoryImageDataset.__getitems__` as is.
+
+    :param batch: A tuple of images and labels that is already batched.
+    :return: The same tuple.
+    """
+    return batch
@@ -0,0 +1,97 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from src.data.components.token_store import hash_source
+from src.data.data import read_processed
+
+
+def _fi_groups(fi: pl.Expr) -> pl.Expr:
+    # get_fi_list/fi_list_exprで", "区切りにしたFIメイングループをリストに戻す
+    return fi.str.split(", ").list.eval(pl.element().filter(pl.element() != ""))
+
+
+def count_labels(df: pl.DataFrame) -> pl.DataFrame:
+    """FIメイングループごとの出現件数を数える
+
+    Args:
+        df: FIカラムを含むDataFrame
+
+    Returns:
+        pl.DataFrame: label, countカラムを持ち、件数の多い順に並んだDataFrame
+    """
+    return (
+        df.select(_fi_groups(pl.col("FI")).alias("label"))
+        .explode("label")
+        .drop_nulls()
+        .group_by("label")
+        .agg(pl.len().alias("count"))
+        .sort(["count", "label"], descending=[True, False])
+    )
+
+
+def load_label_counts(data_path: str | os.PathLike, df: pl.DataFrame | None = None) -> pl.DataFrame:
+    """ラベルの出現件数を前処理済みデータの隣にキャッシュし、読み込む
+
+    キャッシュのファイル名には元データのハッシュを含めるため、データが変わると作り直される
+
+    Args:
+        data_path: 前処理済みデータのパス
+        df: data_pathを読み込んだDataFrame。キャッシュがない場合に使う
+
+    Returns:
+        pl.DataFrame: count_labelsの結果
+    """
+    data_path = Path(data_path)
+    cache_path = data_path.with_name(f"{data_path.stem}_label_counts_{hash_source(data_path)[:16]}.parquet")
+    if cache_path.exists():
+        return pl.read_parquet(cache_path)
+
+    counts = count_labels(read_processed(data_path) if df is None else df)
+    counts.write_parquet(cache_path)
+    return counts
+
+
+def label_vocab(counts: pl.DataFrame, min_count: int = 1) -> list[str]:
+    """出現件数がmin_count件以上の全てのラベルを、件数の多い順に語彙とする
+
+    Args:
+        counts: load_label_countsの結果
+        min_count: 語彙に含める最小の出現件数
+
+    Returns:
+        list[str]: ラベルの語彙
+    """
+    return counts.filter(pl.col("count") >= min_count)["label"].to_list()
+
+
+def label_key(vocab: list[str]) -> str:
+    """ラベルの語彙からTokenStoreに保存するラベル配列の名前を作る"""
+    return hashlib.sha256("\n".join(vocab).encode()).hexdigest()[:16]
+
+
+def encode_labels(df: pl.DataFrame, vocab: list[str]) -> np.ndarray:
+    """カンマ区切りのFIメイングループを、語彙に対するmulti-hotの行列に変換する
+
+    行ごとのPythonのループではなく、explodeと語彙とのjoinで(行, ラベル)の組を一度に求める
+
+    Args:
+        df: FIカラムを含むDataFrame
+        vocab: ラベルの語彙
+
+    Returns:
+        np.ndarray: (行数, 語彙数)のint8の行列
+    """
+    vocab_df = pl.DataFrame({"label": vocab, "col": np.arange(len(vocab), dtype=np.int64)})
+    pairs = (
+        df.select(_fi_groups(pl.col("FI")).alias("label"))
+        .with_row_index("row")
+        .explode("label")
+        .join(vocab_df, on="label", how="inner")
+    )
+    labels = np.zeros((len(df), len(vocab)), dtype=np.int8)
+    labels[pairs["row"].to_numpy(), pairs["col"].to_numpy()] = 1
+    return labels
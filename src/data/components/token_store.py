@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from src.data.components.tokenization import tokenize_batched
+
+# トークン化の結果として保存するカラム
+FIELDS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+# Parquetファイルの末尾のマジックナンバー。その直前の4バイトがフッターの長さ
+PARQUET_MAGIC = b"PAR1"
+
+
+def _parquet_footer(f: Any, size: int) -> bytes:
+    """Parquetファイルのフッター(スキーマ、行グループごとの行数・サイズ・統計量)を読む。Parquetでなければ空"""
+    if size < 12:
+        return b""
+    f.seek(-8, os.SEEK_END)
+    tail = f.read(8)
+    if tail[4:] != PARQUET_MAGIC:
+        return b""
+    footer_len = int.from_bytes(tail[:4], "little")
+    f.seek(-(8 + footer_len), os.SEEK_END)
+    return f.read(footer_len)
+
+
+def hash_source(path: str | os.PathLike) -> str:
+    """元データ(ファイルまたはParquetのディレクトリ)を識別するハッシュ値を計算する
+
+    データ全体は読まず、ファイル名、サイズ、更新時刻と、Parquetの場合はフッターから計算する。
+    prepare_dataとsetupの各ランクで何度呼んでも、元データの大きさによらずすぐに返る。
+    ファイルを書き直す(コピーし直す)とハッシュ値が変わり、キャッシュを作り直す
+
+    Args:
+        path: 元データのパス
+
+    Returns:
+        str: sha256の16進文字列
+    """
+    path = Path(path)
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    digest = hashlib.sha256()
+    for file in files:
+        stat = file.stat()
+        digest.update(str(file.relative_to(path) if path.is_dir() else file.name).encode())
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        with open(file, "rb") as f:
+            digest.update(_parquet_footer(f, stat.st_size))
+    return digest.hexdigest()
+
+
+def store_key(model_name: str, max_length: int, source_hash: str) -> str:
+    """トークナイザ名、max_length、元データのハッシュからキャッシュのディレクトリ名を作る"""
+    return f"{model_name.replace('/', '--')}_len{max_length}_{source_hash[:16]}"
+
+
+class EncodingDataset(Dataset):
+    """トークン化済みの配列(input_ids, attention_mask, ...)を行単位で読み出すDataset
+
+    推論時のようにメモリ上の配列をそのまま使う場合に用い、TokenStoreの基底クラスにもなる
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+        """
+        Args:
+            arrays: カラム名から(行数, ...)の配列への辞書
+        """
+        self._arrays = arrays
+
+    @property
+    def arrays(self) -> dict[str, np.ndarray]:
+        return self._arrays
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """[PAD]を除いた各サンプルの系列長"""
+        return self.arrays["attention_mask"].sum(1, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.arrays["input_ids"])
+
+    def __getitem__(self, index: int) -> dict[str, torch.Tensor]:
+        return {
+            field: torch.from_numpy(array[index].astype(np.int64)) for field, array in self.arrays.items()
+        }
+
+    def __getitems__(self, indices: list[int]) -> dict[str, torch.Tensor]:
+        # DataLoaderからバッチ単位で呼ばれ、行をまとめて読み出す(collate_tokensでそのままバッチになる)
+        indices = np.asarray(indices)
+        return {
+            field: torch.from_numpy(array[indices].astype(np.int64)) for field, array in self.arrays.items()
+        }
+
+
+class TokenStore(EncodingDataset):
+    """トークン化済みのデータをメモリマップで読み出すDataset
+
+    各カラムは連続した整数の配列として`.npy`に保存し、`np.load(mmap_mode="r")`で開く。
+    ファイルはページキャッシュ経由で共有されるため、DDPの各プロセスやDataLoaderのワーカーが
+    それぞれデータ全体のコピーを持つことはない。配列は最初にアクセスしたプロセスで開き、
+    pickle時にはパスだけを渡す。
+
+    ラベルはトークンとは別に`labels/{名前}.npy`として保存するため、ラベルの語彙を変えても
+    トークン化をやり直す必要はない。
+    """
+
+    def __init__(self, path: str | os.PathLike, labels: str | None = None) -> None:
+        """
+        Args:
+            path: キャッシュのディレクトリ
+            labels: 読み出すラベル配列の名前。Noneの場合はラベルを返さない
+        """
+        self.path = Path(path)
+        self.labels = labels
+        self._arrays: dict[str, np.ndarray] | None = None
+
+    def exists(self) -> bool:
+        return (self.path / "meta.json").exists()
+
+    @property
+    def meta(self) -> dict[str, Any]:
+        with open(self.path / "meta.json") as f:
+            return json.load(f)
+
+    @property
+    def arrays(self) -> dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {
+                field: np.load(self.path / f"{field}.npy", mmap_mode="r") for field in FIELDS
+            }
+            if self.labels is not None:
+                self._arrays["labels"] = np.load(self.labels_path(self.labels), mmap_mode="r")
+        return self._arrays
+
+    def labels_path(self, name: str) -> Path:
+        return self.path / "labels" / f"{name}.npy"
+
+    def has_labels(self, name: str) -> bool:
+        return self.labels_path(name).exists()
+
+    def write_labels(self, name: str, labels: np.ndarray, vocab: list[str]) -> None:
+        """(行数, ラベル数)のラベル配列と、その語彙を保存する
+
+        Args:
+            name: ラベル配列の名前
+            labels: ラベル配列
+            vocab: 各列に対応するラベル
+        """
+        if len(labels) != self.meta["num_rows"]:
+            raise ValueError(f"Number of labels ({len(labels)}) does not match number of rows ({self.meta['num_rows']}).")
+        (self.path / "labels").mkdir(exist_ok=True)
+        tmp_path = self.path / "labels" / f"{name}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(labels, dtype=np.int8))
+        with open(self.path / "labels" / f"{name}.json", "w") as f:
+            json.dump(vocab, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.labels_path(name))
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """[PAD]を除いた各サンプルの系列長"""
+        path = self.path / "lengths.npy"
+        if path.exists():
+            return np.load(path, mmap_mode="r")
+        return self.arrays["attention_mask"].sum(1, dtype=np.int32)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # 配列の中身ではなくパスだけを渡し、ワーカー側で開き直す
+        return {"path": self.path, "labels": self.labels, "_arrays": None}
+
+    @classmethod
+    def build(
+        cls,
+        path: str | os.PathLike,
+        texts: list[str],
+        tokenizer: Any,
+        max_length: int,
+        num_workers: int | None = None,
+        meta: dict[str, Any] | None = None,
+    ) -> "TokenStore":
+        """テキストをトークン化し、メモリマップ可能な配列として保存する
+
+        一時ディレクトリに書き出してからリネームするため、途中で失敗しても壊れたキャッシュは残らない
+
+        Args:
+            path: 保存先のディレクトリ
+            texts: トークン化するテキスト
+            tokenizer: Hugging Faceのトークナイザ
+            max_length: トークン列の長さ
+            num_workers: トークン化に使うプロセス数。Noneの場合は使用可能なコア数
+            meta: meta.jsonに追加で記録する情報
+
+        Returns:
+            TokenStore: 保存したTokenStore
+        """
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        n = len(texts)
+        # 語彙数がint16に収まる場合はint16で保存する
+        ids_dtype = np.int16 if len(tokenizer) <= np.iinfo(np.int16).max else np.int32
+        dtypes = {
+            "input_ids": ids_dtype,
+            "attention_mask": np.int8,
+            "token_type_ids": np.int8,
+        }
+        outputs = {
+            field: np.lib.format.open_memmap(tmp_path / f"{field}.npy", mode="w+", dtype=dtype, shape=(n, max_length))
+            for field, dtype in dtypes.items()
+        }
+        for start, encoding in tokenize_batched(texts, tokenizer, max_length, num_workers=num_workers):
+            for field, output in outputs.items():
+                output[start:start + len(encoding[field])] = encoding[field]
+        for output in outputs.values():
+            output.flush()
+        np.save(tmp_path / "lengths.npy", outputs["attention_mask"].sum(1, dtype=np.int32))
+
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump({**(meta or {}), "num_rows": n, "max_length": max_length}, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
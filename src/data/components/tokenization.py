@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator
+
+import numpy as np
+
+# ワーカープロセスごとに保持するトークナイザ
+_tokenizer: Any = None
+
+
+def available_cores() -> int:
+    """このプロセスが使用できるCPUコア数を返す"""
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def _init_worker(tokenizer: Any) -> None:
+    global _tokenizer
+    _tokenizer = tokenizer
+
+
+def _tokenize_chunk(texts: list[str], max_length: int) -> dict[str, np.ndarray]:
+    encoding = _tokenizer(
+        texts,
+        max_length=max_length,
+        padding="max_length",
+        truncation=True,
+        return_tensors="np",
+    )
+    return dict(encoding)
+
+
+def tokenizer_pool(tokenizer: Any, num_workers: int | None = None) -> ProcessPoolExecutor | None:
+    """トークン化用のプロセスプールを作る。ワーカーが1つ以下の場合はNoneを返す
+
+    tokenize_batchedを何度も呼ぶ場合(推論時のチャンクごとなど)に、ワーカーの起動を1回で済ませるために使う
+
+    Args:
+        tokenizer: Hugging Faceのトークナイザ(各ワーカーにpickleして渡す)
+        num_workers: ワーカープロセス数。Noneの場合は使用可能なコア数
+
+    Returns:
+        ProcessPoolExecutor | None: プロセスプール
+    """
+    if num_workers is None:
+        num_workers = available_cores()
+    if num_workers <= 1:
+        return None
+
+    # polarsなどのスレッドを持つプロセスをforkするとデッドロックしうるため、spawnでワーカーを起動する
+    return ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(tokenizer,),
+    )
+
+
+def tokenize_batched(
+    texts: list[str],
+    tokenizer: Any,
+    max_length: int,
+    num_workers: int | None = None,
+    chunk_size: int = 1024,
+    executor: ProcessPoolExecutor | None = None,
+) -> Iterator[tuple[int, dict[str, np.ndarray]]]:
+    """テキストをチャンク単位でまとめてトークン化する
+
+    MeCabによる単語分割はCPUバウンドなので、チャンクをプロセスプールに分散させる。
+    結果は入力と同じ順番で返す。
+
+    Args:
+        texts: トークン化するテキスト
+        tokenizer: Hugging Faceのトークナイザ(各ワーカーにpickleして渡す)
+        max_length: トークン列の長さ
+        num_workers: ワーカープロセス数。Noneの場合は使用可能なコア数
+        chunk_size: 1回にトークナイザへ渡すテキスト数
+        executor: tokenizer_poolで作ったプロセスプール。指定した場合はnum_workersを無視する
+
+    Yields:
+        tuple[int, dict[str, np.ndarray]]: チャンクの先頭の行番号と、(チャンク長, max_length)の配列の辞書
+    """
+    starts = range(0, len(texts), chunk_size)
+    chunks = (texts[start:start + chunk_size] for start in starts)
+
+    if executor is not None:
+        # Executor.mapは入力の順番で結果を返す
+        yield from zip(starts, executor.map(_tokenize_chunk, chunks, [max_length] * len(starts)))
+        return
+
+    executor = tokenizer_pool(tokenizer, num_workers)
+    if executor is None:
+        _init_worker(tokenizer)
+        yield from zip(starts, (_tokenize_chunk(chunk, max_length) for chunk in chunks))
+        return
+
+    with executor:
+        yield from zip(starts, executor.map(_tokenize_chunk, chunks, [max_length] * len(starts)))
@@ -1,8 +1,25 @@
+import argparse
+import hashlib
+import json
+import os
 import re
+import shutil
+import time
 import unicodedata
+from pathlib import Path
 
 import polars as pl
 
+YEARS = ["2018", "2019", "2020", "2021", "2022", "2023", "2024"]
+TEST_YEARS = ["2024"]
+ROW_GROUP_SIZE = 16_384
+# 整形処理(clean_text_expr, fi_list_expr)や出力の形式を変えたら上げる。manifestの値と異なれば全ての年を作り直す
+PREPROCESS_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# clean_textで削除する定型の見出し
+_REMOVE_MARKERS = ["【要約】", "【課題】", "【解決手段】", "(修正有)"]
+
 def clean_text(text):
     text = unicodedata.normalize("NFKC", text)
     # (57) や任意の数字の括弧を削除
@@ -23,25 +40,286 @@ def get_fi_list(elements):
     elements = ", ".join(elements)
     return elements
 
+def clean_text_expr(expr: pl.Expr) -> pl.Expr:
+    """clean_textと同じ処理をpolarsの式だけで組み立てる
+
+    Pythonの関数を行ごとに呼ばないため、GILを取らずにpolarsのスレッドプールで並列に実行される
+
+    Args:
+        expr (pl.Expr): 要約の文字列カラム
+
+    Returns:
+        pl.Expr: 整形後の文字列カラム
+    """
+    expr = expr.str.normalize("NFKC")
+    # (57) や任意の数字の括弧を削除
+    expr = expr.str.replace_all(r"\(\d+\)", "")
+    for marker in _REMOVE_MARKERS:
+        expr = expr.str.replace_all(marker, "", literal=True)
+    # 【選択図】図３（数字は任意）を削除
+    expr = expr.str.replace_all(r"【選択図】図\d+", "")
+    expr = expr.str.replace_all("\n", "", literal=True)
+    return expr
+
+def fi_list_expr(expr: pl.Expr) -> pl.Expr:
+    """get_fi_listと同じ処理をpolarsの式だけで組み立てる
+
+    get_fi_listはsetで重複を除くため並び順が実行ごとに変わるが、こちらは初出順に固定する
+
+    Args:
+        expr (pl.Expr): カンマ区切りのFIカラム
+
+    Returns:
+        pl.Expr: 重複を除いたFIメイングループを", "で連結したカラム
+    """
+    element = pl.element()
+    return (
+        expr.str.split(",")
+        .list.eval(element.filter(element.str.contains("/", literal=True)).str.extract(r"^([^/]+)", 1))
+        .list.unique(maintain_order=True)
+        .list.join(", ")
+    )
+
 def extract_dataframe(df):
     df = df.select([
-        pl.col("要約").map_elements(clean_text, return_dtype=pl.String).alias("summary"),
-        pl.col("FI").map_elements(get_fi_list, return_dtype=pl.String).alias("FI")
+        clean_text_expr(pl.col("要約")).alias("summary"),
+        fi_list_expr(pl.col("FI")).alias("FI")
     ])
     return df
 
-def main():
+def scan_raw(raw_dir, years):
+    """複数年の生CSVをまとめて遅延読み込みし、整形済みのLazyFrameを返す
+
+    Args:
+        raw_dir: patent_deeplearning_{year}.csvが置かれたディレクトリ
+        years: 読み込む年のリスト
+
+    Returns:
+        pl.LazyFrame: summary, FI, yearカラムを持つLazyFrame
+    """
+    paths = [f"{raw_dir}/patent_deeplearning_{year}.csv" for year in years]
+    lf = pl.scan_csv(paths, infer_schema=False, include_file_paths="path")
+    # ファイル名から年を取り出し、ルーティングに使う
+    year = pl.col("path").str.extract(r"patent_deeplearning_(\d+)\.csv$", 1)
+    return lf.select([
+        clean_text_expr(pl.col("要約")).alias("summary"),
+        fi_list_expr(pl.col("FI")).alias("FI"),
+        year.alias("year"),
+    ])
+
+def process_streaming(raw_dir, processed_dir, years=YEARS, test_years=TEST_YEARS):
+    """ストリーミングエンジンで整形し、年ごとに分割したParquetとして書き出す
+
+    train は全ての年、test は test_years の年を含む。
+    CSVの読み込みから書き出しまでをチャンク単位で処理するため、年数が増えてもメモリ使用量はほとんど増えない
+
+    Args:
+        raw_dir: 生CSVのディレクトリ
+        processed_dir: 出力先ディレクトリ(train/year=YYYY/*.parquet, test/year=YYYY/*.parquet)
+        years: 読み込む年のリスト
+        test_years: テストに回す年のリスト
+    """
+    lf = scan_raw(raw_dir, years)
+    # 年ごとのライターは最後まで開いたままなので、行グループを小さくしてライター毎のバッファを抑える
+    lf.sink_parquet(
+        pl.PartitionByKey(f"{processed_dir}/train", by="year", include_key=False),
+        mkdir=True,
+        row_group_size=ROW_GROUP_SIZE,
+        engine="streaming",
+    )
+    # testはtrainの該当する年のパーティションだけを読み直す(生CSVを再度スキャンしない)
+    test = pl.scan_parquet(f"{processed_dir}/train", hive_schema={"year": pl.String})
+    test.filter(pl.col("year").is_in(test_years)).sink_parquet(
+        pl.PartitionByKey(f"{processed_dir}/test", by="year", include_key=False),
+        mkdir=True,
+        row_group_size=ROW_GROUP_SIZE,
+        engine="streaming",
+    )
+
+def raw_path(raw_dir, year):
+    return Path(raw_dir) / f"patent_deeplearning_{year}.csv"
+
+def fingerprint(path, previous=None):
+    """生CSVのサイズ、更新時刻、内容のハッシュを返す
+
+    サイズと更新時刻がpreviousと同じ場合は、ファイルを読まずにpreviousのハッシュを使う
+
+    Args:
+        path: 生CSVのパス
+        previous: 前回のfingerprintの結果
+
+    Returns:
+        dict: size, mtime_ns, sha256を持つ辞書
+    """
+    stat = os.stat(path)
+    if previous is not None and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": previous["sha256"]}
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+def read_manifest(processed_dir):
+    path = Path(processed_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"version": PREPROCESS_VERSION, "years": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def _replace_dir(tmp_path, path):
+    # 一時ディレクトリに書き出してから置き換え、途中で失敗しても前回の結果を壊さない
+    shutil.rmtree(path, ignore_errors=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, path)
+
+def process_year(raw_dir, processed_dir, year):
+    """1年分の生CSVを整形し、trainの年のパーティション(train/year=YYYY/0.parquet)を置き換える
+
+    Args:
+        raw_dir: 生CSVのディレクトリ
+        processed_dir: 出力先ディレクトリ
+        year: 処理する年
+
+    Returns:
+        int: 書き出した行数
+    """
+    path = Path(processed_dir) / "train" / f"year={year}"
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    lf = pl.scan_csv(raw_path(raw_dir, year), infer_schema=False)
+    lf.select([
+        clean_text_expr(pl.col("要約")).alias("summary"),
+        fi_list_expr(pl.col("FI")).alias("FI"),
+    ]).sink_parquet(tmp_path / "0.parquet", row_group_size=ROW_GROUP_SIZE, engine="streaming")
+    rows = pl.scan_parquet(tmp_path / "0.parquet").select(pl.len()).collect().item()
+    _replace_dir(tmp_path, path)
+    return rows
+
+def process_incremental(raw_dir, processed_dir, years=YEARS, test_years=TEST_YEARS, force=False):
+    """前回から変わった年の生CSVだけを整形し直し、train/testを組み立て直す
+
+    生CSVごとのfingerprint(サイズ、更新時刻、内容のハッシュ)をprocessed_dir/manifest.jsonに記録し、
+    ハッシュが変わった年、新しく追加された年、出力がない年だけを作り直す。更新時刻だけが変わった場合は作り直さない。
+    出力の形式はprocess_streamingと同じ(train/year=YYYY/*.parquet, test/year=YYYY/*.parquet)で、
+    testはtrainの該当する年のパーティションをコピーする。
+
+    Args:
+        raw_dir: 生CSVのディレクトリ
+        processed_dir: 出力先ディレクトリ
+        years: 読み込む年のリスト
+        test_years: テストに回す年のリスト
+        force: 変更の有無によらず全ての年を作り直す
+
+    Returns:
+        dict: 書き出したmanifest。rebuiltに作り直した年、removedに削除した年を持つ
+
+    Raises:
+        ValueError: test_yearsにyearsに含まれない年がある場合。出力には手を付けない
+    """
+    # testはtrainのパーティションをコピーするため、yearsから外した年をテストに残すことはできない
+    missing = [year for year in test_years if year not in years]
+    if missing:
+        raise ValueError(
+            f"test_years {missing} are not in years {list(years)}. Add them to years or remove them from test_years."
+        )
+
+    processed_dir = Path(processed_dir)
+    previous = read_manifest(processed_dir)
+    if previous.get("version") != PREPROCESS_VERSION:
+        force = True
+    previous_years = previous["years"]
+
+    years_meta = {}
+    rebuilt = []
+    for year in years:
+        prev = None if force else previous_years.get(year)
+        fp = fingerprint(raw_path(raw_dir, year), prev)
+        partition = processed_dir / "train" / f"year={year}"
+        if prev is not None and prev["sha256"] == fp["sha256"] and partition.exists():
+            years_meta[year] = {**fp, "rows": prev["rows"]}
+            continue
+        years_meta[year] = {**fp, "rows": process_year(raw_dir, processed_dir, year)}
+        rebuilt.append(year)
+
+    # years から外れた年のパーティションを削除する
+    removed = sorted(set(previous_years) - set(years))
+    for year in removed:
+        shutil.rmtree(processed_dir / "train" / f"year={year}", ignore_errors=True)
+
+    # testは作り直した年と、新しくテストに回した年だけをコピーし直す
+    test_dir = processed_dir / "test"
+    for year in test_years:
+        path = test_dir / f"year={year}"
+        if year in rebuilt or year not in previous.get("test_years", []) or not path.exists():
+            tmp_path = path.with_name(path.name + ".tmp")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.copytree(processed_dir / "train" / f"year={year}", tmp_path)
+            _replace_dir(tmp_path, path)
+    if test_dir.exists():
+        for path in test_dir.iterdir():
+            if path.name.removeprefix("year=") not in test_years:
+                shutil.rmtree(path)
+
+    manifest = {
+        "version": PREPROCESS_VERSION,
+        "years": years_meta,
+        "test_years": list(test_years),
+        "rebuilt": rebuilt,
+        "removed": removed,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    tmp_path = processed_dir / f"{MANIFEST_NAME}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, processed_dir / MANIFEST_NAME)
+    return manifest
+
+def process_eager(raw_dir, processed_dir, years=YEARS, test_years=TEST_YEARS):
+    """年ごとにCSVを読み込み、全体を連結してCSVに書き出す(従来の処理)"""
     dataframes = []
-    for year in ["2018", "2019", "2020", "2021", "2022", "2023", "2024"]:
-        df = pl.read_csv(f"./data/raw/patent_deeplearning_{year}.csv")
+    for year in years:
+        df = pl.read_csv(f"{raw_dir}/patent_deeplearning_{year}.csv")
         df = extract_dataframe(df)
-        if year == "2024":
-            df.write_csv("./data/processed/test.csv")
+        if year in test_years:
+            df.write_csv(f"{processed_dir}/test.csv")
         dataframes.append(df)
-        
+
     df_train = pl.concat(dataframes)
-    df_train.write_csv("./data/processed/train.csv")
+    df_train.write_csv(f"{processed_dir}/train.csv")
+
+def read_processed(path):
+    """前処理済みデータを読み込む
+
+    Args:
+        path: process_eagerのCSV、またはprocess_streamingのParquetディレクトリ
+
+    Returns:
+        pl.DataFrame: summary, FIカラムを含むDataFrame
+    """
+    if str(path).endswith(".csv"):
+        return pl.read_csv(path)
+    return pl.scan_parquet(path, hive_schema={"year": pl.String}).collect()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw-dir", default="./data/raw")
+    parser.add_argument("--processed-dir", default="./data/processed")
+    parser.add_argument("--years", nargs="+", default=YEARS)
+    parser.add_argument("--test-years", nargs="+", default=TEST_YEARS)
+    parser.add_argument("--eager", action="store_true", help="従来の処理でCSVに書き出す")
+    parser.add_argument("--force", action="store_true", help="変更の有無によらず全ての年を作り直す")
+    args = parser.parse_args()
+
+    if args.eager:
+        process_eager(args.raw_dir, args.processed_dir, args.years, args.test_years)
+        return
+
+    start = time.perf_counter()
+    manifest = process_incremental(args.raw_dir, args.processed_dir, args.years, args.test_years, force=args.force)
+    print(
+        f"rebuilt: {manifest['rebuilt'] or 'none'}, removed: {manifest['removed'] or 'none'} "
+        f"({time.perf_counter() - start:.2f} sec)"
+    )
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
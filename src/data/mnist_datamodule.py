@@ -6,6 +6,13 @@ from torch.utils.data import ConcatDataset, DataLoader, Dataset, random_split
 from torchvision.datasets import MNIST
 from torchvision.transforms import transforms
 
+from src.data.components.distributed import distributed_sampler
+from src.data.components.in_memory import InMemoryImageDataset, collate_batch
+
+# Mean and standard deviation of the MNIST training images scaled to [0, 1]
+MNIST_MEAN = (0.1307,)
+MNIST_STD = (0.3081,)
+
 
 class MNISTDataModule(LightningDataModule):
     """`LightningDataModule` for the MNIST dataset.
@@ -59,6 +66,7 @@ class MNISTDataModule(LightningDataModule):
         batch_size: int = 64,
         num_workers: int = 0,
         pin_memory: bool = False,
+        in_memory: bool = False,
     ) -> None:
         """Initialize a `MNISTDataModule`.
 
@@ -67,6 +75,8 @@ class MNISTDataModule(LightningDataModule):
         :param batch_size: The batch size. Defaults to `64`.
         :param num_workers: The number of workers. Defaults to `0`.
         :param pin_memory: Whether to pin memory. Defaults to `False`.
+        :param in_memory: Whether to keep all images as one raw `uint8` tensor and build whole batches by
+            slicing it, instead of transforming every sample with `ToTensor()` and `Normalize`. Defaults to `False`.
         """
         super().__init__()
 
@@ -76,7 +86,7 @@ class MNISTDataModule(LightningDataModule):
 
         # data transformations
         self.transforms = transforms.Compose(
-            [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
+            [transforms.ToTensor(), transforms.Normalize(MNIST_MEAN, MNIST_STD)]
         )
 
         self.data_train: Dataset | None = None
@@ -126,51 +136,66 @@ class MNISTDataModule(LightningDataModule):
         if not self.data_train and not self.data_val and not self.data_test:
             trainset = MNIST(self.hparams.data_dir, train=True, transform=self.transforms)
             testset = MNIST(self.hparams.data_dir, train=False, transform=self.transforms)
-            dataset = ConcatDataset(datasets=[trainset, testset])
+            if self.hparams.in_memory:
+                # same order as the `ConcatDataset`, so `random_split` below yields the same splits
+                dataset = InMemoryImageDataset(
+                    torch.cat([trainset.data, testset.data]),
+                    torch.cat([trainset.targets, testset.targets]),
+                    mean=MNIST_MEAN,
+                    std=MNIST_STD,
+                )
+            else:
+                dataset = ConcatDataset(datasets=[trainset, testset])
             self.data_train, self.data_val, self.data_test = random_split(
                 dataset=dataset,
                 lengths=self.hparams.train_val_test_split,
                 generator=torch.Generator().manual_seed(42),
             )
 
-    def train_dataloader(self) -> DataLoader[Any]:
-        """Create and return the train dataloader.
+    def _dataloader(self, dataset: Dataset, shuffle: bool) -> DataLoader[Any]:
+        """Create a dataloader.
 
-        :return: The train dataloader.
+        In the in-memory mode, the `BatchSampler` that `DataLoader` builds from `batch_size` passes the indices of
+        a whole batch to the dataset's `__getitems__`, which returns an already batched and normalized tuple.
+
+        When running with several processes, the dataset is split across ranks here, so the loaders also work
+        with `trainer.use_distributed_sampler=False` (see `configs/trainer/ddp_cpu.yaml`).
+
+        :param dataset: The dataset to load.
+        :param shuffle: Whether to shuffle the samples.
+        :return: The dataloader.
         """
+        sampler = distributed_sampler(dataset, self.trainer, shuffle)
         return DataLoader(
-            dataset=self.data_train,
+            dataset=dataset,
             batch_size=self.batch_size_per_device,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
-            shuffle=True,
+            shuffle=shuffle and sampler is None,
+            sampler=sampler,
+            collate_fn=collate_batch if self.hparams.in_memory else None,
         )
 
+    def train_dataloader(self) -> DataLoader[Any]:
+        """Create and return the train dataloader.
+
+        :return: The train dataloader.
+        """
+        return self._dataloader(self.data_train, shuffle=True)
+
     def val_dataloader(self) -> DataLoader[Any]:
         """Create and return the validation dataloader.
 
         :return: The validation dataloader.
         """
-        return DataLoader(
-            dataset=self.data_val,
-            batch_size=self.batch_size_per_device,
-            num_workers=self.hparams.num_workers,
-            pin_memory=self.hparams.pin_memory,
-            shuffle=False,
-        )
+        return self._dataloader(self.data_val, shuffle=False)
 
     def test_dataloader(self) -> DataLoader[Any]:
         """Create and return the test dataloader.
 
         :return: The test dataloader.
         """
-        return DataLoader(
-            dataset=self.data_test,
-            batch_size=self.batch_size_per_device,
-            num_workers=self.hparams.num_workers,
-            pin_memory=self.hparams.pin_memory,
-            shuffle=False,
-        )
+        return self._dataloader(self.data_test, shuffle=False)
 
     def teardown(self, stage: str | None = None) -> None:
         """Lightning hook for cleaning up after `trainer.fit()`, `trainer.validate()`,
@@ -1,12 +1,25 @@
-from typing import Any
-import random
+from functools import partial
+from typing import Any, Sequence
 
-import polars as pl
+import numpy as np
 import torch
 from lightning.pytorch import LightningDataModule
-from torch.utils.data import DataLoader, Dataset
-from torchvision.transforms import transforms
-from transformers import BertJapaneseTokenizer
+from lightning.pytorch.utilities import rank_zero_info, rank_zero_warn
+from torch.utils.data import DataLoader, Dataset, Subset
+
+from src.data.components.batching import LengthBucketBatchSampler, collate_tokens, pad_to_longest
+from src.data.components.dedup import group_split, load_clusters
+from src.data.components.distributed import (
+    distributed_sampler,
+    injects_distributed_sampler,
+    is_distributed,
+    shared_seed,
+)
+from src.data.components.embedding_store import EmbeddingStore, embedding_key, hash_module
+from src.data.components.file_lock import file_lock
+from src.data.components.labels import encode_labels, label_key, label_vocab, load_label_counts
+from src.data.components.token_store import TokenStore, hash_source, store_key
+from src.data.data import read_processed
 
 
 class PatentDataModule(LightningDataModule):
@@ -15,10 +28,29 @@ class PatentDataModule(LightningDataModule):
         model_name,
         train_data_path,
         test_data_path,
+        cache_dir,
+        max_length: int = 256,
+        tokenize_workers: int | None = None,
+        labels: Sequence[str] | None = ("G06V30",),
+        min_label_count: int = 1,
+        dynamic_padding: bool = True,
+        pad_to_multiple_of: int | None = None,
+        length_bucketing: bool = True,
+        embedding_cache_dir: str | None = None,
+        embedding_batch_size: int = 256,
+        val_fraction: float = 0.3,
+        split_seed: int = 42,
+        dedup: bool = False,
+        dedup_threshold: float = 0.8,
+        dedup_num_perm: int = 128,
+        dedup_bands: int = 16,
+        dedup_workers: int | None = None,
         train_val_test_split: tuple[int, int, int] = (55_000, 5_000, 10_000),
         batch_size: int = 64,
         num_workers: int = 0,
         pin_memory: bool = False,
+        persistent_workers: bool = False,
+        prefetch_factor: int | None = None,
     ) -> None:
         """
         """
@@ -34,106 +66,254 @@ class PatentDataModule(LightningDataModule):
 
         self.batch_size_per_device = batch_size
 
+        self._label_vocab: list[str] | None = None
+        self._encoder_hash: str | None = None
+
+    @property
+    def label_vocab(self) -> list[str]:
+        """学習に使うラベルの語彙。labelsがNoneの場合は学習データのラベルの出現件数から決まる"""
+        if self._label_vocab is None:
+            if self.hparams.labels is not None:
+                self._label_vocab = list(self.hparams.labels)
+            else:
+                counts = load_label_counts(self.hparams.train_data_path)
+                self._label_vocab = label_vocab(counts, min_count=self.hparams.min_label_count)
+        return self._label_vocab
+
     @property
     def num_classes(self) -> int:
-        return 1
+        return len(self.label_vocab)
+
+    def _token_store(self, data_path, labels: str | None = None) -> TokenStore:
+        # トークナイザ名、max_length、元データのハッシュごとにキャッシュを分ける
+        key = store_key(self.hparams.model_name, self.hparams.max_length, hash_source(data_path))
+        return TokenStore(f"{self.hparams.cache_dir}/{key}", labels=labels)
+
+    def _clusters(self) -> list[np.ndarray]:
+        # 学習データとテストデータをまとめて近似重複のクラスタに分ける。2回目以降はキャッシュを読むだけ
+        return load_clusters(
+            [self.hparams.train_data_path, self.hparams.test_data_path],
+            threshold=self.hparams.dedup_threshold,
+            num_perm=self.hparams.dedup_num_perm,
+            bands=self.hparams.dedup_bands,
+            num_workers=self.hparams.dedup_workers,
+        )
+
+    def _split(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """学習データの行を学習と検証に分ける。分割はsplit_seedだけで決まる
+
+        dedupを有効にした場合は、テストデータと重複する行を除き、各クラスタから最初の1行だけを残したうえで、
+        同じクラスタの行が学習と検証に分かれないようにクラスタ単位で分割する
+        """
+        if not self.hparams.dedup:
+            return group_split(np.arange(n), self.hparams.val_fraction, self.hparams.split_seed)
+
+        train_clusters, test_clusters = self._clusters()
+        _, first = np.unique(train_clusters, return_index=True)
+        rows = np.sort(first)
+        rows = rows[~np.isin(train_clusters[rows], test_clusters)]
+        # 学習・検証の件数が変わるため、dedupなしの実験と比べるときに分かるようにする
+        rank_zero_info(f"Deduplication kept {len(rows)} of {n} training rows.")
+        train, val = group_split(train_clusters[rows], self.hparams.val_fraction, self.hparams.split_seed)
+        return rows[train], rows[val]
+
+    def _encoder(self) -> torch.nn.Module:
+        # 学習するモデルのエンコーダ。重みのハッシュはプロセスごとに一度だけ計算する
+        if self.trainer is None:
+            raise RuntimeError("embedding_cache_dir requires the datamodule to be attached to a Trainer.")
+        model = self.trainer.lightning_module
+        if not model.hparams.get("freeze_encoder"):
+            raise RuntimeError("embedding_cache_dir requires the model to be trained with freeze_encoder=True.")
+        encoder = model.bert_scml
+        if self._encoder_hash is None:
+            self._encoder_hash = hash_module(encoder.bert)
+        return encoder
+
+    def _embedding_store(self, token_store: TokenStore) -> EmbeddingStore:
+        # エンコーダの重みとTokenStoreごとにキャッシュを分ける
+        self._encoder()
+        key = embedding_key(self._encoder_hash, token_store)
+        labels_path = None if token_store.labels is None else token_store.labels_path(token_store.labels)
+        return EmbeddingStore(f"{self.hparams.embedding_cache_dir}/{key}", labels_path=labels_path)
+
+    def _prepare_embeddings(self) -> None:
+        """固定したエンコーダで文書ベクトルを計算してキャッシュに保存する。キャッシュがあれば何もしない"""
+        encoder = self._encoder()
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        for data_path in [self.hparams.train_data_path, self.hparams.test_data_path]:
+            token_store = self._token_store(data_path)
+            store = self._embedding_store(token_store)
+            if store.exists():
+                continue
+            # prepare_dataの時点ではモデルはまだCPUにあるので、エンコードの間だけデバイスに移す
+            encoder.to(device)
+            try:
+                EmbeddingStore.build(
+                    store.path,
+                    token_store,
+                    encoder.pool,
+                    dim=encoder.bert.config.hidden_size,
+                    batch_size=self.hparams.embedding_batch_size,
+                    device=device,
+                    meta={"encoder_hash": self._encoder_hash, "model_name": self.hparams.model_name},
+                )
+            finally:
+                encoder.to("cpu")
+
+    def prepare_data(self) -> None:
+        """トークン化したデータをキャッシュに保存する。キャッシュがあれば何もしない
+
+        Lightningが1プロセスだけで呼び出すため、DDPの各プロセスでトークン化を繰り返すことはない。
+        並列に実行するハイパーパラメータ探索の試行どうしはcache_dirのロックで待ち合わせ、
+        最初の試行が作ったキャッシュを後の試行はそのまま使う
+        """
+        with file_lock(f"{self.hparams.cache_dir}/.lock"):
+            self._prepare_data()
+
+    def _prepare_data(self) -> None:
+        tokenizer = None
+        # ラベルの出現件数を前処理済みデータの隣にキャッシュする
+        load_label_counts(self.hparams.train_data_path)
+        vocab = self.label_vocab
+        for data_path in [self.hparams.train_data_path, self.hparams.test_data_path]:
+            store = self._token_store(data_path)
+            if store.exists() and store.has_labels(label_key(vocab)):
+                continue
+
+            df = read_processed(data_path)
+            if not store.exists():
+                if tokenizer is None:
+                    # transformersはトークン化のキャッシュを作るときにだけ読み込む
+                    from transformers import BertJapaneseTokenizer
+
+                    tokenizer = BertJapaneseTokenizer.from_pretrained(self.hparams.model_name)
+                TokenStore.build(
+                    store.path,
+                    df["summary"].to_list(),
+                    tokenizer,
+                    self.hparams.max_length,
+                    num_workers=self.hparams.tokenize_workers,
+                    meta={"model_name": self.hparams.model_name, "source": str(data_path)},
+                )
+            # FIメイングループをラベルの語彙に対するmulti-hotに変換する
+            store.write_labels(label_key(vocab), encode_labels(df, vocab), vocab)
+
+        if self.hparams.dedup:
+            self._clusters()
+        if self.hparams.embedding_cache_dir is not None:
+            self._prepare_embeddings()
 
     def setup(self, stage: str | None = None) -> None:
-        if not self.data_train and not self.data_val and not self.data_test:
-            MODEL_NAME = self.hparams.model_name
-            df_train = pl.read_csv(self.hparams.train_data_path)
-            df_test = pl.read_csv(self.hparams.test_data_path)
-
-            tokenizer = BertJapaneseTokenizer.from_pretrained(MODEL_NAME)
-
-            G06V30_l_train = []
-            G06V30_l_test = []
-
-            for fi_l in df_train["FI"]:
-                if "G06V30" in fi_l:
-                    encode = 1
-                else:
-                    encode = 0
-                G06V30_l_train.append(encode)
-
-            for fi_l in df_test["FI"]:
-                if "G06V30" in fi_l:
-                    encode = 1
-                else:
-                    encode = 0
-                G06V30_l_test.append(encode)
-
-            max_length = 256
-            train_dataset_for_loader = []
-            test_dataset_for_loader = []
-
-            for i in range(len(df_train)):
-                text = df_train["summary"][i]
-                labels = [G06V30_l_train[i]]
-                encoding = tokenizer(
-                    text,
-                    max_length=max_length,
-                    padding='max_length',
-                    truncation=True
+        # Divide batch size by the number of devices.
+        if self.trainer is not None:
+            if self.hparams.batch_size % self.trainer.world_size != 0:
+                raise RuntimeError(
+                    f"Batch size ({self.hparams.batch_size}) is not divisible by the number of devices ({self.trainer.world_size})."
                 )
-                encoding['labels'] = labels
-                encoding = { k: torch.tensor(v) for k, v in encoding.items() }
-                train_dataset_for_loader.append(encoding)
-
-            for i in range(len(df_test)):
-                text = df_test["summary"][i]
-                labels = [G06V30_l_test[i]]
-                encoding = tokenizer(
-                    text,
-                    max_length=max_length,
-                    padding='max_length',
-                    truncation=True
+            self.batch_size_per_device = self.hparams.batch_size // self.trainer.world_size
+
+            # モデルの出力数とラベルの語彙数が一致していることを確認する
+            num_labels = self.trainer.lightning_module.hparams.get("num_labels")
+            if num_labels is not None and num_labels != self.num_classes:
+                raise RuntimeError(
+                    f"Model num_labels ({num_labels}) does not match the number of labels ({self.num_classes})."
                 )
-                encoding['labels'] = labels
-                encoding = { k: torch.tensor(v) for k, v in encoding.items() }
-                test_dataset_for_loader.append(encoding)
+
+        if not self.data_train and not self.data_val and not self.data_test:
+            # prepare_dataで保存したキャッシュをメモリマップで開くだけなので、データ量によらずすぐに終わる
+            train_store = self._token_store(self.hparams.train_data_path, labels=label_key(self.label_vocab))
+            test_store = self._token_store(self.hparams.test_data_path, labels=label_key(self.label_vocab))
+            if self.hparams.embedding_cache_dir is not None:
+                # 行の並びはTokenStoreと同じなので、同じインデックスで分割できる
+                train_store = self._embedding_store(train_store)
+                test_store = self._embedding_store(test_store)
 
             # データセットの分割
-            random.shuffle(train_dataset_for_loader)
-            n = len(train_dataset_for_loader)
-            n_train = int(0.7*n)
+            train_indices, val_indices = self._split(len(train_store))
+
+            self.data_train = Subset(train_store, train_indices.tolist())
+            self.data_val = Subset(train_store, val_indices.tolist())
+            self.data_test = test_store
 
-            self.data_train = train_dataset_for_loader[:n_train]
-            self.data_val = train_dataset_for_loader[n_train:]
-            self.data_test = test_dataset_for_loader
+    def _dataloader(self, dataset: Dataset, shuffle: bool) -> DataLoader[Any]:
+        # 文書ベクトルは長さが揃っているので、パディングも系列長によるバケットも要らない
+        embeddings = self.hparams.embedding_cache_dir is not None
+        # バッチごとに最長の系列までパディングする
+        if self.hparams.dynamic_padding and not embeddings:
+            collate_fn = partial(pad_to_longest, pad_to_multiple_of=self.hparams.pad_to_multiple_of)
+        else:
+            collate_fn = collate_tokens
+
+        # TokenStoreはpickle時にパスだけを渡すので、各ワーカーは同じメモリマップを開き直してページを共有する
+        loader_kwargs: dict[str, Any] = {
+            "num_workers": self.hparams.num_workers,
+            "pin_memory": self.hparams.pin_memory,
+            "collate_fn": collate_fn,
+        }
+        if self.hparams.num_workers > 0:
+            loader_kwargs["persistent_workers"] = self.hparams.persistent_workers
+            loader_kwargs["prefetch_factor"] = self.hparams.prefetch_factor
+
+        bucketing = self.hparams.length_bucketing and not embeddings
+        if bucketing and injects_distributed_sampler(self.trainer):
+            # Lightningはカスタムのbatch_samplerを作り直せずにエラーになるため、DistributedSamplerで分ける
+            # (評価時はサンプルを重複させないUnrepeatedDistributedSamplerになる)
+            rank_zero_warn(
+                "Length bucketing is disabled because the trainer injects distributed samplers. "
+                "Set `trainer.use_distributed_sampler=False` to bucket batches per rank (configs/trainer/ddp_cpu.yaml)."
+            )
+            bucketing = False
+
+        if bucketing:
+            # 系列長が近いサンプルをまとめ、パディングをさらに減らす
+            if isinstance(dataset, Subset):
+                lengths = dataset.dataset.lengths[dataset.indices]
+            else:
+                lengths = dataset.lengths
+            # DDPではバッチ単位でランクに配る(trainer.use_distributed_sampler=Falseの場合のみ)
+            distributed = is_distributed(self.trainer)
+            batch_sampler = LengthBucketBatchSampler(
+                lengths,
+                batch_size=self.batch_size_per_device,
+                shuffle=shuffle,
+                seed=shared_seed(self.trainer) if shuffle else 0,
+                num_replicas=self.trainer.world_size if distributed else 1,
+                rank=self.trainer.global_rank if distributed else 0,
+                even_shards=shuffle,
+            )
+            return DataLoader(dataset=dataset, batch_sampler=batch_sampler, **loader_kwargs)
+
+        # DDPでは、評価時にサンプルを重複させずにランクごとに分ける(Lightningが差し込むサンプラは件数を揃えるために
+        # 重複させ、評価指標がずれる)。学習時はランク間でステップ数が揃うように分ける
+        sampler = distributed_sampler(dataset, self.trainer, shuffle)
+        return DataLoader(
+            dataset=dataset,
+            batch_size=self.batch_size_per_device,
+            shuffle=shuffle and sampler is None,
+            sampler=sampler,
+            **loader_kwargs,
+        )
 
     def train_dataloader(self) -> DataLoader[Any]:
         """Create and return the train dataloader.
 
         :return: The train dataloader.
         """
-        return DataLoader(
-            dataset=self.data_train,
-            batch_size=self.batch_size_per_device,
-            shuffle=True,
-        )
+        return self._dataloader(self.data_train, shuffle=True)
 
     def val_dataloader(self) -> DataLoader[Any]:
         """Create and return the validation dataloader.
 
         :return: The validation dataloader.
         """
-        return DataLoader(
-            dataset=self.data_val,
-            batch_size=self.batch_size_per_device,
-            shuffle=False,
-        )
+        return self._dataloader(self.data_val, shuffle=False)
 
     def test_dataloader(self) -> DataLoader[Any]:
         """Create and return the test dataloader.
 
         :return: The test dataloader.
         """
-        return DataLoader(
-            dataset=self.data_test,
-            batch_size=self.batch_size_per_device,
-            shuffle=False,
-        )
+        return self._dataloader(self.data_test, shuffle=False)
 
     def teardown(self, stage: str | None = None) -> None:
         """Lightning hook for cleaning up after `trainer.fit()`, `trainer.validate()`,
@@ -1,9 +1,7 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import hydra
 import rootutils
-from lightning.pytorch import LightningDataModule, LightningModule, Trainer
-from lightning.pytorch.loggers import Logger
 from omegaconf import DictConfig
 
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
@@ -16,6 +14,11 @@ from src.utils import (
     task_wrapper,
 )
 
+# torchとLightningはhydra.utils.instantiateで設定のクラスを作るときに読み込まれる
+if TYPE_CHECKING:
+    from lightning.pytorch import LightningDataModule, LightningModule, Trainer
+    from lightning.pytorch.loggers import Logger
+
 log = RankedLogger(__name__, rank_zero_only=True)
 
 
@@ -32,11 +35,15 @@ def evaluate(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
     """
     assert cfg.ckpt_path
 
+    # torchとsafetensorsを読み込むため、--helpなどで読み込まないようにここでimportする
+    from src.utils.checkpoint import load_model
+
     log.info(f"Instantiating datamodule <{cfg.data._target_}>")
     datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
 
     log.info(f"Instantiating model <{cfg.model._target_}>")
-    model: LightningModule = hydra.utils.instantiate(cfg.model)
+    # 事前学習済みの重みは読まずに骨組みだけを作り、チェックポイント(あれば隣の.safetensors)の重みを読み込む
+    model: LightningModule = load_model(cfg.model, cfg.ckpt_path)
 
     log.info("Instantiating loggers...")
     logger: list[Logger] = instantiate_loggers(cfg.get("logger"))
@@ -57,10 +64,9 @@ def evaluate(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
         log_hyperparameters(object_dict)
 
     log.info("Starting testing!")
-    trainer.test(model=model, datamodule=datamodule, ckpt_path=cfg.ckpt_path)
+    trainer.test(model=model, datamodule=datamodule)
 
-    # for predictions use trainer.predict(...)
-    # predictions = trainer.predict(model=model, dataloaders=dataloaders, ckpt_path=cfg.ckpt_path)
+    # for predictions use src/predict.py
 
     metric_dict = trainer.callback_metrics
 
@@ -0,0 +1,282 @@
+import time
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Any, Iterable
+
+import hydra
+import numpy as np
+import rootutils
+import torch
+from lightning.pytorch import LightningDataModule, LightningModule, Trainer
+from lightning.pytorch.loggers import Logger, MLFlowLogger
+from omegaconf import DictConfig
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.models.bert_module import BertOutput
+from src.utils import (
+    RankedLogger,
+    extras,
+    instantiate_loggers,
+    log_hyperparameters,
+    task_wrapper,
+)
+from src.utils.checkpoint import load_model
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+# トレース・エクスポートするモデルの入力
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class LogitsOnly(torch.nn.Module):
+    """BertForSequenceClassificationMultiLabelの出力からlogitsだけを返す
+
+    トレースやONNXへの変換ではテンソル以外の出力を扱えないため、このラッパーを通して書き出す
+    """
+
+    def __init__(self, model: torch.nn.Module) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, token_type_ids: torch.Tensor) -> torch.Tensor:
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).logits
+
+
+class ScriptedClassifier(torch.nn.Module):
+    """書き出したTorchScriptのモデルを、BertForSequenceClassificationMultiLabelと同じ呼び出し方で使えるようにする
+
+    LightningModuleのbert_scmlと差し替えて、test_stepの精度の計算をそのまま使う
+    """
+
+    def __init__(self, scripted: torch.jit.ScriptModule) -> None:
+        super().__init__()
+        self.scripted = scripted
+
+    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, labels=None) -> BertOutput:
+        return BertOutput(logits=self.scripted(input_ids, attention_mask, token_type_ids))
+
+
+def quantize(model: torch.nn.Module) -> torch.nn.Module:
+    """Linear層の重みをint8にする動的量子化を行う。活性値の量子化のパラメータは推論時に計算する
+
+    Args:
+        model: fp32のモデル
+
+    Returns:
+        torch.nn.Module: 量子化したモデル(元のモデルは変更しない)
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=False)
+
+
+def example_inputs(batch: dict[str, torch.Tensor]) -> tuple[torch.Tensor, ...]:
+    return tuple(batch[name] for name in INPUT_NAMES)
+
+
+def export_torchscript(model: torch.nn.Module, batch: dict[str, torch.Tensor], path: Path) -> torch.jit.ScriptModule:
+    """モデルをトレースしてTorchScriptとして保存する
+
+    Args:
+        model: BertForSequenceClassificationMultiLabel(量子化済みでもよい)
+        batch: トレースに使う入力のバッチ
+        path: 保存先
+
+    Returns:
+        torch.jit.ScriptModule: 保存したファイルを読み込み直したモデル
+    """
+    with torch.inference_mode(False), torch.no_grad():
+        traced = torch.jit.trace(LogitsOnly(model).eval(), example_inputs(batch), check_trace=False)
+    torch.jit.save(traced, str(path))
+    return torch.jit.load(str(path))
+
+
+def export_onnx(model: torch.nn.Module, batch: dict[str, torch.Tensor], path: Path) -> None:
+    """fp32のモデルをバッチサイズと系列長を可変にしてONNXとして保存する
+
+    Args:
+        model: fp32のBertForSequenceClassificationMultiLabel
+        batch: エクスポートに使う入力のバッチ
+        path: 保存先
+    """
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    dynamic_axes["logits"] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            LogitsOnly(model).eval(),
+            example_inputs(batch),
+            str(path),
+            input_names=INPUT_NAMES,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+
+
+@torch.inference_mode()
+def benchmark(model: torch.nn.Module, batches: list[dict[str, torch.Tensor]], n_warmup: int = 2) -> dict[str, float]:
+    """テストデータのバッチを順に推論し、1バッチあたりのレイテンシとスループットを計測する
+
+    Args:
+        model: BertForSequenceClassificationMultiLabelと同じ呼び出し方のモデル
+        batches: 計測に使うバッチ
+        n_warmup: 計測前に推論するバッチ数
+
+    Returns:
+        dict[str, float]: レイテンシの中央値・p95(ミリ秒)と1秒あたりのサンプル数
+    """
+    for batch in batches[:n_warmup]:
+        model(**{name: batch[name] for name in INPUT_NAMES})
+
+    latencies = []
+    n_samples = 0
+    for batch in batches:
+        start = time.perf_counter()
+        model(**{name: batch[name] for name in INPUT_NAMES})
+        latencies.append(time.perf_counter() - start)
+        n_samples += len(batch["input_ids"])
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {"latency_p50_ms": p50, "latency_p95_ms": p95, "samples_per_sec": n_samples / sum(latencies)}
+
+
+def take_batches(loader: Iterable[dict[str, torch.Tensor]], n_batches: int) -> list[dict[str, torch.Tensor]]:
+    batches = []
+    for batch in loader:
+        batches.append(batch)
+        if len(batches) == n_batches:
+            break
+    return batches
+
+
+def log_export(loggers: Iterable[Logger], metric_dict: dict[str, float], artifacts: Iterable[Path]) -> None:
+    """書き出しの指標を各ロガーに記録し、MLflowのrunには書き出したファイルをartifactとして添付する
+
+    Args:
+        loggers: Trainerのロガー
+        metric_dict: 記録する指標
+        artifacts: 添付するファイル
+    """
+    for lg in loggers:
+        lg.log_metrics(metric_dict)
+        # configs/logger/mlflow.yamlのBufferedMLFlowLoggerはMLFlowLoggerのサブクラスで、メトリクスはtask_wrapperの
+        # 終了時までに書き出される。ランク0以外ではrunを作らないため、run_idはNoneになる
+        if isinstance(lg, MLFlowLogger) and lg.run_id is not None:
+            for path in artifacts:
+                lg.experiment.log_artifact(lg.run_id, str(path))
+
+
+@task_wrapper
+def export(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
+    """学習済みのチェックポイントをCPU推論用に量子化・書き出しし、fp32のモデルと精度・速度を比較する
+
+    1. fp32のモデルでテストデータの精度を計算する
+    2. Linear層をint8に動的量子化し、TorchScriptとして書き出す(ONNXはfp32のモデルを書き出す)
+    3. 書き出したTorchScriptをbert_scmlと差し替え、同じtest_stepで精度を計算する
+    4. CPUでのレイテンシ・スループットを計測し、ロガー(MLflowなど)に記録する
+
+    Args:
+        cfg (DictConfig): Hydraによって構成されたDictConfig
+
+    Returns:
+        tuple[dict[str, Any], dict[str, Any]]:
+    """
+    assert cfg.ckpt_path
+    # ONNXへの変換にはonnxパッケージが必要だが、依存関係には含めていない
+    if "onnx" in cfg.formats and find_spec("onnx") is None:
+        raise ImportError("Exporting to ONNX requires the `onnx` package. Install it with `uv pip install onnx`.")
+
+    if cfg.get("num_threads"):
+        torch.set_num_threads(cfg.num_threads)
+
+    log.info(f"Instantiating datamodule <{cfg.data._target_}>")
+    datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
+
+    log.info(f"Instantiating model <{cfg.model._target_}>")
+    model: LightningModule = load_model(cfg.model, cfg.ckpt_path)
+    model.eval()
+
+    log.info("Instantiating loggers...")
+    logger: list[Logger] = instantiate_loggers(cfg.get("logger"))
+
+    log.info(f"Instantiating trainer <{cfg.trainer._target_}>")
+    trainer: Trainer = hydra.utils.instantiate(cfg.trainer, logger=logger)
+
+    object_dict = {
+        "cfg": cfg,
+        "datamodule": datamodule,
+        "model": model,
+        "logger": logger,
+        "trainer": trainer,
+    }
+
+    if logger:
+        log.info("Logging hyperparameters!")
+        log_hyperparameters(object_dict)
+
+    log.info("Evaluating fp32 model!")
+    fp32_accuracy = trainer.test(model=model, datamodule=datamodule)[0]["accuracy"]
+    batches = take_batches(datamodule.test_dataloader(), cfg.benchmark_batches)
+
+    export_dir = Path(cfg.export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    fp32 = model.bert_scml
+    int8 = quantize(fp32)
+    artifacts = []
+    metric_dict: dict[str, float] = {"export/fp32/accuracy": fp32_accuracy}
+    metric_dict.update({f"export/fp32/{k}": v for k, v in benchmark(fp32, batches).items()})
+
+    if "torchscript" in cfg.formats:
+        path = export_dir / "model_int8.pt"
+        log.info(f"Exporting int8 TorchScript model to <{path}>")
+        scripted = ScriptedClassifier(export_torchscript(int8, batches[0], path))
+        artifacts.append(path)
+
+        # 書き出したファイルそのものを、fp32のモデルと同じtest_stepで評価する
+        log.info("Evaluating exported int8 model!")
+        model.bert_scml = scripted
+        try:
+            int8_accuracy = trainer.test(model=model, datamodule=datamodule)[0]["accuracy"]
+        finally:
+            model.bert_scml = fp32
+        metric_dict["export/int8/accuracy"] = int8_accuracy
+        metric_dict["export/int8/accuracy_drop"] = fp32_accuracy - int8_accuracy
+        metric_dict["export/int8/size_mb"] = path.stat().st_size / 2**20
+        metric_dict.update({f"export/int8/{k}": v for k, v in benchmark(scripted, batches).items()})
+        metric_dict["export/int8/speedup"] = (
+            metric_dict["export/int8/samples_per_sec"] / metric_dict["export/fp32/samples_per_sec"]
+        )
+
+    if "onnx" in cfg.formats:
+        path = export_dir / "model_fp32.onnx"
+        log.info(f"Exporting fp32 ONNX model to <{path}>")
+        export_onnx(fp32, batches[0], path)
+        artifacts.append(path)
+        metric_dict["export/onnx/size_mb"] = path.stat().st_size / 2**20
+
+    log_export(trainer.loggers, metric_dict, artifacts)
+
+    for name, value in metric_dict.items():
+        log.info(f"{name}: {value:.4f}")
+
+    if metric_dict.get("export/int8/accuracy_drop", 0.0) > cfg.max_accuracy_drop:
+        raise ValueError(
+            f"int8 accuracy dropped by {metric_dict['export/int8/accuracy_drop']:.4f} "
+            f"(> max_accuracy_drop={cfg.max_accuracy_drop})."
+        )
+
+    return metric_dict, object_dict
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="export.yaml")
+def main(cfg: DictConfig) -> None:
+    """量子化・書き出しのエントリーポイント
+
+    Args:
+        cfg (DictConfig): Hydraで構成されたDitConfig
+    """
+    extras(cfg)
+
+    export(cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import re
+import threading
+import time
+import weakref
+from typing import Any, Mapping
+
+from lightning.pytorch.loggers import MLFlowLogger
+from lightning_utilities.core.rank_zero import rank_zero_only
+
+from src.utils.pylogger import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+# MLflowのlog_batchが1回に受け付けるメトリクスの最大数
+MAX_METRICS_PER_BATCH = 1000
+
+# task_wrapperから失敗時にも書き出せるよう、生成したロガーを弱参照で保持する
+_instances: "weakref.WeakSet[BufferedMLFlowLogger]" = weakref.WeakSet()
+
+
+class BufferedMLFlowLogger(MLFlowLogger):
+    """メトリクスをメモリ上に溜め、バックグラウンドのスレッドからlog_batchでまとめて書き出すMLFlowLogger
+
+    `self.log`のたびに同期的にトラッキングサーバー(ファイルストアの場合はファイル)へ書き込む代わりに、
+    flush_interval秒ごと、または溜まったメトリクスがmax_buffer_size件に達した時点で書き出す。
+    finalize(学習・評価の終了時やLightningが例外を捕まえた時)とtask_wrapperの終了時には、
+    残っているメトリクスを同期的に書き出す。
+    """
+
+    def __init__(self, *args: Any, flush_interval: float = 5.0, max_buffer_size: int = 1000, **kwargs: Any) -> None:
+        """
+        Args:
+            flush_interval: 書き出しの間隔(秒)
+            max_buffer_size: この件数が溜まったら、間隔を待たずに書き出す
+            *args, **kwargs: MLFlowLoggerの引数
+        """
+        super().__init__(*args, **kwargs)
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+        self._buffer: list[Any] = []
+        self._lock = threading.Lock()
+        # 書き出しが同時に走らないようにする(バックグラウンドのスレッドとfinalize)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: threading.Thread | None = None
+        _instances.add(self)
+
+    @rank_zero_only
+    def log_metrics(self, metrics: Mapping[str, float], step: int | None = None) -> None:
+        from mlflow.entities import Metric
+
+        timestamp_ms = int(time.time() * 1000)
+        new_metrics = []
+        for k, v in metrics.items():
+            if isinstance(v, str):
+                log.warning(f"Discarding metric with string value {k}={v}.")
+                continue
+            if self._prefix:
+                k = f"{self._prefix}{self.LOGGER_JOIN_CHAR}{k}"
+            # MLFlowLoggerと同じく、MLflowで使えない文字を取り除く
+            k = re.sub("[^a-zA-Z0-9_/. -]+", "", k)
+            new_metrics.append(Metric(key=k, value=float(v), timestamp=timestamp_ms, step=step or 0))
+
+        with self._lock:
+            self._buffer.extend(new_metrics)
+            full = len(self._buffer) >= self.max_buffer_size
+        self._start()
+        if full:
+            self._wake.set()
+
+    def _start(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="mlflow-flush", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """溜まっているメトリクスをlog_batchで書き出す。失敗した場合は次回に書き出す"""
+        with self._flush_lock:
+            with self._lock:
+                metrics, self._buffer = self._buffer, []
+            for start in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+                try:
+                    self.experiment.log_batch(
+                        run_id=self.run_id,
+                        metrics=metrics[start:start + MAX_METRICS_PER_BATCH],
+                        **self._log_batch_kwargs,
+                    )
+                except Exception as e:
+                    log.warning(f"Failed to flush {len(metrics) - start} metrics to MLflow: {e!r}")
+                    with self._lock:
+                        self._buffer = metrics[start:] + self._buffer
+                    return
+
+    def _shutdown(self) -> None:
+        if self._worker is not None:
+            self._stop.set()
+            self._wake.set()
+            self._worker.join()
+            self._worker = None
+        self.flush()
+
+    @rank_zero_only
+    def finalize(self, status: str = "success") -> None:
+        # runを終了する前に、残っているメトリクスを書き出す
+        self._shutdown()
+        super().finalize(status)
+
+
+def flush_all() -> None:
+    """生成済みの全てのBufferedMLFlowLoggerのメトリクスを書き出す。task_wrapperの終了時に呼ぶ"""
+    for logger in list(_instances):
+        try:
+            logger._shutdown()
+        except Exception:
+            log.exception("Failed to flush MLflow metrics")
@@ -1,25 +1,98 @@
+from typing import NamedTuple
+
 import torch
-from transformers import BertModel
+from transformers import BertConfig, BertModel, get_linear_schedule_with_warmup
+from transformers.modeling_utils import no_init_weights
 from lightning.pytorch import LightningModule
+from lightning.pytorch.utilities import rank_zero_warn
+from torchmetrics import AUROC, Accuracy, ExactMatch, F1Score, MeanMetric, MetricCollection, MinMetric, Precision, Recall
+
+class BertOutput(NamedTuple):
+  """BertForSequenceClassificationMultiLabelの出力
+
+  呼び出しごとにクラスを作らず固定の型にすることで、torch.compileでグラフとして追跡できる
+  """
+  logits: torch.Tensor
+  loss: torch.Tensor | None = None
+
+def enable_compile_compat():
+  """PyTorch 2.2でtransformersのBERTをtorch.compileできるようにする
+
+  transformersはtorch.compiler.is_compiling(PyTorch 2.3以降)を呼び、なければAttributeErrorを捕まえて
+  Falseとみなすが、Dynamoは追跡中の例外を扱えずにコンパイルが失敗するため、同じ関数を登録しておく
+  """
+  if not hasattr(torch.compiler, 'is_compiling'):
+    torch.compiler.is_compiling = torch._dynamo.is_compiling
+
+def build_metrics(num_labels, thresholds=(0.3, 0.5, 0.7), auroc_thresholds=200):
+  """マルチラベル分類の評価指標をまとめたMetricCollectionを作る
+
+  各指標はバッチごとに件数や混同行列をデバイス上に足し込むだけで、computeのときに初めて
+  プロセス間で集約する。そのため、最後のバッチが小さい場合やランクごとの件数が異なる場合も、
+  全データで計算した値になる。
+
+  Args:
+    num_labels: ラベル数。1の場合は二値分類の指標を使う
+    thresholds: 適合率と再現率を求める確率のしきい値
+    auroc_thresholds: AUROCを求めるしきい値の数。全ての予測を保持せず、固定長のヒストグラムで近似する
+
+  Returns:
+    シグモイドを通した確率とラベルで更新するMetricCollection
+  """
+  task = 'binary' if num_labels == 1 else 'multilabel'
+  metrics = {
+      # 全てのラベルの予測が正解と一致した文書の割合
+      'accuracy': (
+          Accuracy(task='binary') if num_labels == 1
+          else ExactMatch(task='multilabel', num_labels=num_labels)
+      ),
+      'f1_micro': F1Score(task=task, num_labels=num_labels, average='micro'),
+      'f1_macro': F1Score(task=task, num_labels=num_labels, average='macro'),
+      'auroc': AUROC(task=task, num_labels=num_labels, average='macro', thresholds=auroc_thresholds),
+  }
+  # 状態を共有してよいのは、同じしきい値の適合率と再現率だけ。compute_groups=Trueでは最初のバッチで状態が
+  # たまたま一致した指標(例えば0.5と0.7の間に予測がない場合のt50とt70)もまとめられ、以降の値が誤る
+  compute_groups = [[name] for name in metrics]
+  for threshold in thresholds:
+    # ModuleDictのキーには'.'を使えないので、しきい値は百分率で表す
+    suffix = f't{round(threshold * 100):02d}'
+    metrics[f'precision_{suffix}'] = Precision(
+        task=task, num_labels=num_labels, average='micro', threshold=threshold
+    )
+    metrics[f'recall_{suffix}'] = Recall(
+        task=task, num_labels=num_labels, average='micro', threshold=threshold
+    )
+    compute_groups.append([f'precision_{suffix}', f'recall_{suffix}'])
+  return MetricCollection(metrics, compute_groups=compute_groups)
 
 class BertForSequenceClassificationMultiLabel(torch.nn.Module):
 
-  def __init__(self, model_name, num_labels):
+  def __init__(self, model_name, num_labels, gradient_checkpointing=False, pretrained=True):
     super() .__init__()
-    # BertModelのロード
-    self.bert = BertModel.from_pretrained(model_name)
+    if pretrained:
+      # BertModelのロード
+      # from_pretrainedはevalモードで返し、Lightningは学習開始時にモードを変えないため、
+      # 学習モードに戻しておく(そのままだとDropoutと勾配チェックポイントが無効になる)
+      self.bert = BertModel.from_pretrained(model_name).train()
+    else:
+      # 重みを全てチェックポイントから読み込む場合は、設定だけから骨組みを作る
+      # (事前学習済みの重みを読まず、すぐに上書きされる乱数での初期化も省く)
+      with no_init_weights():
+        self.bert = BertModel(BertConfig.from_pretrained(model_name))
+    # 文書ベクトルには最終層の平均を使い、[CLS]のpoolerは損失に関わらないので学習しない
+    # (DDPは勾配が流れないパラメータがあるとエラーになる。state_dictのキーは変えない)
+    if self.bert.pooler is not None:
+      self.bert.pooler.requires_grad_(False)
+    # 勾配チェックポイント: エンコーダの各層の活性値を保持せず、逆伝播時に再計算してメモリを減らす
+    if gradient_checkpointing:
+      self.bert.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
     # 線形変換を初期化しておく
     self.linear = torch.nn.Linear(
         self.bert.config.hidden_size, num_labels
     )
 
-  def forward(
-      self,
-      input_ids=None,
-      attention_mask=None,
-      token_type_ids=None,
-      labels=None     
-  ):
+  def pool(self, input_ids, attention_mask, token_type_ids=None):
+    """BERTの最終層の隠れ状態を[PAD]以外のトークンで平均した文書ベクトルを返す"""
     # データを入力しBERTの最終層の出力を得る
     bert_output = self.bert(
         input_ids=input_ids,
@@ -31,31 +104,115 @@ class BertForSequenceClassificationMultiLabel(torch.nn.Module):
     averaged_hedden_state = \
       (last_hidden_state*attention_mask.unsqueeze(-1)).sum(1) \
       / attention_mask.sum(1, keepdim=True)
+    return averaged_hedden_state
 
-    # 線形変換
-    scores = self.linear(averaged_hedden_state)
+  def forward(
+      self,
+      input_ids=None,
+      attention_mask=None,
+      token_type_ids=None,
+      labels=None,
+      embeddings=None
+  ):
+    # EmbeddingStoreにキャッシュした文書ベクトルが渡された場合はエンコーダを通さない
+    if embeddings is None:
+      embeddings = self.pool(input_ids, attention_mask, token_type_ids)
 
-    # 出力の形式を整える
-    output = {'logits': scores}
+    # 線形変換
+    scores = self.linear(embeddings)
 
     # labelsが入力に含まれていたら、損失を計算し出力する
+    loss = None
     if labels is not None:
       loss = torch.nn.BCEWithLogitsLoss() (scores, labels.float())
-      output['loss'] = loss
 
     # 属性でアクセスできるようにする
-    output = type('bert_output', (object,), output)
-
-    return output
+    return BertOutput(logits=scores, loss=loss)
 
 class BertForSequenceClassificationMultiLabel_pl(LightningModule):
 
-  def __init__(self, model_name, num_labels, lr):
+  def __init__(
+      self,
+      model_name,
+      num_labels,
+      lr,
+      optimizer='adam',
+      weight_decay=0.0,
+      warmup_ratio=None,
+      gradient_checkpointing=False,
+      compile=False,
+      compile_dynamic=True,
+      freeze_encoder=False,
+      encoder_ckpt_path=None,
+      metric_thresholds=(0.3, 0.5, 0.7),
+      auroc_thresholds=200,
+      pretrained=True,
+  ):
+    """
+    Args:
+      model_name: 事前学習済みのBERTのモデル名
+      num_labels: ラベル数
+      lr: 学習率
+      optimizer: 'adam'または'adamw'
+      weight_decay: AdamWの重み減衰。バイアスとLayerNormには適用しない
+      warmup_ratio: 全ステップのうち学習率を線形に増やす割合。Noneの場合はスケジューラを使わない
+      gradient_checkpointing: BERTのエンコーダで勾配チェックポイントを使うかどうか
+      compile: 学習時にtorch.compileでコンパイルするかどうか
+      compile_dynamic: 系列長を動的な形状としてコンパイルするかどうか。
+        Falseの場合は系列長ごとに再コンパイルするため、data.pad_to_multiple_ofで系列長の種類を絞る
+      freeze_encoder: BERTのエンコーダを固定し、線形層だけを学習するかどうか。
+        data.embedding_cache_dirと組み合わせると、キャッシュした文書ベクトルから学習する
+      encoder_ckpt_path: エンコーダの重みを読み込む学習済みのチェックポイント。線形層は読み込まない
+      metric_thresholds: 検証・テストで適合率と再現率を求める確率のしきい値
+      auroc_thresholds: AUROCを近似するしきい値の数
+      pretrained: 事前学習済みのBERTの重みを読み込むかどうか。Falseの場合は設定だけから骨組みを作り、
+        encoder_ckpt_pathも読み込まない(評価・推論で全ての重みをチェックポイントから読み込む場合)
+    """
     super() .__init__()
     self.save_hyperparameters()
     self.bert_scml = BertForSequenceClassificationMultiLabel(
-        model_name, num_labels=num_labels
+        model_name, num_labels=num_labels, gradient_checkpointing=gradient_checkpointing, pretrained=pretrained
     )
+    if encoder_ckpt_path is not None and pretrained:
+      state_dict = torch.load(encoder_ckpt_path, map_location='cpu')['state_dict']
+      prefix = 'bert_scml.bert.'
+      self.bert_scml.bert.load_state_dict(
+          {k[len(prefix):]: v for k, v in state_dict.items() if k.startswith(prefix)}
+      )
+    if freeze_encoder:
+      self.bert_scml.bert.requires_grad_(False)
+      self.bert_scml.bert.eval()
+
+    # 評価指標はエポックの終わりにだけ集約する。検証の指標には'val_'を付け、テストの指標はそのままの名前で記録する
+    metrics = build_metrics(num_labels, thresholds=tuple(metric_thresholds), auroc_thresholds=auroc_thresholds)
+    self.val_metrics = metrics.clone(prefix='val_')
+    self.test_metrics = metrics.clone()
+    self.val_loss = MeanMetric()
+    # ハイパーパラメータ探索で最適化する、これまでの最良の検証の損失
+    self.val_loss_best = MinMetric()
+
+  def train(self, mode=True):
+    super().train(mode)
+    # 固定したエンコーダはDropoutを無効にしたままにし、キャッシュした文書ベクトルと同じ出力にする
+    if self.hparams.freeze_encoder:
+      self.bert_scml.bert.eval()
+    return self
+
+  def setup(self, stage):
+    if self.hparams.compile and stage == 'fit':
+      # PyTorch 2.2のDynamoはPython 3.12に対応していないため、その場合はeagerのまま学習する
+      if not torch._dynamo.is_dynamo_supported():
+        rank_zero_warn('torch.compile is not supported in this environment. Falling back to eager mode.')
+        return
+      enable_compile_compat()
+      # Module.compileはモジュールをその場でコンパイルするので、state_dictのキーは変わらない
+      self.bert_scml.compile(dynamic=self.hparams.compile_dynamic)
+
+  def on_train_start(self):
+    # 学習前のサニティチェックで更新した検証の指標を捨てる
+    self.val_loss.reset()
+    self.val_metrics.reset()
+    self.val_loss_best.reset()
 
   def training_step(self, batch, batch_idx):
     output = self.bert_scml(**batch)
@@ -64,21 +221,74 @@ class BertForSequenceClassificationMultiLabel_pl(LightningModule):
     return loss
 
   def validation_step(self, batch, batch_idx):
+    labels = batch['labels']
     output = self.bert_scml(**batch)
-    val_loss = output.loss
-    self.log('val_loss', val_loss)
+    # 損失はバッチ内の平均なので、文書数で重み付けして平均する
+    self.val_loss.update(output.loss, weight=labels.size(0))
+    self.val_metrics.update(torch.sigmoid(output.logits), labels)
+    # Metricを渡すと、エポックの終わりにcomputeした値(全プロセスで集約した値)が記録される
+    self.log('val_loss', self.val_loss, on_step=False, on_epoch=True)
+    self.log_dict(self.val_metrics, on_step=False, on_epoch=True)
+
+  def on_validation_epoch_end(self):
+    self.val_loss_best(self.val_loss.compute())
+    # Metricのまま記録するとエポックごとにリセットされるので、値として記録する
+    self.log('val_loss_best', self.val_loss_best.compute(), sync_dist=True)
 
   def test_step(self, batch, batch_idx):
     labels = batch.pop('labels')
     output = self.bert_scml(**batch)
+    self.test_metrics.update(torch.sigmoid(output.logits), labels)
+    self.log_dict(self.test_metrics, on_step=False, on_epoch=True)
+
+  def predict_step(self, batch, batch_idx):
+    batch.pop('labels', None)
+    # 入力の並び順に戻すための行番号
+    index = batch.pop('index', None)
+    output = self.bert_scml(**batch)
     scores = output.logits
-    labels_predicted = ( scores > 0 ).int()
-    num_correct = ( labels_predicted == labels ).all(-1).sum().item()
-    accuracy = num_correct/scores.size(0)
-    self.log('accuracy', accuracy)
+    return {'index': index, 'logits': scores, 'probs': torch.sigmoid(scores)}
 
   def configure_optimizers(self):
-    return torch.optim.Adam(self.parameters(), lr=self.hparams.lr)
+    if self.hparams.optimizer == 'adam':
+      optimizer = torch.optim.Adam(
+          [param for param in self.parameters() if param.requires_grad], lr=self.hparams.lr
+      )
+    elif self.hparams.optimizer == 'adamw':
+      # バイアスとLayerNormの重みは重み減衰の対象から外す
+      decay, no_decay = [], []
+      for param in self.parameters():
+        if not param.requires_grad:
+          continue
+        (no_decay if param.ndim < 2 else decay).append(param)
+      # fusedはCUDAのみ対応しているので、CPUではパラメータをまとめて更新するforeach実装を使う
+      fused = self.device.type == 'cuda'
+      optimizer = torch.optim.AdamW(
+          [
+              {'params': decay, 'weight_decay': self.hparams.weight_decay},
+              {'params': no_decay, 'weight_decay': 0.0},
+          ],
+          lr=self.hparams.lr,
+          fused=fused,
+          foreach=None if fused else True,
+      )
+    else:
+      raise ValueError(f"Unknown optimizer: {self.hparams.optimizer}")
+
+    if self.hparams.warmup_ratio is None:
+      return optimizer
+
+    # 勾配累積を考慮した、実際にパラメータを更新する回数
+    total_steps = self.trainer.estimated_stepping_batches
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer,
+        num_warmup_steps=int(total_steps * self.hparams.warmup_ratio),
+        num_training_steps=total_steps,
+    )
+    return {
+        'optimizer': optimizer,
+        'lr_scheduler': {'scheduler': scheduler, 'interval': 'step'},
+    }
 
 if __name__ == "__main__":
     _ = BertForSequenceClassificationMultiLabel_pl(None, None, None)
@@ -0,0 +1,263 @@
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import hydra
+import numpy as np
+import polars as pl
+import rootutils
+import torch
+from lightning.pytorch import LightningDataModule, LightningModule, Trainer
+from lightning.pytorch.loggers import Logger
+from omegaconf import DictConfig
+from torch.utils.data import DataLoader
+from transformers import BertJapaneseTokenizer
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.components.batching import pad_to_longest
+from src.data.components.token_store import EncodingDataset
+from src.data.components.tokenization import tokenize_batched, tokenizer_pool
+from src.data.data import clean_text_expr
+from src.utils import (
+    RankedLogger,
+    extras,
+    instantiate_loggers,
+    task_wrapper,
+)
+from src.utils.checkpoint import load_model
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+def _read_csv_batches(path: str, batch_size: int) -> Iterator[pl.DataFrame]:
+    """CSVを先頭から1回だけ読み、およそbatch_size行ずつのDataFrameを返す。全てのカラムを文字列として読む"""
+    reader = pl.read_csv_batched(path, infer_schema_length=0, batch_size=batch_size)
+    while batches := reader.next_batches(1):
+        yield from batches
+
+
+def _with_summary(chunk: pl.DataFrame) -> pl.DataFrame:
+    """summaryカラムがなければ要約カラムを整形して作る"""
+    if "summary" not in chunk.columns:
+        chunk = chunk.with_columns(clean_text_expr(pl.col("要約")).alias("summary"))
+    return chunk
+
+
+def iter_chunks(
+    path: str, chunk_size: int, skip: Callable[[int], bool] | None = None
+) -> Iterator[tuple[int, pl.DataFrame]]:
+    """推論するCSV/Parquetをchunk_size行ずつ読み込む。summaryカラムがなければ要約カラムを整形して作る
+
+    CSVはバッチ単位で先頭から順に読み、Parquetはスライスを読み込みに押し下げて、フッターの行数から
+    各チャンクと重なる行グループだけを読む。どちらも入力全体を読み直したりメモリに載せたりしない。
+    最後以外のチャンクはちょうどchunk_size行にするので、入力とchunk_sizeが同じなら何番目のチャンクかで再開できる
+
+    Args:
+        path: 入力のパス
+        chunk_size: 1チャンクの行数
+        skip: チャンクの番号を受け取り、飛ばす場合にTrueを返す関数。飛ばすチャンクは整形せず、
+            Parquetの場合は読み込みもしない
+
+    Yields:
+        tuple[int, pl.DataFrame]: チャンクの番号と、summaryカラムを含むチャンク
+    """
+    skip = skip or (lambda i: False)
+    if not str(path).endswith(".csv"):
+        lf = pl.scan_parquet(path)
+        # 行数はフッターだけから求まる
+        n_rows = lf.select(pl.len()).collect().item()
+        for i, offset in enumerate(range(0, n_rows, chunk_size)):
+            if not skip(i):
+                yield i, _with_summary(lf.slice(offset, chunk_size).collect())
+        return
+
+    # CSVのバッチの行数は一定でないため、溜めてからchunk_size行ずつに切り分ける
+    buffer: list[pl.DataFrame] = []
+    n_buffered = 0
+    i = 0
+    for batch in _read_csv_batches(path, chunk_size):
+        buffer.append(batch)
+        n_buffered += len(batch)
+        while n_buffered >= chunk_size:
+            frame = pl.concat(buffer)
+            if not skip(i):
+                yield i, _with_summary(frame[:chunk_size])
+            i += 1
+            buffer = [frame[chunk_size:]]
+            n_buffered = len(buffer[0])
+    if n_buffered and not skip(i):
+        yield i, _with_summary(pl.concat(buffer))
+
+
+def check_manifest(output_path: Path, manifest: dict[str, Any]) -> None:
+    """出力先が前回と同じ設定で書かれたことを確認する。チャンクの区切りがずれたまま再開しないようにする
+
+    Args:
+        output_path: 出力先のディレクトリ
+        manifest: 入力のパス、チャンクサイズ、ラベル、系列長などの設定
+    """
+    path = output_path / "manifest.json"
+    if path.exists():
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != manifest:
+            raise ValueError(f"Output path <{output_path}> was written with different settings: {previous}")
+        return
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def score_chunk(
+    trainer: Trainer,
+    model: LightningModule,
+    texts: list[str],
+    tokenizer: Any,
+    cfg: DictConfig,
+    executor: Any,
+) -> tuple[np.ndarray, np.ndarray]:
+    """1チャンク分のテキストをトークン化して推論し、入力と同じ順番のlogitsと確率を返す
+
+    チャンクごとにtrainer.predictを呼ぶと、予測ループの準備と後片付けをチャンクの数だけ繰り返すため、
+    モデルのpredict_stepを直接呼ぶ。Trainerからはデバイスと精度(autocast)の設定だけを使う。
+    系列長の近いテキストをまとめてバッチにするため、推論後に行番号で並び順を戻す
+    """
+    encodings = [
+        encoding
+        for _, encoding in tokenize_batched(texts, tokenizer, cfg.data.max_length, num_workers=1, executor=executor)
+    ]
+    arrays = {field: np.concatenate([encoding[field] for encoding in encodings]) for field in encodings[0]}
+    arrays["index"] = np.arange(len(texts))
+
+    # チャンク全体を系列長でソートしてからバッチにし、パディングを最小にする
+    order = np.argsort(EncodingDataset(arrays).lengths, kind="stable")
+    dataset = EncodingDataset({field: array[order] for field, array in arrays.items()})
+    loader = DataLoader(dataset, batch_size=cfg.data.batch_size, shuffle=False, collate_fn=pad_to_longest)
+    device = trainer.strategy.root_device
+    outputs = []
+    with torch.inference_mode(), trainer.precision_plugin.forward_context():
+        for batch_idx, batch in enumerate(loader):
+            batch = {key: value.to(device) for key, value in batch.items()}
+            outputs.append({key: value.cpu() for key, value in model.predict_step(batch, batch_idx).items()})
+
+    order = torch.cat([output["index"] for output in outputs]).argsort()
+    logits = torch.cat([output["logits"] for output in outputs])[order]
+    probs = torch.cat([output["probs"] for output in outputs])[order]
+    return logits.float().numpy(), probs.float().numpy()
+
+
+@task_wrapper
+def predict(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
+    """入力をチャンク単位で読み込んで推論し、チャンクごとにParquetへ書き出す
+    入力全体をメモリに載せないため、入力の大きさによらずメモリ使用量は一定になる。
+    書き出し済みのチャンクは飛ばすので、中断しても同じ出力先で再実行すれば続きから再開できる
+
+    Args:
+        cfg (DictConfig): Hydraによって構成されたDictConfig
+
+    Returns:
+        tuple[dict[str, Any], dict[str, Any]]:
+    """
+    assert cfg.ckpt_path
+    assert cfg.input_path
+
+    log.info(f"Instantiating datamodule <{cfg.data._target_}>")
+    datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
+
+    log.info(f"Instantiating model <{cfg.model._target_}>")
+    model: LightningModule = load_model(cfg.model, cfg.ckpt_path)
+
+    log.info("Instantiating loggers...")
+    logger: list[Logger] = instantiate_loggers(cfg.get("logger"))
+
+    log.info(f"Instantiating trainer <{cfg.trainer._target_}>")
+    trainer: Trainer = hydra.utils.instantiate(cfg.trainer, logger=logger)
+
+    object_dict = {
+        "cfg": cfg,
+        "datamodule": datamodule,
+        "model": model,
+        "logger": logger,
+        "trainer": trainer,
+    }
+
+    # trainer.predictを通さずに推論するため、Lightningが予測の開始時に行う準備をここで1回だけ行う
+    model = trainer.precision_plugin.convert_module(model).to(trainer.strategy.root_device).eval()
+
+    tokenizer = BertJapaneseTokenizer.from_pretrained(cfg.data.model_name)
+    labels = datamodule.label_vocab
+
+    output_path = Path(cfg.output_path)
+    # ラベルや系列長を変えて再開すると、列や値の異なるチャンクが混ざるため、設定に含める
+    check_manifest(
+        output_path,
+        {
+            "input_path": str(cfg.input_path),
+            "chunk_size": cfg.chunk_size,
+            "ckpt_path": str(cfg.ckpt_path),
+            "labels": list(labels),
+            "max_length": cfg.data.max_length,
+        },
+    )
+
+    def part_path(i: int) -> Path:
+        return output_path / f"part-{i:05d}.parquet"
+
+    def written(i: int) -> bool:
+        # 書き出し済みのチャンクは、要約の整形もせずに飛ばす
+        if part_path(i).exists():
+            log.info(f"Skipping chunk {i} (already written)")
+            return True
+        return False
+
+    log.info(f"Starting prediction! <chunk_size={cfg.chunk_size}>")
+    n_scored = 0
+    elapsed = 0.0
+    executor = tokenizer_pool(tokenizer, cfg.data.get("tokenize_workers"))
+    try:
+        for i, chunk in iter_chunks(cfg.input_path, cfg.chunk_size, skip=written):
+            start = time.perf_counter()
+            logits, probs = score_chunk(trainer, model, chunk["summary"].to_list(), tokenizer, cfg, executor)
+            result = chunk.select(list(cfg.id_columns)).with_columns(
+                *[pl.Series(f"logit_{label}", logits[:, j]) for j, label in enumerate(labels)],
+                *[pl.Series(f"prob_{label}", probs[:, j]) for j, label in enumerate(labels)],
+            )
+
+            # 書き込み途中のファイルを完了したチャンクと誤認しないよう、一時ファイルからリネームする
+            tmp_path = part_path(i).with_suffix(".tmp")
+            result.write_parquet(tmp_path)
+            tmp_path.rename(part_path(i))
+
+            chunk_elapsed = time.perf_counter() - start
+            n_scored += len(chunk)
+            elapsed += chunk_elapsed
+            log.info(f"Chunk {i}: {len(chunk)} rows, {len(chunk) / chunk_elapsed:.1f} rows/sec")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    metric_dict = {"predict/rows": n_scored, "predict/rows_per_sec": n_scored / elapsed if elapsed else 0.0}
+    log.info(f"Scored {n_scored} rows! <{metric_dict['predict/rows_per_sec']:.1f} rows/sec>")
+    for lg in trainer.loggers:
+        lg.log_metrics(metric_dict)
+
+    return metric_dict, object_dict
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="predict.yaml")
+def main(cfg: DictConfig) -> None:
+    """推論のエントリーポイント
+
+    Args:
+        cfg (DictConfig): Hydraで構成されたDitConfig
+    """
+    extras(cfg)
+
+    predict(cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import polars as pl
+
+# list/compareはキャッシュだけを読むので、MLflowはサーバーに問い合わせるときに初めて読み込む
+if TYPE_CHECKING:
+    from mlflow.entities import Run
+    from mlflow.tracking import MlflowClient
+
+# search_runsの1ページあたりの件数(MLflowの上限)
+PAGE_SIZE = 1000
+
+# run_idなどの列。メトリクス・パラメータ・タグはそれぞれ"metrics.", "params.", "tags."を付けた列になる
+INFO_COLUMNS = ["run_id", "run_name", "experiment_id", "status", "start_time", "end_time", "artifact_uri"]
+# INFO_COLUMNSのうち、エポックからのミリ秒で表す列
+TIME_COLUMNS = ["start_time", "end_time"]
+
+
+def run_to_row(run: Run) -> dict[str, Any]:
+    """MLflowのRunを、キャッシュの1行に対応する辞書に変換する"""
+    info = run.info
+    return {
+        "run_id": info.run_id,
+        "run_name": info.run_name,
+        "experiment_id": info.experiment_id,
+        "status": info.status,
+        "start_time": info.start_time,
+        "end_time": info.end_time,
+        "artifact_uri": info.artifact_uri,
+        **{f"metrics.{k}": float(v) for k, v in run.data.metrics.items()},
+        **{f"params.{k}": v for k, v in run.data.params.items()},
+        **{f"tags.{k}": v for k, v in run.data.tags.items()},
+    }
+
+
+def runs_to_frame(runs: list[Run]) -> pl.DataFrame:
+    """RunのリストをDataFrameに変換する。runごとに異なるメトリクス・パラメータの列は欠損値で埋める"""
+    rows = [run_to_row(run) for run in runs]
+    if not rows:
+        return pl.DataFrame(schema={c: pl.Int64 if c in TIME_COLUMNS else pl.String for c in INFO_COLUMNS})
+    # パラメータとタグは(名前が_timeで終わるものも含めて)文字列、メトリクスはfloatに揃える
+    schema = {
+        key: pl.Float64 if key.startswith("metrics.") else pl.Int64 if key in TIME_COLUMNS else pl.String
+        for key in dict.fromkeys(k for row in rows for k in row)
+    }
+    return pl.from_dicts(rows, schema=schema)
+
+
+def search_all(client: MlflowClient, experiment_id: str, filter_string: str = "") -> list[Run]:
+    """search_runsをページトークンで最後まで辿り、条件に合う全てのrunを返す"""
+    from mlflow.entities import ViewType
+
+    runs: list[Run] = []
+    page_token = None
+    while True:
+        page = client.search_runs(
+            [experiment_id],
+            filter_string=filter_string,
+            run_view_type=ViewType.ACTIVE_ONLY,
+            max_results=PAGE_SIZE,
+            page_token=page_token,
+        )
+        runs.extend(page)
+        page_token = page.token
+        if not page_token:
+            return runs
+
+
+class RunCache:
+    """実験ごとのrunのメタデータを、ローカルのParquetにキャッシュする
+
+    2回目以降の同期では、前回の同期で見た最新のend_timeより後に終了したrunと、
+    前回実行中だったrunだけを取得して差し替える。実験名とIDの対応も同期のときにキャッシュする。
+    キャッシュを読み込んだ後の絞り込み・並べ替えはpolarsで行い、サーバーには問い合わせない。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | os.PathLike,
+        client: MlflowClient | None = None,
+        max_workers: int = 8,
+        tracking_uri: str | None = None,
+    ) -> None:
+        """
+        Args:
+            cache_dir: キャッシュのディレクトリ
+            client: MlflowClient。Noneの場合はサーバーに問い合わせるときにtracking_uriで作る
+            max_workers: 同時にsearch_runsを呼び出す数
+            tracking_uri: clientを作るときのトラッキングURI。Noneの場合は既定のURIを使う
+        """
+        self.cache_dir = Path(cache_dir)
+        self._client = client
+        self.tracking_uri = tracking_uri
+        self.max_workers = max_workers
+
+    @property
+    def client(self) -> MlflowClient:
+        if self._client is None:
+            from mlflow.tracking import MlflowClient
+
+            self._client = MlflowClient(self.tracking_uri)
+        return self._client
+
+    def path(self, experiment_id: str) -> Path:
+        return self.cache_dir / f"{experiment_id}.parquet"
+
+    @property
+    def _experiments_path(self) -> Path:
+        return self.cache_dir / "experiments.json"
+
+    def load(self, experiment_ids: list[str]) -> pl.DataFrame:
+        """キャッシュ済みのrunを読み込む(同期はしない)"""
+        frames = [pl.read_parquet(self.path(i)) for i in experiment_ids if self.path(i).exists()]
+        return pl.concat(frames, how="diagonal_relaxed") if frames else runs_to_frame([])
+
+    def experiment_ids(self, names: list[str], refresh: bool = False) -> list[str]:
+        """実験名をIDに変換する
+
+        Args:
+            names: 実験名
+            refresh: サーバーに問い合わせて対応をキャッシュし直すかどうか(同期するとき)。
+                Falseの場合はキャッシュした対応だけを使う
+
+        Returns:
+            list[str]: 実験ID
+        """
+        mapping = json.loads(self._experiments_path.read_text()) if self._experiments_path.exists() else {}
+        if refresh:
+            for name in names:
+                experiment = self.client.get_experiment_by_name(name)
+                if experiment is None:
+                    raise ValueError(f"Experiment <{name}> not found.")
+                mapping[name] = experiment.experiment_id
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._experiments_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(mapping, ensure_ascii=False, indent=2))
+            os.replace(tmp_path, self._experiments_path)
+
+        missing = [name for name in names if name not in mapping]
+        if missing:
+            raise ValueError(f"Experiments {missing} are not cached. Run `sync` (or pass `--sync`) first.")
+        return [mapping[name] for name in names]
+
+    def _fetch(self, experiment_id: str, cached: pl.DataFrame | None, executor: ThreadPoolExecutor) -> list[Run]:
+        watermark = None if cached is None else cached["end_time"].max()
+        if watermark is None:
+            return search_all(self.client, experiment_id)
+
+        # 前回の同期以降に終了したrunを検索し、前回実行中だったrunはget_runで並列に取り直す
+        # (前回の同期以降に開始してまだ実行中のrunは、終了した後の同期で取得される)
+        running = cached.filter(pl.col("status") == "RUNNING")["run_id"].to_list()
+        refreshed = executor.map(self.client.get_run, running)
+        finished = search_all(self.client, experiment_id, f"attributes.end_time > {watermark}")
+        # 前回実行中で、その後終了したrunは両方に含まれるため重複を除く
+        return list({run.info.run_id: run for run in [*refreshed, *finished]}.values())
+
+    def sync(self, experiment_ids: list[str]) -> dict[str, int]:
+        """キャッシュを差分で更新する。実験ごとの検索と、実行中だったrunの取得を並列に行う
+
+        Args:
+            experiment_ids: 同期する実験のID
+
+        Returns:
+            dict[str, int]: 実験IDごとの、取得し直したrunの数
+        """
+        cached = {i: pl.read_parquet(self.path(i)) if self.path(i).exists() else None for i in experiment_ids}
+        with ThreadPoolExecutor(self.max_workers) as executor, ThreadPoolExecutor(len(experiment_ids)) as outer:
+            # 実験ごとの検索と、その中のget_runは別のプールで実行する(同じプールだと待ち合わせでデッドロックしうる)
+            results = list(outer.map(lambda i: self._fetch(i, cached[i], executor), experiment_ids))
+
+        counts = {}
+        for experiment_id, runs in zip(experiment_ids, results):
+            updated = runs_to_frame(runs)
+            if cached[experiment_id] is not None:
+                updated = pl.concat(
+                    [cached[experiment_id].filter(~pl.col("run_id").is_in(updated["run_id"].implode())), updated],
+                    how="diagonal_relaxed",
+                )
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path(experiment_id).with_suffix(".tmp")
+            updated.sort("start_time", descending=True).write_parquet(tmp_path)
+            os.replace(tmp_path, self.path(experiment_id))
+            counts[experiment_id] = len(runs)
+        return counts
+
+
+def query(
+    df: pl.DataFrame,
+    where: str | None = None,
+    sort_by: str | None = None,
+    descending: bool = False,
+    top: int | None = None,
+    columns: list[str] | None = None,
+) -> pl.DataFrame:
+    """キャッシュしたrunを絞り込み、メトリクスなどで並べ替える
+
+    Args:
+        df: RunCache.loadの結果
+        where: SQLのWHERE句。列名は"metrics.val_loss"のようにダブルクォートで囲む
+        sort_by: 並べ替えに使う列。"val_loss"のように接頭辞を省略した場合はメトリクスとみなす
+        descending: 降順にするかどうか
+        top: 先頭から返す件数
+        columns: 返す列。Noneの場合はrun_id, run_name, status, start_timeと全てのメトリクス
+
+    Returns:
+        pl.DataFrame: 絞り込み・並べ替えた結果
+    """
+    if where:
+        df = df.sql(f"SELECT * FROM self WHERE {where}")
+    if sort_by:
+        if sort_by not in df.columns and f"metrics.{sort_by}" in df.columns:
+            sort_by = f"metrics.{sort_by}"
+        df = df.sort(sort_by, descending=descending, nulls_last=True)
+    if top:
+        df = df.head(top)
+    if columns is None:
+        columns = ["run_id", "run_name", "status", "start_time"] + [c for c in df.columns if c.startswith("metrics.")]
+    return df.select(columns).with_columns(
+        pl.col(c).cast(pl.Datetime("ms")) for c in TIME_COLUMNS if c in columns
+    )
+
+
+def compare(df: pl.DataFrame, run_ids: list[str]) -> pl.DataFrame:
+    """複数のrunのメトリクスとパラメータを、値が異なる項目だけ横に並べる
+
+    Args:
+        df: RunCache.loadの結果
+        run_ids: 比べるrunのID
+
+    Returns:
+        pl.DataFrame: 項目名の列と、runごとの値の列
+    """
+    runs = df.filter(pl.col("run_id").is_in(run_ids))
+    missing = set(run_ids) - set(runs["run_id"])
+    if missing:
+        raise ValueError(f"Runs not found in cache: {sorted(missing)}")
+
+    keys = [c for c in runs.columns if c.startswith(("metrics.", "params."))]
+    table = runs.select("run_id", *[pl.col(c).cast(pl.String) for c in keys]).transpose(
+        include_header=True, header_name="key", column_names="run_id"
+    )
+    values = pl.concat_list(run_ids)
+    return table.select("key", *run_ids).filter(values.list.n_unique() > 1)
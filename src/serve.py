@@ -0,0 +1,369 @@
+import asyncio
+import json
+import signal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import hydra
+import numpy as np
+import rootutils
+import torch
+from lightning.pytorch import LightningDataModule, LightningModule
+from omegaconf import DictConfig
+from transformers import BertJapaneseTokenizer
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+
+from src.data.data import clean_text
+from src.utils import (
+    RankedLogger,
+    extras,
+    task_wrapper,
+)
+from src.utils.checkpoint import load_model
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class LatencyStats:
+    """リクエストのレイテンシとスループットを集計する
+
+    パーセンタイルは直近window件のリクエストから計算し、件数は起動時からの累計とする
+    """
+
+    def __init__(self, window: int = 10000) -> None:
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.batch_sizes: deque[int] = deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def record_request(self, latency: float, n_rows: int) -> None:
+        self.latencies.append(latency)
+        self.requests += 1
+        self.rows += n_rows
+
+    def record_batch(self, n_rows: int) -> None:
+        self.batch_sizes.append(n_rows)
+        self.batches += 1
+
+    def snapshot(self) -> dict[str, float]:
+        """現在の集計値を返す
+
+        Returns:
+            dict[str, float]: 件数、レイテンシのパーセンタイル(ミリ秒)、1秒あたりの件数
+        """
+        uptime = time.perf_counter() - self.started
+        metrics = {
+            "requests": self.requests,
+            "rows": self.rows,
+            "batches": self.batches,
+            "errors": self.errors,
+            "uptime_sec": uptime,
+            "requests_per_sec": self.requests / uptime,
+            "rows_per_sec": self.rows / uptime,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+        }
+        if self.latencies:
+            p50, p95, p99 = np.percentile(np.fromiter(self.latencies, dtype=np.float64), [50, 95, 99]) * 1000
+            metrics.update({"latency_p50_ms": p50, "latency_p95_ms": p95, "latency_p99_ms": p99})
+        return metrics
+
+
+class Scorer:
+    """テキストのリストをトークン化してモデルに入力し、各ラベルの確率を返す"""
+
+    def __init__(self, model: LightningModule, tokenizer: Any, max_length: int) -> None:
+        """
+        Args:
+            model: 学習済みのBertForSequenceClassificationMultiLabel_pl
+            tokenizer: Hugging Faceのトークナイザ
+            max_length: トークン列の最大長
+        """
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    @torch.inference_mode()
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        # バッチ内の最長の系列に合わせてパディングする
+        encoding = self.tokenizer(
+            [clean_text(text) for text in texts],
+            max_length=self.max_length,
+            padding="longest",
+            truncation=True,
+            return_tensors="pt",
+        )
+        output = self.model.bert_scml(**encoding)
+        return torch.sigmoid(output.logits).float().numpy()
+
+
+class MicroBatcher:
+    """同時に届いたリクエストを1回の推論にまとめる
+
+    最初のリクエストが届いてからmax_wait_ms待つか、テキスト数がmax_batch_sizeに達した時点で推論する。
+    max_batch_sizeより多いテキストを含むリクエストは、max_batch_size件ずつに分けて推論する。
+    推論は専用のスレッドで行うため、推論中もイベントループは次のリクエストを受け付け、
+    推論中に溜まったリクエストは次のバッチにまとめられる。
+    """
+
+    def __init__(
+        self,
+        score_fn: Callable[[list[str]], np.ndarray],
+        max_batch_size: int,
+        max_wait_ms: float,
+        stats: LatencyStats,
+    ) -> None:
+        """
+        Args:
+            score_fn: テキストのリストから(テキスト数, ラベル数)の確率を返す関数
+            max_batch_size: 1回の推論にまとめる最大のテキスト数
+            max_wait_ms: 後続のリクエストを待つ最大の時間(ミリ秒)
+            stats: バッチサイズを記録するLatencyStats
+        """
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats
+        self.queue: asyncio.Queue[tuple[list[str], asyncio.Future]] = asyncio.Queue()
+        # 前のバッチに入りきらず、次のバッチの先頭にするリクエスト
+        self._pending: tuple[list[str], asyncio.Future] | None = None
+        # PyTorchは演算中にGILを解放するので、スレッドで推論してもイベントループは止まらない
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scorer")
+
+    async def submit(self, texts: list[str]) -> np.ndarray:
+        """テキストをmax_batch_size件ずつ推論待ちのキューに入れ、全ての推論結果を待つ"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(texts), self.max_batch_size):
+            future = loop.create_future()
+            await self.queue.put((texts[start:start + self.max_batch_size], future))
+            futures.append(future)
+        return np.concatenate(await asyncio.gather(*futures))
+
+    async def _collect(self) -> list[tuple[list[str], asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        if self._pending is not None:
+            items, self._pending = [self._pending], None
+        else:
+            items = [await self.queue.get()]
+        n_texts = len(items[0][0])
+        deadline = loop.time() + self.max_wait
+        while n_texts < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except TimeoutError:
+                break
+            if n_texts + len(item[0]) > self.max_batch_size:
+                # max_batch_sizeを超えないよう、次のバッチに回す
+                self._pending = item
+                break
+            items.append(item)
+            n_texts += len(item[0])
+        return items
+
+    async def run(self) -> None:
+        """キューからリクエストを取り出して推論し続ける"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            texts = [text for item_texts, _ in items for text in item_texts]
+            try:
+                probs = await loop.run_in_executor(self.executor, self.score_fn, texts)
+            except Exception as ex:
+                log.exception("Scoring failed")
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+
+            self.stats.record_batch(len(texts))
+            offset = 0
+            for item_texts, future in items:
+                # 待っている間に接続が切れたリクエストは結果を捨てる
+                if not future.done():
+                    future.set_result(probs[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+class ScoringServer:
+    """ローカルで推論リクエストを受け付けるHTTP/1.1サーバー
+
+    Endpoints:
+        - POST /predict: {"text": str}または{"texts": list[str]}を受け取り、各ラベルの確率を返す
+        - GET /metrics: レイテンシのパーセンタイルとスループットを返す
+        - GET /health: 死活監視用
+    """
+
+    def __init__(
+        self, batcher: MicroBatcher, labels: list[str], stats: LatencyStats, max_request_texts: int = 1024
+    ) -> None:
+        """
+        Args:
+            batcher: 推論をまとめるMicroBatcher
+            labels: モデルの出力の各列に対応するラベル
+            stats: レイテンシを記録するLatencyStats
+            max_request_texts: 1回のリクエストで受け付ける最大のテキスト数。超えた場合は400を返す
+        """
+        self.batcher = batcher
+        self.labels = labels
+        self.stats = stats
+        self.max_request_texts = max_request_texts
+
+    async def _predict(self, body: bytes) -> tuple[int, dict[str, Any]]:
+        try:
+            payload = json.loads(body)
+            texts = payload["texts"] if "texts" in payload else [payload["text"]]
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": 'Body must be JSON with "text" or "texts".'}
+        if not texts or not all(isinstance(text, str) for text in texts):
+            return 400, {"error": '"texts" must be a non-empty list of strings.'}
+        if len(texts) > self.max_request_texts:
+            return 400, {"error": f'"texts" must contain at most {self.max_request_texts} items, got {len(texts)}.'}
+
+        start = time.perf_counter()
+        probs = await self.batcher.submit(texts)
+        self.stats.record_request(time.perf_counter() - start, len(texts))
+        results = [
+            {
+                "probs": dict(zip(self.labels, row.tolist())),
+                "labels": [label for label, p in zip(self.labels, row) if p > 0.5],
+            }
+            for row in probs
+        ]
+        return 200, {"results": results}
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[int, dict[str, Any]]:
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "Use POST."}
+            return await self._predict(body)
+        if path == "/metrics":
+            return 200, self.stats.snapshot()
+        if path == "/health":
+            return 200, {"status": "ok"}
+        return 404, {"error": f"Unknown path <{path}>"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1つの接続でリクエストを順に処理する。Connection: closeが来るまで接続を使い回す"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, response = await self._route(method, path, body)
+                except Exception as ex:
+                    self.stats.errors += 1
+                    status, response = 500, {"error": repr(ex)}
+
+                data = json.dumps(response, ensure_ascii=False).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """サーバーを起動し、SIGINT/SIGTERMを受け取るまでリクエストを受け付ける"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        batch_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await stop.wait()
+            log.info("Shutting down...")
+        finally:
+            batch_task.cancel()
+            self.batcher.executor.shutdown(wait=False)
+
+
+@task_wrapper
+def serve(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
+    """チェックポイントとトークナイザを1回だけ読み込み、推論サーバーを起動する
+    停止(Ctrl+C、SIGTERM)されたら、起動からの集計値を返す
+
+    Args:
+        cfg (DictConfig): Hydraによって構成されたDictConfig
+
+    Returns:
+        tuple[dict[str, Any], dict[str, Any]]:
+    """
+    assert cfg.ckpt_path
+
+    if cfg.get("num_threads"):
+        torch.set_num_threads(cfg.num_threads)
+
+    log.info(f"Instantiating datamodule <{cfg.data._target_}>")
+    datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
+
+    log.info(f"Instantiating model <{cfg.model._target_}>")
+    model: LightningModule = load_model(cfg.model, cfg.ckpt_path)
+
+    tokenizer = BertJapaneseTokenizer.from_pretrained(cfg.data.model_name)
+    scorer = Scorer(model, tokenizer, cfg.data.max_length)
+    # 最初のリクエストで初期化のコストを払わないよう、起動時に1回推論しておく
+    scorer(["warmup"] * min(cfg.max_batch_size, 8))
+
+    object_dict = {
+        "cfg": cfg,
+        "datamodule": datamodule,
+        "model": model,
+    }
+
+    stats = LatencyStats(cfg.latency_window)
+    batcher = MicroBatcher(scorer, cfg.max_batch_size, cfg.max_wait_ms, stats)
+    server = ScoringServer(batcher, datamodule.label_vocab, stats, cfg.max_request_texts)
+    asyncio.run(server.serve(cfg.host, cfg.port))
+
+    metric_dict = stats.snapshot()
+    log.info(f"Served {metric_dict['requests']} requests! <{metric_dict}>")
+    return metric_dict, object_dict
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="serve.yaml")
+def main(cfg: DictConfig) -> None:
+    """推論サーバーのエントリーポイント
+
+    Args:
+        cfg (DictConfig): Hydraで構成されたDitConfig
+    """
+    extras(cfg)
+
+    serve(cfg)
+
+
+if __name__ == "__main__":
+    main()
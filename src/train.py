@@ -1,11 +1,7 @@
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import hydra
-import lightning.pytorch as L
 import rootutils
-import torch
-from lightning.pytorch import Callback, LightningDataModule, LightningModule, Trainer
-from lightning.pytorch.loggers import Logger
 from omegaconf import DictConfig
 
 rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
@@ -20,6 +16,10 @@ from src.utils import (
     task_wrapper,
 )
 
+if TYPE_CHECKING:
+    from lightning.pytorch import Callback, LightningDataModule, LightningModule, Trainer
+    from lightning.pytorch.loggers import Logger
+
 log = RankedLogger(__name__, rank_zero_only=True)
 
 @task_wrapper
@@ -33,6 +33,9 @@ def train(cfg: DictConfig) -> tuple[dict[str, Any], dict[str, Any]]:
     Returns:
         tuple[dict[str, Any], dict[str, Any]]: 
     """
+    # torchとLightningは学習を始めるときに読み込む(--helpや--cfgで設定を確認するだけなら読み込まない)
+    import lightning.pytorch as L
+
     # PyTorch, NumPy, Pythonの標準んライブラリの疑似乱数生成器に対してシードを設定する
     # -> 実験の再現性確保
     if cfg.get("seed"):
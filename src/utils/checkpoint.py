@@ -0,0 +1,100 @@
+import inspect
+import os
+from pathlib import Path
+from typing import Any, Mapping
+
+import hydra
+import torch
+from omegaconf import DictConfig
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from src.utils.pylogger import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+# 重みだけのチェックポイントの拡張子。Lightningのチェックポイント(.ckpt)と同じ場所に、拡張子だけ変えて置く
+WEIGHTS_SUFFIX = ".safetensors"
+
+
+def weights_path(ckpt_path: str | os.PathLike) -> Path:
+    """Lightningのチェックポイントに対応する、重みだけのチェックポイントのパス"""
+    return Path(ckpt_path).with_suffix(WEIGHTS_SUFFIX)
+
+
+def save_weights(
+    state_dict: Mapping[str, torch.Tensor],
+    path: str | os.PathLike,
+    half: bool = False,
+    metadata: Mapping[str, Any] | None = None,
+) -> None:
+    """state_dictをsafetensorsで書き出す。オプティマイザの状態などは含めない
+
+    Args:
+        state_dict: 書き出すモデルの重み
+        path: 書き出し先
+        half: 浮動小数点の重みをfloat16にして、ファイルを半分の大きさにする。読み込むときにモデルの型に戻す
+        metadata: ファイルに含める付加情報(エポック数など)。値は文字列にする
+    """
+    tensors = {}
+    for key, value in state_dict.items():
+        value = value.detach().cpu()
+        if half and value.is_floating_point():
+            value = value.half()
+        # safetensorsは連続したテンソルしか書き出せない
+        tensors[key] = value.contiguous()
+    metadata = {key: str(value) for key, value in (metadata or {}).items()}
+    metadata["dtype"] = "float16" if half else "float32"
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 書きかけのファイルを読まないように、一時ファイルに書いてから置き換える
+    tmp_path = path.with_suffix(".tmp")
+    save_file(tensors, tmp_path, metadata=metadata)
+    os.replace(tmp_path, path)
+
+
+def load_state_dict(path: str | os.PathLike) -> dict[str, torch.Tensor]:
+    """チェックポイントからモデルの重みを読み込む
+
+    safetensorsはメモリマップして読み込む。Lightningのチェックポイントもメモリマップするため、
+    オプティマイザの状態など、state_dict以外の部分はディスクから読まない
+
+    Args:
+        path: 重みだけのチェックポイント(.safetensors)またはLightningのチェックポイント(.ckpt)
+
+    Returns:
+        モデルのstate_dict
+    """
+    path = Path(path)
+    if path.suffix == WEIGHTS_SUFFIX:
+        with safe_open(path, framework="pt", device="cpu") as f:
+            return {key: f.get_tensor(key) for key in f.keys()}
+    # PyTorch 2.2のmmapはパスを文字列で渡す必要がある
+    checkpoint = torch.load(str(path), map_location="cpu", mmap=True)
+    return checkpoint["state_dict"]
+
+
+def load_model(model_cfg: DictConfig, ckpt_path: str | os.PathLike) -> torch.nn.Module:
+    """推論用にモデルを作り、チェックポイントの重みを読み込む
+
+    重みは全てチェックポイントから読み込むため、モデルが`pretrained`引数を持つ場合は
+    事前学習済みの重みを読み込まずに骨組みだけを作る。ckpt_pathに対応する.safetensorsがあればそれを優先する
+
+    Args:
+        model_cfg: モデルの設定
+        ckpt_path: チェックポイントのパス(.ckptまたは.safetensors)
+
+    Returns:
+        重みを読み込んだモデル
+    """
+    target = hydra.utils.get_class(model_cfg._target_)
+    kwargs = {"pretrained": False} if "pretrained" in inspect.signature(target).parameters else {}
+    model = hydra.utils.instantiate(model_cfg, **kwargs)
+
+    path = Path(ckpt_path)
+    if path.suffix != WEIGHTS_SUFFIX and weights_path(path).exists():
+        path = weights_path(path)
+    log.info(f"Loading weights from <{path}>")
+    model.load_state_dict(load_state_dict(path))
+    return model
@@ -1,10 +1,17 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 import hydra
-from lightning.pytorch import Callback
-from lightning.pytorch.loggers import Logger
 from omegaconf import DictConfig
 
 from src.utils import pylogger
 
+# Lightningは型注釈にだけ使い、設定のクラスをインスタンス化するときに初めて読み込まれるようにする
+if TYPE_CHECKING:
+    from lightning.pytorch import Callback
+    from lightning.pytorch.loggers import Logger
+
 log = pylogger.RankedLogger(__name__, rank_zero_only=True)
 
 def instantiate_callbacks(callbacks_cfg: DictConfig) -> list[Callback]:
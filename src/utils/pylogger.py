@@ -1,8 +1,17 @@
 import logging
+import os
 from typing import Mapping
 
 from lightning_utilities.core.rank_zero import rank_prefixed_message, rank_zero_only
 
+# rank_zero_only.rankはLightningをimportしたときに設定されるが、エントリーポイントではLightningを遅延してimportするため、
+# Lightningと同じ環境変数から先に設定しておく
+if getattr(rank_zero_only, "rank", None) is None:
+    rank_zero_only.rank = next(
+        (int(os.environ[key]) for key in ("RANK", "LOCAL_RANK", "SLURM_PROCID", "JSM_NAMESPACE_RANK") if key in os.environ),
+        0,
+    )
+
 class RankedLogger(logging.LoggerAdapter):
     def __init__(
         self,
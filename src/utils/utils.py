@@ -50,6 +50,10 @@ def task_wrapper(task_func: Callable) -> Callable:
             raise ex
         
         finally:
+            # バッファリングしているロガーのメトリクスを、失敗した場合も含めて書き出す
+            from src.loggers.buffered_mlflow import flush_all
+
+            flush_all()
             log.info(f"Output dir: {cfg.paths.output_dir}")
 
         return metric_dict, object_dict
@@ -78,3 +82,5 @@ def get_metric_value(metric_dict: dict[str, Any], metric_name: str | None) -> fl
 
     metric_value = metric_dict[metric_name].item()
     log.info(f"Retrieved metric value! <{metric_name}={metric_value}")
+
+    return metric_value
@@ -0,0 +1,4 @@
+import rootutils
+
+# テストからsrcとtests.helpersをimportできるようにする。ベンチマークもtests.helpersのデータやスタブを使う
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
@@ -0,0 +1,18 @@
+"""テストとベンチマークで使う、生データと同じ形式のDataFrameを作る"""
+import random
+
+import polars as pl
+
+SNIPPETS = [
+    "【要約】", "【課題】", "【解決手段】", "(修正有)", "（５７）", "(57)", "【選択図】図３", "【選択図】図12",
+    "\n", "画像認識装置は", "ニューラルネットワークを用いて", "ＡＢＣ１２３", "文字列を抽出する。", "ｶﾀｶﾅ",
+]
+FI = ["G06V30/14", "G06V30/19", "G06N3/08", "G06T7/00", "G06F16/35", "H04N1/00", "G06N20/00"]
+
+
+def make_frame(n_rows: int, seed: int = 0) -> pl.DataFrame:
+    """生データと同じ形式(要約とFIの列)のDataFrameを作る"""
+    rng = random.Random(seed)
+    summaries = ["".join(rng.choices(SNIPPETS, k=rng.randint(10, 60))) for _ in range(n_rows)]
+    fis = [",".join(rng.choices(FI + ["G06V30/14@A"], k=rng.randint(1, 8))) for _ in range(n_rows)]
+    return pl.DataFrame({"要約": summaries, "FI": fis})
@@ -0,0 +1,61 @@
+"""1プロセスとDDPの複数プロセスでBERTモジュールをテストし、評価指標を比べるための関数"""
+import time
+
+import torch
+from lightning.pytorch import Trainer, seed_everything
+
+from src.data.components.batching import pad_to_longest
+from src.data.patent_datamodule import PatentDataModule
+from src.models.bert_module import BertForSequenceClassificationMultiLabel_pl
+
+
+def make_datamodule(model_name: str, data_dir: str, batch_size: int) -> PatentDataModule:
+    """data_dir/processed.parquetを学習とテストの両方に使うデータモジュールを作る"""
+    return PatentDataModule(
+        model_name,
+        f"{data_dir}/processed.parquet",
+        f"{data_dir}/processed.parquet",
+        cache_dir=f"{data_dir}/cache",
+        batch_size=batch_size,
+        num_workers=0,
+    )
+
+
+def run_test(
+    model_name: str, data_dir: str, batch_size: int, processes: int, use_distributed_sampler: bool = True
+) -> tuple[dict[str, float], float]:
+    """processes個のプロセス(2以上ではddp_spawn)でテストし、評価指標と時間を返す"""
+    seed_everything(0, verbose=False)
+    model = BertForSequenceClassificationMultiLabel_pl(model_name, num_labels=1, lr=1e-3)
+    trainer = Trainer(
+        accelerator="cpu",
+        devices=processes,
+        strategy="ddp_spawn" if processes > 1 else "auto",
+        use_distributed_sampler=use_distributed_sampler,
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        default_root_dir=data_dir,
+    )
+    start = time.perf_counter()
+    metrics = trainer.test(model, make_datamodule(model_name, data_dir, batch_size), verbose=False)[0]
+    return metrics, time.perf_counter() - start
+
+
+def reference_accuracy(model_name: str, data_dir: str, batch_size: int) -> float:
+    """全件の予測を集めてから、全てのラベルが正解した文書の割合を求める"""
+    seed_everything(0, verbose=False)
+    model = BertForSequenceClassificationMultiLabel_pl(model_name, num_labels=1, lr=1e-3).eval()
+    datamodule = make_datamodule(model_name, data_dir, batch_size)
+    datamodule.prepare_data()
+    datamodule.setup("test")
+    dataset = datamodule.data_test
+    correct = []
+    with torch.inference_mode():
+        for start in range(0, len(dataset), batch_size):
+            batch = pad_to_longest(dataset.__getitems__(list(range(start, min(start + batch_size, len(dataset))))))
+            labels = batch.pop("labels")
+            logits = model.bert_scml(**batch).logits
+            correct.append(((logits > 0).int() == labels).all(-1))
+    return torch.cat(correct).float().mean().item()
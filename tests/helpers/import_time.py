@@ -0,0 +1,40 @@
+"""エントリーポイントを`-X importtime`で実行し、importの時間と読み込んだモジュールを調べる"""
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parents[2]
+
+# 設定のクラスをインスタンス化するときに初めて読み込まれるべきライブラリ
+HEAVY_MODULES = ("torch", "lightning", "transformers", "mlflow", "slack_sdk", "torchvision")
+
+# 重いライブラリを読み込まずに終わるべきコマンド
+COMMANDS = {
+    "train --help": ["src/train.py", "--help"],
+    "train --cfg job": ["src/train.py", "--cfg", "job"],
+    "eval --help": ["src/eval.py", "--help"],
+}
+
+
+def import_profile(args: list[str]) -> tuple[float, set[str], float]:
+    """コマンドを-X importtimeで実行し、importの合計時間(秒)、読み込んだモジュール、実行時間(秒)を返す"""
+    env = {**os.environ, "PROJECT_ROOT": str(ROOT)}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - start
+
+    total_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.add(name.strip())
+        # インデントのない行が最上位のimportで、その累積時間の合計が全体の時間になる
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1e6, modules, elapsed
@@ -0,0 +1,18 @@
+"""Slackに送信せずに通知を記録するWebClientのスタブ"""
+import threading
+import time
+
+
+class StubWebClient:
+    """応答にdelay秒かかるSlackのWebClientのスタブ"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.messages: list[str] = []
+        self.lock = threading.Lock()
+
+    def chat_postMessage(self, channel: str, text: str) -> dict:
+        time.sleep(self.delay)
+        with self.lock:
+            self.messages.append(text)
+        return {"message": {"text": text}}
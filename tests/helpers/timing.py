@@ -0,0 +1,20 @@
+"""学習ループの時間を測るCallback"""
+import time
+
+from lightning.pytorch import Callback
+
+
+class EpochTimer(Callback):
+    """各エポックの学習にかかった時間(秒)を記録する
+
+    on_train_epoch_endで同期的に処理するCallbackの時間も含めるには、callbacksの最後に置く
+    """
+
+    def __init__(self) -> None:
+        self.times: list[float] = []
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self.start = time.perf_counter()
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        self.times.append(time.perf_counter() - self.start)
@@ -0,0 +1,28 @@
+import pytest
+import torch
+
+from src.models.bert_module import build_metrics
+
+
+@pytest.mark.parametrize("num_labels", [1, 3])
+def test_thresholds_are_not_merged_after_first_batch(num_labels: int) -> None:
+    metrics = build_metrics(num_labels)
+    labels = torch.ones(2, num_labels, dtype=torch.int)
+    # 最初のバッチではt50とt70の状態が一致するが、2つ目のバッチで分かれる
+    metrics.update(torch.full((2, num_labels), 0.2), labels)
+    metrics.update(torch.full((2, num_labels), 0.6), labels)
+
+    results = metrics.compute()
+    assert results["recall_t50"] == pytest.approx(0.5)
+    assert results["recall_t70"] == pytest.approx(0.0)
+
+
+def test_metrics_match_single_update() -> None:
+    preds = torch.tensor([[0.1], [0.4], [0.6], [0.8], [0.9]])
+    labels = torch.tensor([[0], [1], [1], [0], [1]])
+    batched, single = build_metrics(1), build_metrics(1)
+    for start in range(0, 5, 2):
+        batched.update(preds[start:start + 2], labels[start:start + 2])
+    single.update(preds, labels)
+
+    assert batched.compute() == pytest.approx(single.compute())
@@ -0,0 +1,38 @@
+import polars as pl
+import pytest
+
+from src.data.data import clean_text, clean_text_expr, extract_dataframe, fi_list_expr, get_fi_list
+from tests.helpers.data import make_frame
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "(57)【要約】【課題】画像を認識する。【解決手段】ニューラルネットワークを用いる。【選択図】図３",
+        "（５７）【要約】(修正有)\n【課題】ＡＢＣ１２３を抽出する。\n【選択図】図12",
+        "ｶﾀｶﾅの(1)(23)括弧と【選択図】図",
+        "",
+    ],
+)
+def test_clean_text_expr_matches_clean_text(text: str) -> None:
+    actual = pl.select(clean_text_expr(pl.lit(text))).item()
+    assert actual == clean_text(text)
+
+
+def test_extract_dataframe_matches_map_elements() -> None:
+    df = make_frame(2000)
+    expected = df.select(
+        pl.col("要約").map_elements(clean_text, return_dtype=pl.String).alias("summary"),
+        pl.col("FI").map_elements(get_fi_list, return_dtype=pl.String).alias("FI"),
+    )
+    actual = extract_dataframe(df)
+
+    assert actual["summary"].to_list() == expected["summary"].to_list()
+    # get_fi_listはsetで重複を除くため並び順が不定なので、集合として比べる
+    for e, a in zip(expected["FI"], actual["FI"]):
+        assert sorted(e.split(", ")) == sorted(a.split(", "))
+
+
+def test_fi_list_expr_keeps_first_occurrence_order() -> None:
+    fi = "G06N3/08,G06V30/14,G06N3/04,H04N1/00@A,G06T7"
+    assert pl.select(fi_list_expr(pl.lit(fi))).item() == "G06N3, G06V30, H04N1"
@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import hydra
+import numpy as np
+import pytest
+import torch
+from hydra import compose, initialize_config_dir
+from lightning.pytorch.strategies import DDPStrategy
+from torch.utils.data import DistributedSampler
+
+from src.data.components.batching import LengthBucketBatchSampler
+from src.data.components.distributed import distributed_sampler, injects_distributed_sampler
+from src.data.data import extract_dataframe
+from tests.helpers.data import SNIPPETS, make_frame
+from tests.helpers.distributed import make_datamodule, reference_accuracy, run_test
+
+CONFIG_DIR = Path(__file__).parents[1] / "configs"
+
+
+def shards(num_replicas: int, **kwargs) -> list[list[list[int]]]:
+    """ランクごとのバッチの並びを返す"""
+    lengths = np.random.default_rng(0).integers(1, 64, 103)
+    return [
+        list(LengthBucketBatchSampler(lengths, 8, num_replicas=num_replicas, rank=rank, bucket_size=2, **kwargs))
+        for rank in range(num_replicas)
+    ]
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("num_replicas", [1, 2, 3])
+def test_length_bucket_shards_are_disjoint_without_even_shards(num_replicas: int, shuffle: bool) -> None:
+    batches = shards(num_replicas, shuffle=shuffle, even_shards=False)
+
+    indices = [i for rank in batches for batch in rank for i in batch]
+    assert sorted(indices) == list(range(103))
+    lengths = np.random.default_rng(0).integers(1, 64, 103)
+    for rank, rank_batches in enumerate(batches):
+        sampler = LengthBucketBatchSampler(lengths, 8, shuffle, num_replicas=num_replicas, rank=rank, even_shards=False)
+        assert len(rank_batches) == len(sampler)
+
+
+@pytest.mark.parametrize("num_replicas", [2, 3, 5])
+def test_length_bucket_even_shards_have_same_length(num_replicas: int) -> None:
+    batches = shards(num_replicas, shuffle=True, even_shards=True)
+
+    # 13バッチを揃えるため、足りないランクは先頭のバッチを繰り返す
+    assert {len(rank) for rank in batches} == {-(-13 // num_replicas)}
+    assert {i for rank in batches for batch in rank for i in batch} == set(range(103))
+
+
+def test_distributed_sampler_is_none_for_single_process() -> None:
+    assert distributed_sampler(list(range(10)), None, shuffle=True) is None
+    assert not injects_distributed_sampler(None)
+
+
+def test_training_sampler_pads_ranks_to_same_length() -> None:
+    samplers = [DistributedSampler(list(range(11)), num_replicas=2, rank=rank, shuffle=True, seed=0) for rank in (0, 1)]
+
+    assert [len(list(sampler)) for sampler in samplers] == [6, 6]
+    assert set(samplers[0]) | set(samplers[1]) == set(range(11))
+
+
+def test_ddp_cpu_config(tmp_path: Path) -> None:
+    with initialize_config_dir(str(CONFIG_DIR), version_base="1.3"):
+        cfg = compose("train", overrides=["trainer=ddp_cpu", f"trainer.default_root_dir={tmp_path}"])
+    trainer = hydra.utils.instantiate(cfg.trainer, logger=False)
+
+    assert isinstance(trainer.strategy, DDPStrategy)
+    assert trainer.strategy._process_group_backend == "gloo"
+    assert trainer.world_size == 2
+    # データモジュールが系列長のバケットをランクごとに分ける
+    assert not injects_distributed_sampler(trainer)
+
+
+@pytest.fixture(scope="module")
+def tiny_bert(tmp_path_factory) -> Path:
+    """テスト用の小さなBERTとトークナイザを保存したディレクトリ"""
+    from transformers import BertConfig, BertJapaneseTokenizer, BertModel
+
+    path = tmp_path_factory.mktemp("tiny_bert")
+    chars = sorted({c for snippet in SNIPPETS for c in snippet if not c.isspace()})
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *chars, *(f"##{c}" for c in chars)]
+    (path / "vocab.txt").write_text("\n".join(vocab) + "\n")
+    BertJapaneseTokenizer(path / "vocab.txt", mecab_kwargs={"mecab_dic": "unidic_lite"}).save_pretrained(path)
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64
+    )
+    BertModel(config).save_pretrained(path)
+    return path
+
+
+@pytest.mark.slow
+def test_ddp_spawn_test_metrics_match_single_process(tiny_bert: Path, tmp_path: Path) -> None:
+    """2プロセス(gloo)でテストしても、1プロセスと同じ評価指標になる"""
+    model_name, data_dir = str(tiny_bert), str(tmp_path)
+    # プロセス数で割り切れず、最後のバッチも小さくなる件数にする
+    make_frame(101).pipe(extract_dataframe).write_parquet(tmp_path / "processed.parquet")
+    make_datamodule(model_name, data_dir, 16).prepare_data()
+
+    expected, _ = run_test(model_name, data_dir, 16, 1)
+    assert expected["accuracy"] == pytest.approx(reference_accuracy(model_name, data_dir, 16), abs=1e-6)
+    for use_distributed_sampler in (True, False):
+        metrics, _ = run_test(model_name, data_dir, 16, 2, use_distributed_sampler)
+        assert metrics == pytest.approx(expected, abs=1e-6)
@@ -0,0 +1,25 @@
+from pathlib import Path
+
+import pytest
+from lightning.pytorch.loggers import CSVLogger
+
+from src.export import log_export
+from src.loggers.buffered_mlflow import BufferedMLFlowLogger, flush_all
+
+
+def test_log_export_attaches_artifacts_to_buffered_mlflow_run(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from mlflow.tracking import MlflowClient
+
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    tracking_uri = f"file:{tmp_path / 'mlruns'}"
+    mlflow_logger = BufferedMLFlowLogger(experiment_name="export", tracking_uri=tracking_uri, flush_interval=60.0)
+    artifact = tmp_path / "model_int8.pt"
+    artifact.write_bytes(b"model")
+
+    log_export([CSVLogger(tmp_path), mlflow_logger], {"export/int8/accuracy": 0.75}, [artifact])
+    # task_wrapperの終了時と同じく、溜まったメトリクスを書き出す
+    flush_all()
+
+    client = MlflowClient(tracking_uri)
+    assert client.get_run(mlflow_logger.run_id).data.metrics == {"export/int8/accuracy": 0.75}
+    assert [a.path for a in client.list_artifacts(mlflow_logger.run_id)] == ["model_int8.pt"]
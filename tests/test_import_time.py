@@ -0,0 +1,14 @@
+import pytest
+
+from tests.helpers.import_time import COMMANDS, HEAVY_MODULES, import_profile
+
+# importの合計時間の上限(秒)。手元の計測値は400ms前後で、torchを読み込むとこれを大きく超える
+BUDGET = 1.0
+
+
+@pytest.mark.parametrize("command", COMMANDS.values(), ids=COMMANDS.keys())
+def test_entrypoint_does_not_import_heavy_modules(command: list[str]) -> None:
+    import_time, modules, _ = min(import_profile(command) for _ in range(2))
+
+    assert not modules & set(HEAVY_MODULES)
+    assert import_time < BUDGET
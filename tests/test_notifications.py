@@ -0,0 +1,108 @@
+from lightning.pytorch import Trainer
+from lightning.pytorch.demos.boring_classes import BoringModel
+
+from src.callbacks.notifications import SlackNotificationCallback
+from tests.helpers.slack import StubWebClient
+from tests.helpers.timing import EpochTimer
+
+DELAY = 0.3
+EPOCHS = 4
+
+
+class FailingWebClient(StubWebClient):
+    """最初の送信だけ接続エラーになるスタブ"""
+
+    def __init__(self, delay: float) -> None:
+        super().__init__(delay)
+        self.failed = False
+
+    def chat_postMessage(self, channel: str, text: str) -> dict:
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError("timed out")
+        return super().chat_postMessage(channel, text)
+
+
+def fit(callback: SlackNotificationCallback, tmp_path) -> EpochTimer:
+    timer = EpochTimer()
+    trainer = Trainer(
+        max_epochs=EPOCHS,
+        limit_train_batches=2,
+        limit_val_batches=0,
+        accelerator="cpu",
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        default_root_dir=tmp_path,
+        callbacks=[callback, timer],
+    )
+    trainer.fit(BoringModel())
+    return timer
+
+
+def test_all_notifications_are_sent_without_blocking_epochs(tmp_path) -> None:
+    callback = SlackNotificationCallback("xoxb-dummy", "#test", min_interval=DELAY)
+    callback.client = StubWebClient(DELAY)
+    timer = fit(callback, tmp_path)
+
+    # teardownで送り切るため、まとめられたメッセージに全エポックの通知が含まれる
+    sent = "\n".join(callback.client.messages)
+    assert "学習が開始しました" in sent
+    assert sent.count("epochまで終了しました") == EPOCHS
+    assert "学習が終了しました" in sent
+    assert len(callback.client.messages) < EPOCHS + 2
+    # Slackの応答を待たずにエポックが進む
+    assert max(timer.times) < DELAY / 2
+    assert not callback._worker.is_alive()
+
+
+def test_send_error_does_not_stop_worker(tmp_path) -> None:
+    callback = SlackNotificationCallback("xoxb-dummy", "#test", min_interval=0.0)
+    callback.client = FailingWebClient(0.0)
+    fit(callback, tmp_path)
+
+    # 最初のメッセージは失われるが、その後の通知は送られる
+    assert "学習が終了しました" in "\n".join(callback.client.messages)
+
+
+def test_full_queue_drops_oldest_message() -> None:
+    callback = SlackNotificationCallback("xoxb-dummy", "#test", max_queue_size=2)
+    for text in ["a", "b", "c"]:
+        callback._enqueue(text)
+
+    assert callback.dropped == 1
+    assert list(callback._queue) == ["b", "c"]
+
+
+def test_flush_stops_worker_even_when_queue_is_full() -> None:
+    callback = SlackNotificationCallback("xoxb-dummy", "#test", min_interval=0.0, max_queue_size=2)
+    callback.client = StubWebClient(0.1)
+    callback._start()
+    for text in ["a", "b", "c", "d"]:
+        callback._enqueue(text)
+    callback.flush()
+
+    # 停止の要求はメッセージと違って捨てられない
+    assert not callback._worker.is_alive()
+    assert callback.client.messages[-1].endswith("d")
+
+
+def test_worker_is_reused_after_flush_timeout() -> None:
+    callback = SlackNotificationCallback("xoxb-dummy", "#test", min_interval=0.0, flush_timeout=0.05)
+    callback.client = StubWebClient(0.3)
+    callback._start()
+    callback._enqueue("first")
+    callback.flush()
+    worker = callback._worker
+    assert worker.is_alive()
+
+    # 送信中のスレッドを使い続け、2つ目のスレッドを起動しない
+    callback._start()
+    callback._enqueue("second")
+    assert callback._worker is worker
+    callback.flush_timeout = 5.0
+    callback.flush()
+
+    assert not worker.is_alive()
+    assert "\n".join(callback.client.messages).split("\n") == ["first", "second"]
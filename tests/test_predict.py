@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from src.data.data import clean_text
+from src.predict import iter_chunks
+from tests.helpers.data import make_frame
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def input_path(request, tmp_path: Path) -> Path:
+    path = tmp_path / f"input.{request.param}"
+    df = make_frame(250).with_row_index("id").with_columns(pl.col("id").cast(pl.String))
+    if request.param == "csv":
+        df.write_csv(path)
+    else:
+        df.write_parquet(path)
+    return path
+
+
+def test_iter_chunks_splits_input_into_fixed_size_chunks(input_path: Path) -> None:
+    chunks = list(iter_chunks(str(input_path), 100))
+
+    assert [i for i, _ in chunks] == [0, 1, 2]
+    assert [len(chunk) for _, chunk in chunks] == [100, 100, 50]
+    frame = pl.concat([chunk for _, chunk in chunks])
+    assert frame["id"].to_list() == [str(i) for i in range(250)]
+    assert frame["summary"].to_list() == [clean_text(text) for text in make_frame(250)["要約"]]
+
+
+def test_iter_chunks_skips_written_chunks(input_path: Path) -> None:
+    chunks = list(iter_chunks(str(input_path), 100, skip=lambda i: i != 1))
+
+    assert [i for i, _ in chunks] == [1]
+    assert chunks[0][1]["id"].to_list() == [str(i) for i in range(100, 200)]
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import pytest
+
+from src.data.data import process_incremental, read_processed
+from tests.helpers.data import make_frame
+
+YEARS = ["2022", "2023", "2024"]
+
+
+@pytest.fixture
+def raw_dir(tmp_path: Path) -> Path:
+    raw_dir = tmp_path / "raw"
+    raw_dir.mkdir()
+    for i, year in enumerate(YEARS):
+        make_frame(50, seed=i).write_csv(raw_dir / f"patent_deeplearning_{year}.csv")
+    return raw_dir
+
+
+def test_incremental_rebuilds_only_changed_years(raw_dir: Path, tmp_path: Path) -> None:
+    processed_dir = tmp_path / "processed"
+    assert process_incremental(raw_dir, processed_dir, YEARS, ["2024"])["rebuilt"] == YEARS
+    assert process_incremental(raw_dir, processed_dir, YEARS, ["2024"])["rebuilt"] == []
+
+    make_frame(30, seed=10).write_csv(raw_dir / "patent_deeplearning_2024.csv")
+    assert process_incremental(raw_dir, processed_dir, YEARS, ["2024"])["rebuilt"] == ["2024"]
+    assert len(read_processed(processed_dir / "test")) == 30
+    assert len(read_processed(processed_dir / "train")) == 130
+
+
+def test_test_year_outside_years_is_rejected(raw_dir: Path, tmp_path: Path) -> None:
+    processed_dir = tmp_path / "processed"
+    process_incremental(raw_dir, processed_dir, YEARS, ["2024"])
+
+    with pytest.raises(ValueError, match=r"test_years \['2024'\] are not in years"):
+        process_incremental(raw_dir, processed_dir, YEARS[:2], ["2024"])
+    # 出力は前回のまま残る
+    assert (processed_dir / "train" / "year=2024").exists()
+    assert len(read_processed(processed_dir / "test")) == 50
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from src.runs import RunCache, query
+
+
+@pytest.fixture
+def client(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    from mlflow.tracking import MlflowClient
+
+    # 新しいMLflowはファイルストアの使用に明示的なオプトインを求める
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    return MlflowClient(f"file:{tmp_path / 'mlruns'}")
+
+
+def test_sync_keeps_time_named_params_and_tags_as_strings(client, tmp_path: Path) -> None:
+    experiment_id = client.create_experiment("runs")
+    run = client.create_run(experiment_id, tags={"sync_time": "yesterday"})
+    client.log_param(run.info.run_id, "trainer/max_time", "00:01:00:00")
+    client.log_metric(run.info.run_id, "val_loss", 0.5)
+    client.set_terminated(run.info.run_id)
+
+    cache = RunCache(tmp_path / "cache", client)
+    assert cache.sync(cache.experiment_ids(["runs"], refresh=True)) == {experiment_id: 1}
+
+    df = cache.load([experiment_id])
+    assert df.schema["start_time"] == pl.Int64
+    assert df.schema["end_time"] == pl.Int64
+    assert df.schema["params.trainer/max_time"] == pl.String
+    assert df.schema["tags.sync_time"] == pl.String
+    assert df["params.trainer/max_time"].to_list() == ["00:01:00:00"]
+    assert query(df).schema["start_time"] == pl.Datetime("ms")
+
+
+def test_experiment_ids_require_sync(tmp_path: Path) -> None:
+    with pytest.raises(ValueError, match="not cached"):
+        RunCache(tmp_path / "cache").experiment_ids(["runs"])
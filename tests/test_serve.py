@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import numpy as np
+
+from src.serve import LatencyStats, MicroBatcher, ScoringServer
+
+
+class RecordingScorer:
+    """テキストの末尾の数値を確率として返し、推論したバッチの大きさを記録するスタブ"""
+
+    def __init__(self) -> None:
+        self.batch_sizes: list[int] = []
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        self.batch_sizes.append(len(texts))
+        return np.array([[float(text.split("-")[1])] for text in texts])
+
+
+def make_server(scorer: RecordingScorer, max_batch_size: int = 8, max_request_texts: int = 100) -> ScoringServer:
+    stats = LatencyStats()
+    return ScoringServer(MicroBatcher(scorer, max_batch_size, 5, stats), ["G06V30"], stats, max_request_texts)
+
+
+async def predict(server: ScoringServer, *requests: list[str]) -> list[tuple[int, dict]]:
+    batch_task = asyncio.create_task(server.batcher.run())
+    try:
+        return await asyncio.gather(*(server._predict(json.dumps({"texts": texts}).encode()) for texts in requests))
+    finally:
+        batch_task.cancel()
+
+
+def test_large_requests_are_split_into_max_batch_size() -> None:
+    scorer = RecordingScorer()
+    server = make_server(scorer)
+    requests = [[f"t-{i}" for i in range(start, start + n)] for start, n in [(0, 20), (100, 3), (200, 7)]]
+
+    responses = asyncio.run(predict(server, *requests))
+
+    assert max(scorer.batch_sizes) <= 8
+    assert sum(scorer.batch_sizes) == 30
+    for texts, (status, body) in zip(requests, responses):
+        assert status == 200
+        assert [r["probs"]["G06V30"] for r in body["results"]] == [float(t.split("-")[1]) for t in texts]
+
+
+def test_request_over_limit_is_rejected() -> None:
+    scorer = RecordingScorer()
+    server = make_server(scorer, max_request_texts=10)
+
+    [(status, body)] = asyncio.run(predict(server, [f"t-{i}" for i in range(11)]))
+
+    assert status == 400
+    assert "at most 10" in body["error"]
+    assert scorer.batch_sizes == []